@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+离线批量分析入口
+读取 JSONL 任务文件（每行 {image_path, prompt, params}），经与 MCP 服务器相同的预处理和 GLM 客户端路径并发分析，
+结果逐行写入输出 JSONL；输出文件即检查点，重新运行时先整理输出（每行只保留一条记录），再跳过已完成的行
+
+用法: python -m bulk_runner jobs.jsonl results.jsonl [--concurrency 4] [--rate 2] [--order input|completed]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Any, Optional, Iterator, Tuple, Set
+
+from config import config
+from logger import logger
+from image_processor import image_processor
+from usage_meter import BudgetExceededError
+
+
+class RateLimiter:
+    """线程安全的请求速率限制（按固定最小间隔放行）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class BulkRunner:
+    """JSONL 批量分析执行器"""
+
+    def __init__(self, client: Any, concurrency: int = 4, rate: float = 0.0, retries: int = 2,
+                 analyze: Optional[Callable[[str, str, float, int], str]] = None):
+        """
+        Args:
+            analyze: 分析函数 (data URL, 提示, temperature, max_tokens) -> 回复，应经过令牌预算、计量与共享速率限制；
+                默认直接调用 client.analyze_image
+        """
+        self.client = client
+        self.analyze = analyze or client.analyze_image
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = RateLimiter(rate)
+        self.retries = max(retries, 0)
+
+    @staticmethod
+    def read_jobs(input_path: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+        """逐行读取任务，返回 (行号, 任务, 解析错误)，行号从 1 开始，空行跳过"""
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f"JSON 解析失败: {e}"
+                    continue
+                if not isinstance(job, dict) or not job.get('image_path') or not job.get('prompt'):
+                    yield line_number, None, "缺少 image_path 或 prompt"
+                    continue
+                yield line_number, job, None
+
+    @staticmethod
+    def compact_output(output_path: str, keep_errors: bool = False) -> Set[int]:
+        """
+        整理已有输出并返回成功完成的行号
+
+        每个行号只保留一条记录（成功记录优先，同类取最后一条），按行号即输入顺序原子重写；
+        无法解析的行（如上次运行中断时写了一半的末行）丢弃。keep_errors 为 False 时去掉失败记录，
+        以便重新执行的结果不与旧记录重复
+        """
+        records: Dict[int, Tuple[bool, str]] = {}
+        try:
+            with open(output_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        line_number = int(record['line'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    success = 'error' not in record
+                    if not success and (not keep_errors or records.get(line_number, (False,))[0]):
+                        continue
+                    records[line_number] = (success, json.dumps(record, ensure_ascii=False))
+        except FileNotFoundError:
+            return set()
+
+        temp_path = f"{output_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for line_number in sorted(records):
+                f.write(records[line_number][1] + '\n')
+        os.replace(temp_path, output_path)
+        return {line_number for line_number, (success, _) in records.items() if success}
+
+    def prepare_image(self, job: Dict[str, Any]) -> str:
+        """按任务参数预处理图像，返回 data URL"""
+        params = job.get('params') or {}
+        crop = params.get('crop')
+        if crop is not None:
+            region = image_processor.crop_region(job['image_path'], tuple(crop), int(params.get('target_size', 1024)))
+            if not region:
+                raise ValueError("区域裁剪失败，请检查 crop 参数")
+            return region['base64']
+        image_data_url = image_processor.encode_image_to_base64(job['image_path'])
+        if not image_data_url:
+            raise ValueError("图像文件不存在、格式不支持或编码失败")
+        return image_data_url
+
+    def run_job(self, line_number: int, job: Dict[str, Any]) -> Dict[str, Any]:
+        """执行单个任务，模型调用失败时按指数退避重试"""
+        record: Dict[str, Any] = {'line': line_number, 'image_path': job['image_path']}
+        if 'id' in job:
+            record['id'] = job['id']
+        params = job.get('params') or {}
+        started = time.time()
+        try:
+            image_data_url = self.prepare_image(job)
+            for attempt in range(self.retries + 1):
+                self.rate_limiter.acquire()
+                try:
+                    record['result'] = self.analyze(
+                        image_data_url, job['prompt'],
+                        params.get('temperature', 0.8), params.get('max_tokens', 1000)
+                    )
+                    break
+                except BudgetExceededError:
+                    raise
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(f"第 {line_number} 行模型调用失败，重试 {attempt + 1}/{self.retries}: {e}")
+                    time.sleep(2 ** attempt)
+        except Exception as e:
+            record['error'] = str(e)
+        record['elapsed'] = round(time.time() - started, 3)
+        return record
+
+    def run(self, input_path: str, output_path: str, ordered: bool = True) -> Dict[str, Any]:
+        """
+        执行批量任务并追加写入输出文件
+
+        ordered 为 True 时按输入顺序输出（先完成的结果暂存），否则按完成顺序输出；
+        在途任务与暂存结果合计不超过并发数的两倍，避免一次性读入全部任务，
+        也避免某个慢任务阻塞输出时暂存结果无限增长。续跑时追加的结果排在旧结果之后，
+        按输入顺序输出时结束后再整理一次，使整个文件恢复输入顺序
+        """
+        resumed = os.path.exists(output_path)
+        completed = self.compact_output(output_path)
+        if completed:
+            logger.info(f"从检查点恢复: 已完成 {len(completed)} 行")
+
+        stats = {'written': 0, 'failed': 0, 'skipped': len(completed)}
+        buffered: Dict[int, Dict[str, Any]] = {}
+        order: deque = deque()
+        max_in_flight = self.concurrency * 2
+        started = time.time()
+
+        with open(output_path, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            def write(record: Dict[str, Any]):
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                stats['written'] += 1
+                stats['failed'] += 'error' in record
+
+            def collect(done_futures):
+                for future in done_futures:
+                    record = future.result()
+                    if ordered:
+                        buffered[record['line']] = record
+                    else:
+                        write(record)
+                # 输入顺序模式下只写出连续完成的前缀
+                while ordered and order and order[0] in buffered:
+                    write(buffered.pop(order.popleft()))
+
+            in_flight = set()
+            for line_number, job, error in self.read_jobs(input_path):
+                if line_number in completed:
+                    continue
+                order.append(line_number)
+                if error:
+                    future = executor.submit(lambda n=line_number, e=error: {'line': n, 'error': e})
+                else:
+                    future = executor.submit(self.run_job, line_number, job)
+                in_flight.add(future)
+                # 输入顺序模式下暂存的结果也占用名额，队首任务未完成时停止提交
+                while in_flight and len(in_flight) + len(buffered) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        if ordered and resumed:
+            self.compact_output(output_path, keep_errors=True)
+
+        stats['elapsed'] = round(time.time() - started, 2)
+        logger.info(f"批量分析完成: 写入 {stats['written']}（失败 {stats['failed']}），跳过 {stats['skipped']}，耗时 {stats['elapsed']}s")
+        return stats
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="离线批量分析 JSONL 任务文件（支持断点续跑）")
+    parser.add_argument("input", help="任务 JSONL 文件，每行 {image_path, prompt, params}")
+    parser.add_argument("output", help="结果 JSONL 文件（已存在时跳过其中已完成的行）")
+    parser.add_argument("--concurrency", type=int, default=config.bulk_concurrency, help="并发请求数")
+    parser.add_argument("--rate", type=float, default=config.bulk_rate_limit, help="每秒最大请求数（0 表示不限制）")
+    parser.add_argument("--retries", type=int, default=2, help="模型调用失败的重试次数")
+    parser.add_argument("--order", choices=["input", "completed"], default="input", help="输出顺序：按输入顺序或按完成顺序")
+    args = parser.parse_args()
+    image_processor.configure(config)
+
+    from glm_client import create_glm_client, create_metered_analyzer
+
+    client = create_glm_client()
+    if client is None:
+        sys.exit(1)
+
+    runner = BulkRunner(client, concurrency=args.concurrency, rate=args.rate, retries=args.retries,
+                        analyze=create_metered_analyzer(client))
+    try:
+        stats = runner.run(args.input, args.output, ordered=args.order == "input")
+    except KeyboardInterrupt:
+        logger.info("批量分析被用户中断，重新运行同一命令即可续跑")
+        sys.exit(130)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from typing import Optional, List, Dict, Any
 
 try:
@@ -100,6 +101,51 @@ class Config:
     def glm_api_base(self) -> str:
         return os.getenv('GLM_API_BASE', 'https://open.bigmodel.cn/api/paas/v4')
     
+    @property
+    def glm_light_model(self) -> str:
+        return os.getenv('GLM_LIGHT_MODEL', '').strip()
+    
+    @property
+    def route_max_image_kb(self) -> int:
+        return max(self._get_int_env('GLM_ROUTE_MAX_IMAGE_KB', 300), 0)
+    
+    @property
+    def route_max_prompt_chars(self) -> int:
+        return max(self._get_int_env('GLM_ROUTE_MAX_PROMPT_CHARS', 200), 0)
+    
+    @property
+    def route_max_tokens(self) -> int:
+        return max(self._get_int_env('GLM_ROUTE_MAX_TOKENS', 512), 0)
+    
+    @property
+    def route_latency_threshold(self) -> float:
+        return max(self._get_float_env('GLM_ROUTE_LATENCY_THRESHOLD', 15.0), 0.0)
+    
+    @property
+    def glm_api_keys(self) -> List[str]:
+        """密钥池：GLM_API_KEYS（逗号分隔）优先，未设置时使用 GLM_API_KEY"""
+        keys = self._get_list_env('GLM_API_KEYS')
+        if not keys and self.glm_api_key:
+            keys = [self.glm_api_key]
+        return keys
+    
+    @property
+    def glm_api_bases(self) -> List[str]:
+        """与密钥池对应的 API 地址（数量不足时循环使用），未设置时均使用 GLM_API_BASE"""
+        return self._get_list_env('GLM_API_BASES') or [self.glm_api_base]
+    
+    @property
+    def key_concurrency(self) -> int:
+        return max(self._get_int_env('GLM_KEY_CONCURRENCY', 4), 1)
+    
+    @property
+    def key_tokens_per_minute(self) -> int:
+        return max(self._get_int_env('GLM_KEY_TPM', 0), 0)
+    
+    @property
+    def key_rest_seconds(self) -> float:
+        return max(self._get_float_env('GLM_KEY_REST_SECONDS', 30.0), 1.0)
+    
     @property
     def glm_image_model(self) -> str:
         return os.getenv('GLM_IMAGE_MODEL', 'glm-4.6v')
@@ -108,13 +154,337 @@ class Config:
     def log_level(self) -> str:
         return os.getenv('LOG_LEVEL', 'INFO')
     
+    @property
+    def image_url_allowlist(self) -> List[str]:
+        """允许直接转发的图像 URL 主机（逗号分隔，支持 *.example.com，为空时不限制）"""
+        return self._get_list_env('GLM_IMAGE_URL_ALLOWLIST')
+    
+    @property
+    def image_url_probe(self) -> bool:
+        """转发图像 URL 前是否先做 HEAD/Range 预检"""
+        return self._get_bool_env('GLM_IMAGE_URL_PROBE', False)
+    
+    @property
+    def image_url_fallback(self) -> bool:
+        """上游无法访问图像 URL 时是否回退为本地下载内联"""
+        return self._get_bool_env('GLM_IMAGE_URL_FALLBACK', True)
+    
+    @property
+    def image_url_allow_private(self) -> bool:
+        """预检与下载回退是否允许访问回环、私有等非公网地址（默认拒绝）"""
+        return self._get_bool_env('GLM_IMAGE_URL_ALLOW_PRIVATE', False)
+    
+    @property
+    def image_url_timeout(self) -> float:
+        return self._get_float_env('GLM_IMAGE_URL_TIMEOUT', 10.0)
+    
+    @property
+    def phash_cache_enabled(self) -> bool:
+        """是否对近似重复图像复用历史分析结果"""
+        return self._get_bool_env('GLM_PHASH_CACHE', False)
+    
+    @property
+    def phash_max_distance(self) -> int:
+        """判定为近似重复的最大汉明距离（64 位 dHash）"""
+        return self._get_int_env('GLM_PHASH_MAX_DISTANCE', 4)
+    
+    @property
+    def phash_cache_size(self) -> int:
+        return self._get_int_env('GLM_PHASH_CACHE_SIZE', 1024)
+    
+    @property
+    def tile_size(self) -> int:
+        """分块模式下每块的边长（像素，按原始分辨率切分）"""
+        return self._get_int_env('GLM_TILE_SIZE', 1024)
+    
+    @property
+    def tile_overlap(self) -> int:
+        return self._get_int_env('GLM_TILE_OVERLAP', 128)
+    
+    @property
+    def tile_parallelism(self) -> int:
+        """分块模式下并发请求数"""
+        return max(self._get_int_env('GLM_TILE_PARALLELISM', 4), 1)
+    
+    @property
+    def tile_max_file_size(self) -> int:
+        """分块模式允许的最大文件大小（字节，环境变量单位为 MB）"""
+        return self._get_int_env('GLM_TILE_MAX_FILE_SIZE_MB', 100) * 1024 * 1024
+    
+    @property
+    def zoom_overview_size(self) -> int:
+        """缩放模式首轮总览图的长边（像素）"""
+        return self._get_int_env('GLM_ZOOM_OVERVIEW_SIZE', 512)
+    
+    @property
+    def zoom_detail_size(self) -> int:
+        """缩放模式细节裁剪图的长边（像素）"""
+        return self._get_int_env('GLM_ZOOM_DETAIL_SIZE', 1024)
+    
+    @property
+    def zoom_max_regions(self) -> int:
+        return max(self._get_int_env('GLM_ZOOM_MAX_REGIONS', 4), 1)
+    
+    @property
+    def zoom_max_rounds(self) -> int:
+        """缩放模式最多追加的细节轮数"""
+        return max(self._get_int_env('GLM_ZOOM_MAX_ROUNDS', 2), 1)
+    
+    @property
+    def frame_samples(self) -> int:
+        """动画关键帧模式最多抽取的帧数"""
+        return max(self._get_int_env('GLM_FRAME_SAMPLES', 6), 1)
+    
+    @property
+    def frame_min_distance(self) -> int:
+        """判定场景变化的最小 dHash 汉明距离"""
+        return self._get_int_env('GLM_FRAME_MIN_DISTANCE', 6)
+    
+    @property
+    def frames_layout(self) -> str:
+        """关键帧发送方式：multi 多图请求，sheet 拼接为网格图"""
+        return os.getenv('GLM_FRAMES_LAYOUT', 'multi')
+    
+    @property
+    def sheet_size(self) -> int:
+        """网格图批量分类时每张网格图包含的图像数"""
+        return max(self._get_int_env('GLM_SHEET_SIZE', 16), 1)
+    
+    @property
+    def sheet_cell_size(self) -> int:
+        return self._get_int_env('GLM_SHEET_CELL_SIZE', 256)
+    
+    @property
+    def sheet_parallelism(self) -> int:
+        return max(self._get_int_env('GLM_SHEET_PARALLELISM', 4), 1)
+    
+    @property
+    def directory_workers(self) -> int:
+        return max(self._get_int_env('GLM_DIRECTORY_WORKERS', 4), 1)
+    
+    @property
+    def directory_checkpoint_interval(self) -> int:
+        return max(self._get_int_env('GLM_DIRECTORY_CHECKPOINT', 10), 1)
+    
+    @property
+    def job_db_path(self) -> str:
+        # 默认放在脚本目录下，避免随客户端启动时的工作目录变化而丢失已提交的任务
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glm_jobs.db')
+        return os.getenv('GLM_JOB_DB', default)
+    
+    @property
+    def job_workers(self) -> int:
+        return max(self._get_int_env('GLM_JOB_WORKERS', 2), 1)
+    
+    @property
+    def job_result_ttl(self) -> int:
+        return max(self._get_int_env('GLM_JOB_RESULT_TTL', 86400), 60)
+    
+    @property
+    def bulk_concurrency(self) -> int:
+        return max(self._get_int_env('GLM_BULK_CONCURRENCY', 4), 1)
+    
+    @property
+    def bulk_rate_limit(self) -> float:
+        return max(self._get_float_env('GLM_BULK_RATE_LIMIT', 0.0), 0.0)
+    
+    @property
+    def transport(self) -> str:
+        value = os.getenv('GLM_TRANSPORT', 'stdio').strip().lower()
+        return value if value in ('stdio', 'http', 'unix') else 'stdio'
+    
+    @property
+    def http_host(self) -> str:
+        return os.getenv('GLM_HTTP_HOST', '127.0.0.1')
+    
+    @property
+    def http_port(self) -> int:
+        return self._get_int_env('GLM_HTTP_PORT', 8000)
+    
+    @property
+    def max_concurrent_calls(self) -> int:
+        return max(self._get_int_env('GLM_MAX_CONCURRENT_CALLS', 16), 1)
+    
+    @property
+    def http_shutdown_timeout(self) -> int:
+        return max(self._get_int_env('GLM_HTTP_SHUTDOWN_TIMEOUT', 30), 1)
+    
+    @property
+    def http_workers(self) -> int:
+        return max(self._get_int_env('GLM_HTTP_WORKERS', 1), 1)
+    
+    @property
+    def worker_max_requests(self) -> int:
+        return max(self._get_int_env('GLM_WORKER_MAX_REQUESTS', 0), 0)
+    
+    @property
+    def worker_max_requests_jitter(self) -> int:
+        return max(self._get_int_env('GLM_WORKER_MAX_REQUESTS_JITTER', 50), 0)
+    
+    @property
+    def shared_state_db(self) -> str:
+        return os.getenv('GLM_SHARED_STATE_DB', 'glm_shared.db')
+    
+    @property
+    def rate_limit(self) -> float:
+        return max(self._get_float_env('GLM_RATE_LIMIT', 0.0), 0.0)
+    
+    @property
+    def rate_burst(self) -> int:
+        return max(self._get_int_env('GLM_RATE_BURST', 1), 1)
+    
+    @property
+    def shared_cache_ttl(self) -> int:
+        return max(self._get_int_env('GLM_SHARED_CACHE_TTL', 3600), 0)
+    
+    @property
+    def adaptive_max_tokens(self) -> bool:
+        return self._get_bool_env('GLM_ADAPTIVE_MAX_TOKENS', True)
+    
+    @property
+    def session_token_budget(self) -> int:
+        return max(self._get_int_env('GLM_SESSION_TOKEN_BUDGET', 0), 0)
+    
+    @property
+    def daily_token_budget(self) -> int:
+        return max(self._get_int_env('GLM_DAILY_TOKEN_BUDGET', 0), 0)
+    
+    @property
+    def strip_metadata(self) -> bool:
+        """上传本地图像前删除 EXIF/XMP/注释等元数据"""
+        return self._get_bool_env('GLM_STRIP_METADATA', True)
+    
+    @property
+    def normalize_orientation(self) -> bool:
+        """按 EXIF 方向转置 JPEG 像素后重新编码（有损）；关闭时保留只含方向标记的最小 EXIF 段"""
+        return self._get_bool_env('GLM_NORMALIZE_ORIENTATION', False)
+    
+    @property
+    def codec_select(self) -> bool:
+        """重新编码图像时在允许的输出格式中自动选择最小编码"""
+        return self._get_bool_env('GLM_CODEC_SELECT', True)
+    
+    @property
+    def output_formats(self) -> List[str]:
+        """允许的重新编码输出格式（jpeg / webp / png）"""
+        formats = [name.lower() for name in self._get_list_env('GLM_OUTPUT_FORMATS')]
+        return [name for name in formats if name in ('jpeg', 'webp', 'png')] or ['jpeg', 'webp', 'png']
+    
+    @property
+    def codec_min_ssim(self) -> float:
+        """有损编码在探测图上需达到的最低 SSIM"""
+        return min(max(self._get_float_env('GLM_CODEC_MIN_SSIM', 0.95), 0.0), 1.0)
+    
+    @property
+    def auto_crop(self) -> bool:
+        """编码前自动裁去纯色边框与空白"""
+        return self._get_bool_env('GLM_AUTO_CROP', False)
+    
+    @property
+    def auto_crop_padding(self) -> int:
+        """自动裁边保留的边距（像素）"""
+        return max(self._get_int_env('GLM_AUTO_CROP_PADDING', 16), 0)
+    
+    @property
+    def auto_crop_tolerance(self) -> int:
+        """与背景色的差值超过该值（0-255）的像素视为内容"""
+        return min(max(self._get_int_env('GLM_AUTO_CROP_TOLERANCE', 12), 0), 254)
+    
+    @property
+    def diff_block_size(self) -> int:
+        """diff_images 比较变化时的块边长（像素）"""
+        return max(self._get_int_env('GLM_DIFF_BLOCK_SIZE', 16), 1)
+    
+    @property
+    def diff_tolerance(self) -> int:
+        """像素差值超过该值（0-255）才视为变化，用于忽略压缩噪声"""
+        return min(max(self._get_int_env('GLM_DIFF_TOLERANCE', 24), 0), 254)
+    
+    @property
+    def diff_max_regions(self) -> int:
+        """diff_images 最多上传的变化区域数"""
+        return max(self._get_int_env('GLM_DIFF_MAX_REGIONS', 4), 1)
+    
+    @property
+    def payload_cache_mb(self) -> int:
+        """本地图像上传载荷缓存上限（MB，0 表示关闭）"""
+        return max(self._get_int_env('GLM_PAYLOAD_CACHE_MB', 64), 0)
+    
+    @property
+    def prewarm_dirs(self) -> List[str]:
+        """预热监视的目录，新写入的图像在请求到达前预先处理"""
+        return self._get_list_env('GLM_PREWARM_DIRS')
+    
+    @property
+    def prewarm_queue_size(self) -> int:
+        return max(self._get_int_env('GLM_PREWARM_QUEUE', 64), 1)
+    
+    @property
+    def prewarm_poll_interval(self) -> float:
+        """inotify 不可用时的轮询间隔（秒）"""
+        return max(self._get_float_env('GLM_PREWARM_POLL_INTERVAL', 2.0), 0.2)
+    
+    @property
+    def image_session_max(self) -> int:
+        """open_image 最多保留的图像会话数（LRU 淘汰）"""
+        return max(self._get_int_env('GLM_IMAGE_SESSION_MAX', 32), 1)
+    
+    @property
+    def image_session_ttl(self) -> int:
+        """图像会话空闲过期时长（秒）"""
+        return max(self._get_int_env('GLM_IMAGE_SESSION_TTL', 1800), 60)
+    
+    @property
+    def image_session_max_turns(self) -> int:
+        """ask_image 携带的最近问答轮数，0 表示不携带上下文"""
+        return max(self._get_int_env('GLM_IMAGE_SESSION_MAX_TURNS', 10), 0)
+    
+    @property
+    def daemon_socket(self) -> str:
+        # 默认路径需与 stdio_shim.default_socket_path 保持一致（当前用户私有目录）
+        base = os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+        default = os.path.join(base, f"glm-mcp-{getattr(os, 'getuid', lambda: 0)()}", "daemon.sock")
+        return os.getenv('GLM_DAEMON_SOCKET', default)
+    
+    @property
+    def daemon_idle_timeout(self) -> int:
+        return max(self._get_int_env('GLM_DAEMON_IDLE_TIMEOUT', 600), 0)
+    
+    @staticmethod
+    def _get_bool_env(name: str, default: bool) -> bool:
+        value = os.getenv(name)
+        if value is None or not value.strip():
+            return default
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    
+    @staticmethod
+    def _get_int_env(name: str, default: int) -> int:
+        try:
+            return int(os.getenv(name, default))
+        except (TypeError, ValueError):
+            logger.warning(f"{name} is not a valid integer, using default {default}")
+            return default
+    
+    @staticmethod
+    def _get_float_env(name: str, default: float) -> float:
+        try:
+            return float(os.getenv(name, default))
+        except (TypeError, ValueError):
+            logger.warning(f"{name} is not a valid number, using default {default}")
+            return default
+    
+    @staticmethod
+    def _get_list_env(name: str) -> List[str]:
+        return [item.strip() for item in os.getenv(name, '').split(',') if item.strip()]
+    
     def get_config_summary(self) -> Dict[str, Any]:
         """获取配置摘要（用于调试）"""
         return {
             "glm_api_base": self.glm_api_base,
             "glm_image_model": self.glm_image_model,
             "log_level": self.log_level,
-            "api_key_set": bool(self.glm_api_key),
+            "api_key_set": bool(self.glm_api_keys),
+            "api_key_count": len(self.glm_api_keys),
             "working_directory": os.getcwd(),
             "config_file_directory": os.path.dirname(os.path.abspath(__file__))
         }
@@ -124,12 +494,12 @@ class Config:
         self._validation_errors = []
         
         # 检查必需的配置项
-        if not self.glm_api_key:
+        if not self.glm_api_keys:
             self._validation_errors.append("GLM_API_KEY 未设置")
             logger.error("GLM_API_KEY is not configured")
         
         # 检查 API URL 格式
-        if not self.glm_api_base.startswith('http'):
+        if not all(base.startswith('http') for base in self.glm_api_bases):
             self._validation_errors.append("GLM_API_BASE 格式不正确")
             logger.error("GLM_API_BASE format is invalid")
         
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+目录增量分析模块
+遍历目录中的图像，借助持久化清单只分析新增或变更的文件，支持并发、断点续跑和按完成顺序输出结果
+"""
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Any, Optional, List, Iterator, Tuple
+
+from config import config
+from logger import logger
+from image_processor import image_processor
+
+MANIFEST_FILENAME = ".glm_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class DirectoryAnalyzer:
+    """目录增量分析器"""
+
+    def __init__(self, client: Any, workers: int = 4, checkpoint_interval: int = 10,
+                 analyze: Optional[Callable[[str, str, float, int], str]] = None):
+        """
+        Args:
+            client: GLM 客户端（其 model 参与清单中的提示键）
+            analyze: 分析函数 (data URL, 提示, temperature, max_tokens) -> 回复，应经过令牌预算、计量与速率限制；
+                默认直接调用 client.analyze_image
+        """
+        self.client = client
+        self.analyze = analyze or client.analyze_image
+        self.workers = max(workers, 1)
+        self.checkpoint_interval = max(checkpoint_interval, 1)
+
+    def scan(self, root: str, patterns: Optional[List[str]] = None, recursive: bool = True) -> Iterator[Tuple[str, os.stat_result]]:
+        """使用 os.scandir 遍历目录，返回 (相对路径, stat) ，仅包含支持格式且匹配任一 glob 的文件"""
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file() or not image_processor.is_supported_format(entry.name):
+                            continue
+                        relative_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        if patterns and not any(
+                            fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(entry.name, pattern)
+                            for pattern in patterns
+                        ):
+                            continue
+                        yield relative_path, entry.stat()
+            except OSError as e:
+                logger.warning(f"无法读取目录: {current} | {e}")
+
+    @staticmethod
+    def load_manifest(manifest_path: str) -> Dict[str, Any]:
+        """读取清单，不存在或损坏时返回空清单"""
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION and isinstance(manifest.get('files'), dict):
+                return manifest
+            logger.warning(f"清单版本不匹配，将重新分析: {manifest_path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"清单读取失败，将重新分析: {manifest_path} | {e}")
+        return {'version': MANIFEST_VERSION, 'files': {}}
+
+    @staticmethod
+    def save_manifest(manifest_path: str, manifest: Dict[str, Any]):
+        """原子写入清单（先写临时文件再替换）"""
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+
+    @staticmethod
+    def make_prompt_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+        """同一文件在提示或参数变化后需要重新分析"""
+        raw = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        hash_obj = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hash_obj.update(chunk)
+        return hash_obj.hexdigest()
+
+    def _plan(self, root: str, manifest: Dict[str, Any], prompt_key: str, patterns: Optional[List[str]],
+              recursive: bool) -> Tuple[List[Tuple[str, os.stat_result, Optional[str]]], int, int]:
+        """对比清单确定待分析文件，返回 (待分析列表, 未变更数, 已删除数)"""
+        files = manifest['files']
+        pending = []
+        unchanged = 0
+        seen = set()
+
+        for relative_path, stat in self.scan(root, patterns, recursive):
+            seen.add(relative_path)
+            entry = files.get(relative_path)
+            done = entry is not None and entry.get('prompt_key') == prompt_key and 'result' in entry
+            if done and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                unchanged += 1
+                continue
+
+            # 大小或修改时间变化时比较内容哈希，内容未变则只刷新 stat
+            content_hash = None
+            if done:
+                content_hash = self.hash_file(os.path.join(root, relative_path))
+                if content_hash == entry.get('sha256'):
+                    entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+                    unchanged += 1
+                    continue
+            pending.append((relative_path, stat, content_hash))
+
+        # 只清理磁盘上已不存在的文件，被 glob 过滤掉的条目保留
+        removed = [path for path in files if path not in seen and not os.path.exists(os.path.join(root, path))]
+        for path in removed:
+            del files[path]
+        return pending, unchanged, len(removed)
+
+    def _analyze_file(self, file_path: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        image_data_url = image_processor.encode_image_to_base64(file_path)
+        if not image_data_url:
+            raise ValueError("图像文件不存在、格式不支持或编码失败")
+        return self.analyze(image_data_url, prompt, temperature, max_tokens)
+
+    def run(self, root: str, prompt: str, patterns: Optional[List[str]] = None, recursive: bool = True,
+            temperature: float = 0.8, max_tokens: int = 1000, manifest_path: Optional[str] = None,
+            retry_failed: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        增量分析目录，按完成顺序逐个产出结果
+
+        每完成 checkpoint_interval 个文件写一次清单，中断后重新运行会跳过已完成的文件；
+        最后产出一条 type 为 summary 的汇总记录
+        """
+        root = os.path.abspath(root)
+        manifest_path = manifest_path or os.path.join(root, MANIFEST_FILENAME)
+        manifest = self.load_manifest(manifest_path)
+        prompt_key = self.make_prompt_key(prompt, getattr(self.client, 'model', ''), temperature, max_tokens)
+
+        pending, unchanged, removed = self._plan(root, manifest, prompt_key, patterns, recursive)
+        skipped_failed = 0
+        if not retry_failed:
+            # 上次失败的文件默认重试；内容未变且错误不可重试（如文件无法解码）的文件跳过
+            skipped = [item for item in pending if self._failed_unchanged(manifest, item, prompt_key)]
+            pending = [item for item in pending if item not in skipped]
+            skipped_failed = len(skipped)
+        logger.info(
+            f"目录分析计划: {root} | 待分析 {len(pending)}，未变更 {unchanged}，"
+            f"跳过不可重试的失败 {skipped_failed}，已删除 {removed}"
+        )
+
+        started = time.time()
+        completed = failed = 0
+        lock = threading.Lock()
+
+        def process(item: Tuple[str, os.stat_result, Optional[str]]) -> Dict[str, Any]:
+            relative_path, stat, content_hash = item
+            file_path = os.path.join(root, relative_path)
+            entry = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': content_hash or self.hash_file(file_path),
+                'prompt_key': prompt_key,
+                'analyzed_at': int(time.time())
+            }
+            try:
+                entry['result'] = self._analyze_file(file_path, prompt, temperature, max_tokens)
+            except Exception as e:
+                entry['error'] = str(e)
+                # 图像无法读取或编码（ValueError）在内容不变时重试也会失败；模型调用、预算等错误可重试
+                entry['retryable'] = not isinstance(e, ValueError)
+            return {'path': relative_path, **entry}
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(process, item) for item in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                with lock:
+                    manifest['files'][record['path']] = {k: v for k, v in record.items() if k != 'path'}
+                    completed += 1
+                    failed += 'error' in record
+                    if completed % self.checkpoint_interval == 0:
+                        self.save_manifest(manifest_path, manifest)
+                yield {
+                    'type': 'result',
+                    'path': record['path'],
+                    'result': record.get('result'),
+                    'error': record.get('error')
+                }
+        finally:
+            # 中断时取消未开始的任务并保存已完成部分
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.save_manifest(manifest_path, manifest)
+
+        elapsed = time.time() - started
+        logger.info(
+            f"目录分析完成: {root} | 分析 {completed}（失败 {failed}），跳过 {unchanged + skipped_failed}，耗时 {elapsed:.1f}s"
+        )
+        yield {
+            'type': 'summary',
+            'directory': root,
+            'manifest': manifest_path,
+            'analyzed': completed,
+            'failed': failed,
+            'unchanged': unchanged,
+            'skipped_failed': skipped_failed,
+            'removed': removed,
+            'elapsed': round(elapsed, 2)
+        }
+
+    @staticmethod
+    def _failed_unchanged(manifest: Dict[str, Any], item: Tuple[str, os.stat_result, Optional[str]], prompt_key: str) -> bool:
+        relative_path, stat, _ = item
+        entry = manifest['files'].get(relative_path)
+        return (
+            entry is not None
+            and 'error' in entry
+            and not entry.get('retryable', True)
+            and entry.get('prompt_key') == prompt_key
+            and entry.get('size') == stat.st_size
+            and entry.get('mtime_ns') == stat.st_mtime_ns
+        )
+
+    def get_cached_results(self, root: str, manifest_path: Optional[str] = None) -> Dict[str, Any]:
+        """读取清单中的全部结果"""
+        root = os.path.abspath(root)
+        manifest = self.load_manifest(manifest_path or os.path.join(root, MANIFEST_FILENAME))
+        return {path: entry.get('result') for path, entry in manifest['files'].items() if 'result' in entry}
+
+
+def main():
+    """命令行入口：逐行输出 JSON 结果"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="增量分析目录中的图像（仅处理新增或变更的文件）")
+    parser.add_argument("directory", help="图像目录")
+    parser.add_argument("--prompt", required=True, help="分析提示文本")
+    parser.add_argument("--pattern", action="append", dest="patterns", help="glob 过滤（可多次指定），如 '*.png'")
+    parser.add_argument("--no-recursive", action="store_true", help="不递归子目录")
+    parser.add_argument("--workers", type=int, default=config.directory_workers, help="并发数")
+    parser.add_argument("--manifest", help=f"清单文件路径（默认 <目录>/{MANIFEST_FILENAME}）")
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--retry-failed", action="store_true", help="同时重试上次因不可重试错误失败且内容未变的文件")
+    args = parser.parse_args()
+    image_processor.configure(config)
+
+    from glm_client import create_glm_client, create_metered_analyzer
+
+    client = create_glm_client()
+    if client is None:
+        sys.exit(1)
+
+    analyzer = DirectoryAnalyzer(client, workers=args.workers, analyze=create_metered_analyzer(client))
+    try:
+        for record in analyzer.run(
+            args.directory, args.prompt, patterns=args.patterns, recursive=not args.no_recursive,
+            temperature=args.temperature, max_tokens=args.max_tokens, manifest_path=args.manifest,
+            retry_failed=args.retry_failed
+        ):
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+    except KeyboardInterrupt:
+        logger.info("目录分析被用户中断，已保存进度")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+GLM 客户端模块
+封装智谱 AI SDK 的客户端创建与对话调用，供 MCP 服务器和命令行工具共用；
+支持多密钥池：按剩余额度分发请求，限制每个密钥的并发，遇到限流或鉴权错误时暂停该密钥
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, Any, Optional, List, Tuple, Union
+
+try:
+    from zhipuai import ZhipuAI
+    ZHIPUAI_AVAILABLE = True
+except ImportError:
+    ZHIPUAI_AVAILABLE = False
+
+from config import config
+from logger import logger
+from model_router import ModelRouter, is_fallback_error
+from usage_meter import UsageMeter, classify_prompt, extract_usage
+
+# 鉴权失败的密钥暂停时长（秒），通常需要人工处理
+AUTH_REST_SECONDS = 600.0
+# 等待可用密钥的最长时间（秒）
+ACQUIRE_TIMEOUT = 120.0
+
+
+class ApiKeySlot:
+    """密钥池中的单个密钥（含独立的 SDK 客户端与用量统计）"""
+
+    def __init__(self, index: int, api_key: str, base_url: str, max_concurrency: int, tokens_per_minute: int):
+        self.index = index
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.client = ZhipuAI(api_key=api_key, base_url=base_url)
+        self.in_flight = 0
+        self.rested_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.total_tokens = 0
+        # 最近一分钟的 (时间, 令牌数)
+        self._window: deque = deque()
+
+    @property
+    def label(self) -> str:
+        """日志中使用的脱敏标识"""
+        return f"#{self.index}(...{self.api_key[-4:]})"
+
+    def tokens_last_minute(self, now: float) -> int:
+        while self._window and now - self._window[0][0] > 60:
+            self._window.popleft()
+        return sum(tokens for _, tokens in self._window)
+
+    def remaining_budget(self, now: float) -> float:
+        """剩余每分钟令牌额度；未配置额度时以最近用量的相反数排序，用得少的优先"""
+        used = self.tokens_last_minute(now)
+        if self.tokens_per_minute:
+            return self.tokens_per_minute - used
+        return -used
+
+    def record_usage(self, tokens: int):
+        self.total_tokens += tokens
+        self._window.append((time.time(), tokens))
+
+    def get_stats(self, now: float) -> Dict[str, Any]:
+        return {
+            'key': self.label,
+            'base_url': self.base_url,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'total_tokens': self.total_tokens,
+            'tokens_last_minute': self.tokens_last_minute(now),
+            'rested_for': max(round(self.rested_until - now, 1), 0)
+        }
+
+
+class ApiKeyPool:
+    """密钥池（线程安全）"""
+
+    def __init__(self, slots: List[ApiKeySlot]):
+        if not slots:
+            raise ValueError("密钥池不能为空")
+        self.slots = slots
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = ACQUIRE_TIMEOUT) -> ApiKeySlot:
+        """选取剩余额度最多、并发未满且未暂停的密钥；都不可用时等待"""
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                candidates = [
+                    slot for slot in self.slots
+                    if slot.rested_until <= now and slot.in_flight < slot.max_concurrency
+                ]
+                if candidates:
+                    slot = max(candidates, key=lambda s: (s.remaining_budget(now), -s.in_flight))
+                    slot.in_flight += 1
+                    slot.requests += 1
+                    return slot
+
+                if now >= deadline:
+                    raise RuntimeError("没有可用的 API 密钥（全部限流暂停或并发已满）")
+                # 等待释放通知，或最早的暂停到期
+                rest_ends = [slot.rested_until for slot in self.slots if slot.rested_until > now]
+                wait = min([deadline - now] + [end - now for end in rest_ends])
+                self._condition.wait(max(wait, 0.05))
+
+    def release(self, slot: ApiKeySlot, tokens: int = 0):
+        with self._condition:
+            slot.in_flight -= 1
+            if tokens:
+                slot.record_usage(tokens)
+            self._condition.notify()
+
+    def rest(self, slot: ApiKeySlot, seconds: float, reason: str):
+        """暂停密钥一段时间"""
+        with self._condition:
+            slot.failures += 1
+            slot.rested_until = max(slot.rested_until, time.time() + seconds)
+        logger.warning(f"API 密钥 {slot.label} 暂停 {seconds:.0f} 秒: {reason}")
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        with self._condition:
+            now = time.time()
+            return [slot.get_stats(now) for slot in self.slots]
+
+
+def _classify_error(error: Exception) -> Optional[str]:
+    """识别需要暂停密钥的错误：rate_limit（429/额度超限）或 auth（401/403）"""
+    status_code = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, 'status_code', None)
+    name = type(error).__name__
+    if status_code == 429 or 'ReachLimit' in name or 'RateLimit' in name:
+        return 'rate_limit'
+    if status_code in (401, 403) or 'Authentication' in name or 'PermissionDenied' in name:
+        return 'auth'
+    return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class GLMClient:
+    """智谱 GLM 对话客户端（多密钥时自动负载均衡）"""
+
+    def __init__(self, api_key: Union[str, List[str]], base_url: Union[str, List[str]], model: str,
+                 max_concurrency: int = 4, tokens_per_minute: int = 0, rest_seconds: float = 30.0,
+                 router: Optional[ModelRouter] = None):
+        if not ZHIPUAI_AVAILABLE:
+            raise ImportError("zhipuai SDK is required")
+        api_keys = [api_key] if isinstance(api_key, str) else api_key
+        base_urls = [base_url] if isinstance(base_url, str) else base_url
+        self.model = model
+        self.base_url = base_urls[0]
+        self.rest_seconds = rest_seconds
+        self.router = router
+        self.pool = ApiKeyPool([
+            ApiKeySlot(index, key, base_urls[index % len(base_urls)], max_concurrency, tokens_per_minute)
+            for index, key in enumerate(api_keys)
+        ])
+
+    def chat(self, messages: List[Dict[str, Any]], temperature: float, max_tokens: int,
+             model: Optional[str] = None) -> str:
+        """发送对话请求并返回回复文本"""
+        return self.chat_detailed(messages, temperature, max_tokens, model)[0]
+
+    def chat_detailed(self, messages: List[Dict[str, Any]], temperature: float, max_tokens: int,
+                      model: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        发送对话请求，返回 (回复文本, 用量信息)
+
+        用量信息包含 model、prompt_tokens、completion_tokens、image_tokens、total_tokens 与 finish_reason；
+        密钥被限流或鉴权失败时换用其他密钥重试
+        """
+        attempts = len(self.pool.slots)
+        for attempt in range(attempts):
+            slot = self.pool.acquire()
+            tokens = 0
+            try:
+                logger.info(f"正在调用智谱 GLM API... 模型 {model or self.model} 密钥 {slot.label}")
+                response = slot.client.chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=False
+                )
+                usage = getattr(response, 'usage', None)
+                tokens = getattr(usage, 'total_tokens', 0) or 0
+            except Exception as e:
+                kind = _classify_error(e)
+                if kind is None:
+                    raise
+                rest = AUTH_REST_SECONDS if kind == 'auth' else (_retry_after(e) or self.rest_seconds)
+                self.pool.rest(slot, rest, str(e))
+                if attempt == attempts - 1:
+                    raise
+                continue
+            finally:
+                self.pool.release(slot, tokens)
+
+            logger.log_api_call(
+                method="POST",
+                url=slot.base_url,
+                status_code=200
+            )
+            info = extract_usage(response)
+            info['model'] = model or self.model
+            return response.choices[0].message.content, info
+
+    def analyze_image(self, image_data_url: Union[str, List[str]], prompt: str,
+                      temperature: float, max_tokens: int) -> str:
+        """分析图像（image_data_url 可为单个 URL 或多图 URL 列表）"""
+        return self.analyze_image_detailed(image_data_url, prompt, temperature, max_tokens)[0]
+
+    def analyze_image_detailed(self, image_data_url: Union[str, List[str]], prompt: str,
+                               temperature: float, max_tokens: int,
+                               history: Optional[List[Tuple[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        分析图像并返回 (回复文本, 用量信息)；配置了路由时按请求开销选择模型
+
+        history 为此前的 (提问, 回答) 轮次，图像随第一轮提问发送，本次提问作为最后一轮
+        """
+        image_urls = [image_data_url] if isinstance(image_data_url, str) else image_data_url
+        turns = list(history or []) + [(prompt, None)]
+        content = [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+        content.append({"type": "text", "text": turns[0][0]})
+        messages = [{"role": "user", "content": content}]
+        for position, (question, answer) in enumerate(turns):
+            if position:
+                messages.append({"role": "user", "content": question})
+            if answer is not None:
+                messages.append({"role": "assistant", "content": answer})
+        if self.router is None:
+            return self.chat_detailed(messages, temperature, max_tokens)
+        
+        candidates = self._route(image_urls, turns, max_tokens)
+        for position, model in enumerate(candidates):
+            started = time.time()
+            try:
+                result = self.chat_detailed(messages, temperature, max_tokens, model=model)
+            except Exception as e:
+                if not is_fallback_error(e):
+                    raise
+                self.router.record(model, False, time.time() - started)
+                if position == len(candidates) - 1:
+                    raise
+                logger.warning(f"模型 {model} 超时或过载，回退到 {candidates[position + 1]}: {e}")
+                continue
+            self.router.record(model, True, time.time() - started)
+            return result
+
+    def _route(self, image_urls: List[str], turns: List[Tuple[str, Optional[str]]], max_tokens: int) -> List[str]:
+        # 内联图像按 base64 长度估算字节数，远程 URL 大小未知
+        image_bytes = None
+        if all(url.startswith('data:') for url in image_urls):
+            image_bytes = sum(len(url) for url in image_urls) * 3 // 4
+        prompt_chars = sum(len(question) + len(answer or '') for question, answer in turns)
+        return self.router.route(image_bytes, prompt_chars, max_tokens, len(image_urls))
+
+    def preferred_model(self, image_data_url: Union[str, List[str]], prompt: str, max_tokens: int) -> str:
+        """该请求当前会首选的模型（未启用路由时为配置的模型），用于区分不同模型的缓存结果"""
+        if self.router is None:
+            return self.model
+        image_urls = [image_data_url] if isinstance(image_data_url, str) else image_data_url
+        return self._route(image_urls, [(prompt, None)], max_tokens)[0]
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """各密钥的用量与状态"""
+        return self.pool.get_stats()
+
+    def get_model_stats(self) -> Optional[Dict[str, Any]]:
+        """各模型的延迟与成功率（未启用路由时返回 None）"""
+        return self.router.get_stats() if self.router else None
+
+
+def create_model_router() -> Optional[ModelRouter]:
+    """配置了轻量模型时创建模型路由器"""
+    light_model = config.glm_light_model
+    if not light_model or light_model == config.glm_image_model:
+        return None
+    logger.info(f"模型路由已启用: 简单请求 -> {light_model}，其余 -> {config.glm_image_model}")
+    return ModelRouter(
+        full_model=config.glm_image_model,
+        light_model=light_model,
+        max_image_bytes=config.route_max_image_kb * 1024,
+        max_prompt_chars=config.route_max_prompt_chars,
+        max_output_tokens=config.route_max_tokens,
+        latency_threshold=config.route_latency_threshold
+    )
+
+
+def create_glm_client() -> Optional[GLMClient]:
+    """按全局配置创建客户端，配置无效或 SDK 不可用时返回 None"""
+    if not config.validate_config():
+        logger.error("配置验证失败，请检查 GLM_API_KEY 等配置")
+        logger.error("验证错误详情:", **{"errors": config.get_validation_errors()})
+        return None
+
+    try:
+        logger.info("正在初始化智谱 AI 客户端...")
+        logger.debug("客户端配置", **{
+            "api_base": config.glm_api_bases,
+            "model": config.glm_image_model,
+            "key_count": len(config.glm_api_keys)
+        })
+
+        if not ZHIPUAI_AVAILABLE:
+            logger.warning("智谱 AI SDK 未安装，无法初始化客户端")
+            return None
+
+        client = GLMClient(
+            api_key=config.glm_api_keys,
+            base_url=config.glm_api_bases,
+            model=config.glm_image_model,
+            max_concurrency=config.key_concurrency,
+            tokens_per_minute=config.key_tokens_per_minute,
+            rest_seconds=config.key_rest_seconds,
+            router=create_model_router()
+        )
+
+        logger.info(f"智谱 AI 客户端初始化成功，密钥数: {len(client.pool.slots)}")
+        logger.debug("客户端已准备就绪")
+        return client
+
+    except Exception as e:
+        logger.log_exception(e, {"context": "Initializing Zhipu AI client"})
+        logger.error(f"智谱 AI 客户端初始化失败: {e}")
+        return None
+
+
+def create_metered_analyzer(client: GLMClient) -> Callable[[str, str, float, int], str]:
+    """
+    为命令行工具创建分析函数 (data URL, 提示, temperature, max_tokens) -> 回复
+
+    与 MCP 服务器的模型调用路径一致：检查令牌预算（整次运行视为一个会话）、按历史输出长度收缩 max_tokens、
+    记录用量，并与服务进程共用跨进程速率预算和每日用量计数
+    """
+    from shared_state import SharedState
+
+    try:
+        shared_state: Optional[SharedState] = SharedState(config.shared_state_db)
+    except Exception as e:
+        logger.warning(f"共享状态数据库打开失败，速率限制与每日预算仅在本进程内生效: {e}")
+        shared_state = None
+    meter = UsageMeter(
+        session_budget=config.session_token_budget,
+        daily_budget=config.daily_token_budget,
+        store=shared_state
+    )
+
+    def analyze(image_data_url: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        def call_once(limit: int) -> Tuple[str, Dict[str, Any]]:
+            if config.rate_limit and shared_state is not None:
+                shared_state.acquire("glm", config.rate_limit, config.rate_burst)
+            return client.analyze_image_detailed(image_data_url, prompt, temperature, limit)
+
+        return meter.metered_call(call_once, classify_prompt(prompt), max_tokens, adaptive=config.adaptive_max_tokens)[0]
+
+    return analyze
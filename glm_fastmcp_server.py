@@ -11,9 +11,22 @@ if sys.platform == "win32":
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 
+from image_probe import probe_image_bytes
+from usage_meter import UsageMeter, classify_prompt, extract_usage
+
 # 加载环境变量（优先使用.env文件）
 load_dotenv('.env')
 
+# 最大输出令牌数上限；同类提示积累样本后按历史输出长度自动收缩
+MAX_TOKENS = int(os.getenv('GLM_FASTMCP_MAX_TOKENS', '8000'))
+ADAPTIVE_MAX_TOKENS = os.getenv('GLM_ADAPTIVE_MAX_TOKENS', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# stdio 模式下一个进程即一个会话
+usage_meter = UsageMeter(
+    session_budget=int(os.getenv('GLM_SESSION_TOKEN_BUDGET', '0')),
+    daily_budget=int(os.getenv('GLM_DAILY_TOKEN_BUDGET', '0'))
+)
+
 # 创建FastMCP服务器实例
 mcp = FastMCP(
     name="glm-mcp",
@@ -38,10 +51,14 @@ def analyze_image(
     try:
         from zhipuai import ZhipuAI
         
-        # 读取图像并转换为base64
+        # 读取图像并转换为base64，MIME 类型取自文件头而非扩展名
         with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
-            data_url = f"data:image/jpeg;base64,{image_data}"
+            raw_data = f.read()
+        probe_info = probe_image_bytes(raw_data, count_frames=False)
+        if not probe_info:
+            return f"图像分析失败: 无法识别的图像文件 {image_path}"
+        image_data = base64.b64encode(raw_data).decode('utf-8')
+        data_url = f"data:{probe_info['mime_type']};base64,{image_data}"
         
         # 调用GLM API
         client = ZhipuAI(
@@ -49,18 +66,32 @@ def analyze_image(
             base_url=os.getenv('GLM_API_BASE', 'https://open.bigmodel.cn/api/paas/v4/')
         )
         
-        response = client.chat.completions.create(
-            model=os.getenv('GLM_IMAGE_MODEL', 'glm-4.6v'),
-            messages=[{
-                'role': 'user',
-                'content': [
-                    {'type': 'image_url', 'image_url': {'url': data_url}},
-                    {'type': 'text', 'text': prompt}
-                ]
-            }],
-            temperature=0.3,
-            max_tokens=8000
-        )
+        usage_meter.check_budget()
+        prompt_class = classify_prompt(prompt)
+        max_tokens = usage_meter.suggest_max_tokens(prompt_class, MAX_TOKENS) if ADAPTIVE_MAX_TOKENS else MAX_TOKENS
+        
+        def create(max_tokens):
+            response = client.chat.completions.create(
+                model=os.getenv('GLM_IMAGE_MODEL', 'glm-4.6v'),
+                messages=[{
+                    'role': 'user',
+                    'content': [
+                        {'type': 'image_url', 'image_url': {'url': data_url}},
+                        {'type': 'text', 'text': prompt}
+                    ]
+                }],
+                temperature=0.3,
+                max_tokens=max_tokens
+            )
+            usage = extract_usage(response)
+            truncated = usage['finish_reason'] == 'length'
+            usage_meter.record(prompt_class, usage, truncated=truncated)
+            return response, truncated
+        
+        response, truncated = create(max_tokens)
+        # 自动收缩的上限导致截断时以完整上限重试
+        if truncated and max_tokens < MAX_TOKENS:
+            response, _ = create(MAX_TOKENS)
         
         return response.choices[0].message.content
         
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+图像头部探测模块
+通过魔数和格式头解析图像的格式、尺寸、模式和帧数，只读取文件头部，无需 PIL 完整解码
+"""
+
+import io
+import os
+import struct
+from typing import Optional, Dict, Any, BinaryIO
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+# 格式名称与 PIL 保持一致
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp',
+    'WEBP': 'image/webp',
+}
+
+# JPEG SOFn 标记（排除 DHT/JPG/DAC）
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# 无长度字段的独立标记
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+class ImageHeaderProbe:
+    """图像头部探测器"""
+
+    def probe_file(self, file_path: str, count_frames: bool = True) -> Optional[Dict[str, Any]]:
+        """探测图像文件头部信息，失败时返回 None"""
+        try:
+            with open(file_path, 'rb') as f:
+                return self.probe_stream(f, count_frames)
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.debug(f"图像头部探测失败: {file_path} | {e}")
+            return None
+
+    def probe_bytes(self, data: bytes, count_frames: bool = True) -> Optional[Dict[str, Any]]:
+        """探测内存中图像数据的头部信息，失败时返回 None"""
+        try:
+            return self.probe_stream(io.BytesIO(data), count_frames)
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.debug(f"图像头部探测失败: {e}")
+            return None
+
+    def probe_stream(self, f: BinaryIO, count_frames: bool = True) -> Dict[str, Any]:
+        """
+        探测可定位二进制流的头部信息，无法识别时抛出 ValueError
+
+        count_frames 为 False 时，GIF 最多扫描到第二帧即停止，frames 仅作为下限
+        """
+        head = f.read(64)
+        if head.startswith(b'\xff\xd8'):
+            info = self._probe_jpeg(f)
+        elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+            info = self._probe_png(f)
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            info = self._probe_gif(f, head, count_frames)
+        elif head.startswith(b'BM'):
+            info = self._probe_bmp(head)
+        elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            info = self._probe_webp(f)
+        else:
+            raise ValueError("无法识别的图像文件头")
+
+        width, height = info['width'], info['height']
+        if width <= 0 or height <= 0:
+            raise ValueError(f"图像尺寸无效: {width}x{height}")
+
+        info.setdefault('frames', 1)
+        info.setdefault('has_transparency', info['mode'] in ('RGBA', 'LA', 'PA'))
+        info['size'] = (width, height)
+        info['mime_type'] = FORMAT_MIME_TYPES[info['format']]
+        info['is_animated'] = info['frames'] > 1
+        return info
+
+    @staticmethod
+    def _read_exact(f: BinaryIO, size: int) -> bytes:
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError("图像文件头被截断")
+        return data
+
+    def _probe_jpeg(self, f: BinaryIO) -> Dict[str, Any]:
+        """逐段跳过 JPEG 标记段直到 SOFn"""
+        f.seek(2)
+        while True:
+            byte = self._read_exact(f, 1)
+            if byte != b'\xff':
+                raise ValueError("JPEG 标记段损坏")
+            marker = self._read_exact(f, 1)[0]
+            # 跳过填充字节
+            while marker == 0xFF:
+                marker = self._read_exact(f, 1)[0]
+            if marker in _JPEG_STANDALONE_MARKERS:
+                continue
+            if marker in (0xD9, 0xDA):
+                raise ValueError("JPEG 缺少 SOF 段")
+            length = struct.unpack('>H', self._read_exact(f, 2))[0]
+            if length < 2:
+                raise ValueError("JPEG 段长度无效")
+            if marker in _JPEG_SOF_MARKERS:
+                _, height, width, components = struct.unpack('>BHHB', self._read_exact(f, 6))
+                mode = {1: 'L', 3: 'RGB', 4: 'CMYK'}.get(components)
+                if mode is None:
+                    raise ValueError(f"不支持的 JPEG 分量数: {components}")
+                return {'format': 'JPEG', 'width': width, 'height': height, 'mode': mode}
+            f.seek(length - 2, os.SEEK_CUR)
+
+    def _probe_png(self, f: BinaryIO) -> Dict[str, Any]:
+        """解析 IHDR，并在 IDAT 之前查找 acTL/tRNS"""
+        f.seek(8)
+        length, chunk_type = struct.unpack('>I4s', self._read_exact(f, 8))
+        if chunk_type != b'IHDR' or length != 13:
+            raise ValueError("PNG 缺少 IHDR 段")
+        width, height, bit_depth, color_type = struct.unpack('>IIBB', self._read_exact(f, 10))
+        f.seek(3 + 4, os.SEEK_CUR)
+
+        if color_type == 0:
+            mode = {1: '1', 16: 'I;16'}.get(bit_depth, 'L')
+        else:
+            mode = {2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}.get(color_type)
+        if mode is None:
+            raise ValueError(f"不支持的 PNG 颜色类型: {color_type}")
+
+        info = {'format': 'PNG', 'width': width, 'height': height, 'mode': mode}
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type in (b'IDAT', b'IEND'):
+                break
+            if chunk_type == b'acTL':
+                info['frames'] = struct.unpack('>I', self._read_exact(f, 4))[0] or 1
+                # 剩余数据 length - 4 字节加 4 字节 CRC
+                f.seek(length, os.SEEK_CUR)
+                continue
+            if chunk_type == b'tRNS':
+                info['has_transparency'] = True
+            f.seek(length + 4, os.SEEK_CUR)
+        return info
+
+    def _probe_gif(self, f: BinaryIO, head: bytes, count_frames: bool) -> Dict[str, Any]:
+        """解析逻辑屏幕描述符，并按块结构跳过 LZW 数据统计帧数"""
+        width, height, packed = struct.unpack('<HHB', head[6:11])
+        f.seek(13)
+        if packed & 0x80:
+            f.seek(3 * (2 << (packed & 0x07)), os.SEEK_CUR)
+
+        frames = 0
+        has_transparency = False
+        while True:
+            block = f.read(1)
+            if not block or block == b'\x3b':
+                break
+            if block == b'\x21':
+                label = self._read_exact(f, 1)
+                if label == b'\xf9':
+                    size, gce_packed = struct.unpack('<BB', self._read_exact(f, 2))
+                    has_transparency = has_transparency or bool(gce_packed & 0x01)
+                    f.seek(size - 1, os.SEEK_CUR)
+                self._skip_gif_sub_blocks(f)
+            elif block == b'\x2c':
+                descriptor = self._read_exact(f, 9)
+                if descriptor[8] & 0x80:
+                    f.seek(3 * (2 << (descriptor[8] & 0x07)), os.SEEK_CUR)
+                f.seek(1, os.SEEK_CUR)
+                self._skip_gif_sub_blocks(f)
+                frames += 1
+                if not count_frames and frames >= 2:
+                    break
+            else:
+                raise ValueError("GIF 块结构损坏")
+
+        if frames == 0:
+            raise ValueError("GIF 不包含任何图像帧")
+        return {
+            'format': 'GIF',
+            'width': width,
+            'height': height,
+            'mode': 'P',
+            'frames': frames,
+            'has_transparency': has_transparency,
+        }
+
+    def _skip_gif_sub_blocks(self, f: BinaryIO):
+        while True:
+            size = self._read_exact(f, 1)[0]
+            if size == 0:
+                return
+            f.seek(size, os.SEEK_CUR)
+
+    def _probe_bmp(self, head: bytes) -> Dict[str, Any]:
+        """解析 BITMAPINFOHEADER / BITMAPCOREHEADER"""
+        header_size = struct.unpack('<I', head[14:18])[0]
+        if header_size == 12:
+            width, height, _, bpp = struct.unpack('<HHHH', head[18:26])
+            compression = 0
+        elif header_size >= 40:
+            width, height, _, bpp, compression = struct.unpack('<iiHHI', head[18:34])
+        else:
+            raise ValueError(f"不支持的 BMP 头部长度: {header_size}")
+
+        mode = {1: '1', 4: 'P', 8: 'P', 16: 'RGB', 24: 'RGB', 32: 'RGB'}.get(bpp)
+        if mode is None:
+            raise ValueError(f"不支持的 BMP 位深: {bpp}")
+        # BI_BITFIELDS / BI_ALPHABITFIELDS 的 32 位图可能带 alpha，仅按头部给出保守判断
+        if bpp == 32 and compression in (3, 6) and header_size >= 56:
+            mode = 'RGBA'
+        return {'format': 'BMP', 'width': width, 'height': abs(height), 'mode': mode}
+
+    def _probe_webp(self, f: BinaryIO) -> Dict[str, Any]:
+        """解析 VP8 / VP8L / VP8X 头部，动画图统计 ANMF 块"""
+        f.seek(12)
+        chunk_type, length = struct.unpack('<4sI', self._read_exact(f, 8))
+        data = self._read_exact(f, min(length, 30))
+
+        if chunk_type == b'VP8 ':
+            if data[3:6] != b'\x9d\x01\x2a':
+                raise ValueError("WebP VP8 起始码无效")
+            width, height = struct.unpack('<HH', data[6:10])
+            return {'format': 'WEBP', 'width': width & 0x3FFF, 'height': height & 0x3FFF, 'mode': 'RGB'}
+
+        if chunk_type == b'VP8L':
+            if data[0] != 0x2F:
+                raise ValueError("WebP VP8L 签名无效")
+            bits = struct.unpack('<I', data[1:5])[0]
+            mode = 'RGBA' if (bits >> 28) & 0x01 else 'RGB'
+            return {
+                'format': 'WEBP',
+                'width': (bits & 0x3FFF) + 1,
+                'height': ((bits >> 14) & 0x3FFF) + 1,
+                'mode': mode,
+            }
+
+        if chunk_type == b'VP8X':
+            flags = data[0]
+            width = int.from_bytes(data[4:7], 'little') + 1
+            height = int.from_bytes(data[7:10], 'little') + 1
+            info = {
+                'format': 'WEBP',
+                'width': width,
+                'height': height,
+                'mode': 'RGBA' if flags & 0x10 else 'RGB',
+            }
+            if flags & 0x02:
+                info['frames'] = self._count_webp_frames(f, 12 + 8 + length + (length & 1))
+            return info
+
+        raise ValueError(f"不支持的 WebP 块类型: {chunk_type!r}")
+
+    def _count_webp_frames(self, f: BinaryIO, offset: int) -> int:
+        frames = 0
+        f.seek(offset)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_type, length = struct.unpack('<4sI', header)
+            if chunk_type == b'ANMF':
+                frames += 1
+            f.seek(length + (length & 1), os.SEEK_CUR)
+        return max(frames, 1)
+
+
+# 创建全局探测器实例
+image_probe = ImageHeaderProbe()
+
+# 便捷函数
+def probe_image_file(file_path: str, count_frames: bool = True) -> Optional[Dict[str, Any]]:
+    return image_probe.probe_file(file_path, count_frames)
+
+def probe_image_bytes(data: bytes, count_frames: bool = True) -> Optional[Dict[str, Any]]:
+    return image_probe.probe_bytes(data, count_frames)
+
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:]:
+        print(f"{path}: {probe_image_file(path)}")
@@ -6,11 +6,19 @@
 
 import os
 import base64
+import hashlib
 import mimetypes
-from typing import Optional, Tuple, Dict, Any
-from PIL import Image
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional, Tuple, Dict, Any, List
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps, JpegImagePlugin, features
 import io
 
+from image_probe import image_probe
+from metadata_strip import strip_metadata
+from phash_index import compute_dhash, compute_file_dhash, hamming_distance
+
 try:
     from logger import logger
     LOGGER_AVAILABLE = True
@@ -19,16 +27,181 @@ except ImportError:
     logger = logging.getLogger(__name__)
     LOGGER_AVAILABLE = False
 
+# EXIF 方向值对应的像素变换（与 ImageOps.exif_transpose 一致）
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 编码格式选择：每种允许的输出格式对应的候选编码方式，及其 MIME 类型与是否无损
+_FORMAT_CODECS = {
+    'jpeg': ('jpeg',),
+    'webp': ('webp', 'webp_lossless'),
+    'png': ('png', 'png_palette'),
+}
+_CODEC_MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'webp_lossless': 'image/webp',
+    'png': 'image/png',
+    'png_palette': 'image/png',
+}
+_LOSSLESS_CODECS = {'webp_lossless', 'png'}
+# 试编码使用的缩小探测图长边像素
+CODEC_PROBE_SIZE = 256
+# 每张源图像的编码选择缓存条目数
+CODEC_CACHE_SIZE = 256
+# 自动裁边检测使用的降采样图长边像素
+AUTO_CROP_PROBE_SIZE = 512
+# 裁剪后面积不超过原图该比例时才裁剪
+AUTO_CROP_MAX_AREA_RATIO = 0.9
+
+
+def structural_similarity(first: Image.Image, second: Image.Image, block: int = 8) -> float:
+    """按不重叠 block×block 窗口计算灰度 SSIM 均值（纯 Python 实现，用于小尺寸探测图）"""
+    a = first.convert('L')
+    b = second.convert('L')
+    if b.size != a.size:
+        b = b.resize(a.size)
+    width, height = a.size
+    block = max(min(block, width, height), 1)
+    pixels_a, pixels_b = a.tobytes(), b.tobytes()
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    count = block * block
+    total, windows = 0.0, 0
+    for top in range(0, height - block + 1, block):
+        for left in range(0, width - block + 1, block):
+            sum_a = sum_b = sum_aa = sum_bb = sum_ab = 0
+            for y in range(top, top + block):
+                start = y * width + left
+                row_a = pixels_a[start:start + block]
+                row_b = pixels_b[start:start + block]
+                sum_a += sum(row_a)
+                sum_b += sum(row_b)
+                sum_aa += sum(v * v for v in row_a)
+                sum_bb += sum(v * v for v in row_b)
+                sum_ab += sum(x * y for x, y in zip(row_a, row_b))
+            mean_a, mean_b = sum_a / count, sum_b / count
+            var_a = sum_aa / count - mean_a * mean_a
+            var_b = sum_bb / count - mean_b * mean_b
+            covariance = sum_ab / count - mean_a * mean_b
+            total += ((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) / (
+                (mean_a * mean_a + mean_b * mean_b + c1) * (var_a + var_b + c2)
+            )
+            windows += 1
+    return total / windows if windows else 1.0
+
+class PayloadCache:
+    """本地图像上传载荷缓存（按文件身份标识，按总字节数 LRU 淘汰，线程安全）"""
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def get(self, identity: Tuple[str, int, int]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(identity)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(identity)
+            self.hits += 1
+            return entry
+    
+    def __contains__(self, identity: Tuple[str, int, int]) -> bool:
+        with self._lock:
+            return identity in self._entries
+    
+    def put(self, identity: Tuple[str, int, int], entry: Dict[str, Any]):
+        size = len(entry['data_url'])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(identity, None)
+            if previous is not None:
+                self._bytes -= len(previous['data_url'])
+            self._entries[identity] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['data_url'])
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
 class ImageProcessor:
     """图像处理器"""
     
     def __init__(self):
         self.supported_formats = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
         self.max_file_size = 10 * 1024 * 1024  # 10MB
+        # 已解码图像金字塔缓存（按文件路径、修改时间和大小标识）
+        self.pyramid_cache_size = 4
+        self._pyramid_cache: "OrderedDict[Tuple[str, int, int], List[Image.Image]]" = OrderedDict()
+        self._pyramid_lock = threading.Lock()
+        # 以下选项由 configure 按全局配置设置
+        # 上传前删除元数据（EXIF 方向保留为最小 EXIF 段）
+        self.strip_metadata = True
+        # 按 EXIF 方向转置像素后重新编码（有损，默认关闭）
+        self.normalize_orientation = False
+        # 重新编码时在允许的输出格式中选择满足 SSIM 阈值的最小编码
+        self.codec_select = True
+        self.output_formats = ['jpeg', 'webp', 'png']
+        self.codec_min_ssim = 0.95
+        self._codec_cache: "OrderedDict[Any, str]" = OrderedDict()
+        # 编码前裁去纯色边框与空白
+        self.auto_crop = False
+        self.auto_crop_padding = 16
+        self.auto_crop_tolerance = 12
+        # 本地文件的 data URL、图像信息与感知哈希缓存（0 字节表示关闭）
+        self.payload_cache = PayloadCache()
+        self._slim_stats = {
+            'images': 0, 'bytes_before': 0, 'bytes_saved': 0, 'orientation_kept': 0, 'reoriented_lossy': 0,
+            'auto_cropped': 0, 'pixels_removed': 0
+        }
+        self._codec_stats: Dict[str, int] = {}
+        self._slim_lock = threading.Lock()
         
         if LOGGER_AVAILABLE:
             logger.info("图像处理器初始化成功")
     
+    def configure(self, settings: Any):
+        """按全局配置对象（config.Config）设置预处理选项"""
+        self.strip_metadata = settings.strip_metadata
+        self.normalize_orientation = settings.normalize_orientation
+        self.codec_select = settings.codec_select
+        self.output_formats = settings.output_formats
+        self.codec_min_ssim = settings.codec_min_ssim
+        self.auto_crop = settings.auto_crop
+        self.auto_crop_padding = settings.auto_crop_padding
+        self.auto_crop_tolerance = settings.auto_crop_tolerance
+        # 预处理选项变化后已缓存的载荷失效
+        self.payload_cache.clear()
+        self.payload_cache.max_bytes = settings.payload_cache_mb * 1024 * 1024
+        with self._slim_lock:
+            self._codec_cache.clear()
+    
     def is_supported_format(self, file_path: str) -> bool:
         """检查文件格式是否支持"""
         _, ext = os.path.splitext(file_path.lower())
@@ -43,29 +216,27 @@ class ImageProcessor:
                 logger.error(f"获取文件大小失败: {e}")
             return 0
     
-    def is_file_size_valid(self, file_path: str) -> bool:
+    def is_file_size_valid(self, file_path: str, max_file_size: Optional[int] = None) -> bool:
         """检查文件大小是否有效"""
         size = self.get_file_size(file_path)
-        return size <= self.max_file_size
+        return size <= (max_file_size or self.max_file_size)
     
-    def validate_image_file(self, file_path: str) -> Tuple[bool, str]:
-        """验证图像文件"""
+    def validate_image_file(self, file_path: str, max_file_size: Optional[int] = None) -> Tuple[bool, str]:
+        """验证图像文件（max_file_size 可覆盖默认大小限制，如分块模式）"""
+        max_file_size = max_file_size or self.max_file_size
         if not os.path.exists(file_path):
             return False, f"文件不存在: {file_path}"
         
         if not self.is_supported_format(file_path):
             return False, f"不支持的图像格式: {file_path}"
         
-        if not self.is_file_size_valid(file_path):
-            return False, f"文件大小超过限制 (最大 {self.max_file_size // (1024*1024)}MB)"
+        if not self.is_file_size_valid(file_path, max_file_size):
+            return False, f"文件大小超过限制 (最大 {max_file_size // (1024*1024)}MB)"
         
-        try:
-            # 尝试打开图像文件
-            with Image.open(file_path) as img:
-                img.verify()
-            return True, "文件验证通过"
-        except Exception as e:
-            return False, f"图像文件损坏: {str(e)}"
+        # 仅解析文件头，避免 PIL 完整解码
+        if image_probe.probe_file(file_path, count_frames=False) is None:
+            return False, f"图像文件损坏或文件头无法识别: {file_path}"
+        return True, "文件验证通过"
     
     def encode_image_to_base64(self, file_path: str) -> Optional[str]:
         """将图像文件编码为 base64"""
@@ -77,16 +248,27 @@ class ImageProcessor:
                     logger.error(f"图像验证失败: {message}")
                 return None
             
-            # 读取文件并编码
+            # 读取文件
             with open(file_path, 'rb') as image_file:
                 image_data = image_file.read()
-                encoded_string = base64.b64encode(image_data).decode('utf-8')
             
-            # 获取 MIME 类型
-            mime_type, _ = mimetypes.guess_type(file_path)
+            # 获取 MIME 类型：优先使用文件头探测结果，扩展名仅作兜底
+            probe_info = image_probe.probe_bytes(image_data, count_frames=False)
+            if probe_info and self.strip_metadata:
+                image_data = self.slim_image_bytes(image_data, probe_info['format'])
+            if probe_info:
+                mime_type = probe_info['mime_type']
+            else:
+                mime_type, _ = mimetypes.guess_type(file_path)
             if not mime_type:
                 mime_type = 'image/jpeg'  # 默认类型
             
+            if self.auto_crop:
+                cropped = self._auto_crop_bytes(image_data)
+                if cropped:
+                    image_data, mime_type = cropped
+            encoded_string = base64.b64encode(image_data).decode('utf-8')
+            
             return f"data:{mime_type};base64,{encoded_string}"
             
         except Exception as e:
@@ -94,6 +276,158 @@ class ImageProcessor:
                 logger.error(f"图像编码失败: {e}")
             return None
     
+    def slim_image_bytes(self, image_data: bytes, image_format: Optional[str]) -> bytes:
+        """
+        删除与显示无关的元数据段（不重新编码像素）
+
+        带 EXIF 方向的 JPEG 默认保留只含方向标记的最小 EXIF 段（无损）；开启 normalize_orientation 时
+        转置像素后重新编码（沿用原始量化表与色度采样，但仍有损失），次数计入 reoriented_lossy
+        """
+        slimmed, orientation = strip_metadata(image_data, image_format, keep_orientation=not self.normalize_orientation)
+        kept = reoriented = False
+        if orientation != 1 and not self.normalize_orientation:
+            kept = True
+        elif orientation != 1:
+            try:
+                slimmed = self._apply_jpeg_orientation(slimmed, orientation)
+                reoriented = True
+            except Exception as e:
+                # 矫正失败时保留原始数据，避免丢失方向信息
+                if LOGGER_AVAILABLE:
+                    logger.warning(f"EXIF 方向矫正失败，保留原始数据: {e}")
+                slimmed = image_data
+        
+        saved = len(image_data) - len(slimmed)
+        with self._slim_lock:
+            self._slim_stats['images'] += 1
+            self._slim_stats['bytes_before'] += len(image_data)
+            self._slim_stats['bytes_saved'] += saved
+            self._slim_stats['orientation_kept'] += kept
+            self._slim_stats['reoriented_lossy'] += reoriented
+        if LOGGER_AVAILABLE and (saved or reoriented):
+            logger.debug("元数据已精简", **{"bytes_before": len(image_data), "bytes_saved": saved, "orientation": orientation})
+        return slimmed
+    
+    @staticmethod
+    def _apply_jpeg_orientation(image_data: bytes, orientation: int) -> bytes:
+        with Image.open(io.BytesIO(image_data)) as img:
+            save_options: Dict[str, Any] = {'format': 'JPEG', 'qtables': img.quantization}
+            subsampling = JpegImagePlugin.get_sampling(img)
+            if subsampling >= 0:
+                save_options['subsampling'] = subsampling
+            if img.info.get('icc_profile'):
+                save_options['icc_profile'] = img.info['icc_profile']
+            transposed = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+        buffer = io.BytesIO()
+        transposed.save(buffer, **save_options)
+        return buffer.getvalue()
+    
+    def auto_crop_box(self, image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+        """
+        检测纯色边框，返回加上边距后的内容区域；没有可裁的边框或节省面积不足时返回 None
+
+        在降采样图上以四角的众数颜色为背景，逐像素求差并阈值化后取包围盒（均由 PIL 在 C 层完成）
+        """
+        width, height = image.size
+        factor = max(1, -(-max(width, height) // AUTO_CROP_PROBE_SIZE))
+        probe = image.convert('RGB')
+        if factor > 1:
+            probe = probe.reduce(factor)
+        probe_width, probe_height = probe.size
+        corners = [probe.getpixel(point) for point in
+                   ((0, 0), (probe_width - 1, 0), (0, probe_height - 1), (probe_width - 1, probe_height - 1))]
+        background, votes = Counter(corners).most_common(1)[0]
+        if votes < 2:
+            return None
+        
+        difference = ImageChops.difference(probe, Image.new('RGB', probe.size, background))
+        tolerance = self.auto_crop_tolerance
+        mask = difference.convert('L').point(lambda value: 255 if value > tolerance else 0)
+        bbox = mask.getbbox()
+        if bbox is None:
+            return None
+        
+        padding = self.auto_crop_padding
+        box = (
+            max(bbox[0] * factor - padding, 0),
+            max(bbox[1] * factor - padding, 0),
+            min(bbox[2] * factor + padding, width),
+            min(bbox[3] * factor + padding, height)
+        )
+        if (box[2] - box[0]) * (box[3] - box[1]) > width * height * AUTO_CROP_MAX_AREA_RATIO:
+            return None
+        return box
+    
+    def apply_auto_crop(self, image: Image.Image) -> Image.Image:
+        """启用自动裁边时裁去纯色边框，否则原样返回"""
+        if not self.auto_crop:
+            return image
+        box = self.auto_crop_box(image)
+        if box is None:
+            return image
+        cropped = image.crop(box)
+        self._record_auto_crop(image.size, box)
+        return cropped
+    
+    def _record_auto_crop(self, size: Tuple[int, int], box: Tuple[int, int, int, int]):
+        with self._slim_lock:
+            self._slim_stats['auto_cropped'] += 1
+            self._slim_stats['pixels_removed'] += size[0] * size[1] - (box[2] - box[0]) * (box[3] - box[1])
+        if LOGGER_AVAILABLE:
+            logger.debug("自动裁边", **{"size": size, "box": box})
+    
+    def _auto_crop_bytes(self, image_data: bytes) -> Optional[Tuple[bytes, str]]:
+        """对原样上传的图像自动裁边；裁剪后需要重新编码，仅在结果更小时采用"""
+        with Image.open(io.BytesIO(image_data)) as img:
+            if getattr(img, 'is_animated', False):
+                return None
+            # 重新编码会丢弃保留的 EXIF 方向，因此先按方向转置（此处本就需要重新编码，不额外引入损失）
+            oriented = ImageOps.exif_transpose(img)
+            box = self.auto_crop_box(oriented)
+            if box is None:
+                return None
+            cropped = oriented.crop(box)
+        if cropped.mode not in ('RGB', 'L'):
+            cropped = cropped.convert('RGB')
+        compressed = self.compress_image_auto(cropped, 90, hashlib.sha1(image_data).hexdigest())
+        if not compressed or len(compressed[0]) >= len(image_data):
+            return None
+        self._record_auto_crop(oriented.size, box)
+        return compressed
+    
+    def get_slim_stats(self) -> Dict[str, Any]:
+        """元数据精简统计（处理图像数、原始字节数、节省字节数、保留方向与有损矫正次数）及各编码格式的选用次数"""
+        with self._slim_lock:
+            return dict(self._slim_stats, codecs=dict(self._codec_stats))
+    
+    def get_file_payload(self, file_path: str, with_hash: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        获取本地图像的上传载荷 {'data_url', 'image_info', 'dhash'}，命中缓存时不再读取和编码
+
+        with_hash 为 True 时同时计算感知哈希；文件无效或编码失败时返回 None
+        """
+        try:
+            identity = self.get_file_identity(file_path)
+        except OSError:
+            return None
+        entry = self.payload_cache.get(identity) if self.payload_cache.max_bytes else None
+        if entry is not None:
+            if with_hash and entry.get('dhash') is None:
+                entry['dhash'] = compute_file_dhash(file_path)
+            return entry
+        
+        data_url = self.encode_image_to_base64(file_path)
+        if not data_url:
+            return None
+        entry = {
+            'data_url': data_url,
+            'image_info': self.get_image_info(file_path) or {},
+            'dhash': compute_file_dhash(file_path) if with_hash else None
+        }
+        if self.payload_cache.max_bytes:
+            self.payload_cache.put(identity, entry)
+        return entry
+    
     def decode_base64_to_image(self, base64_string: str) -> Optional[Image.Image]:
         """将 base64 字符串解码为 PIL 图像对象"""
         try:
@@ -115,6 +449,77 @@ class ImageProcessor:
                 logger.error(f"Base64 解码失败: {e}")
             return None
     
+    def prepare_base64_for_api(self, base64_string: str, max_size: int = 1024, quality: int = 85) -> Optional[Dict[str, Any]]:
+        """
+        处理内联 base64 / data URL 图像以供 API 使用
+
+        仅解码头部做格式探测；满足大小限制时原样转发，不做解码和重新编码，
+        超出限制时才通过 decode_base64_to_image 解码并缩放压缩
+        """
+        try:
+            # 拆分 data URL 前缀并去除换行等空白字符
+            base64_data = base64_string.strip()
+            if base64_data.startswith('data:'):
+                _, _, base64_data = base64_data.partition(',')
+            if any(c.isspace() for c in base64_data):
+                base64_data = ''.join(base64_data.split())
+            if not base64_data:
+                if LOGGER_AVAILABLE:
+                    logger.error("内联图像数据为空")
+                return None
+
+            # 先只解码头部探测，JPEG 等头部段较大时再回退到完整解码
+            head_length = min(len(base64_data), 64 * 1024) // 4 * 4
+            probe_info = image_probe.probe_bytes(base64.b64decode(base64_data[:head_length]), count_frames=False)
+            if not probe_info and head_length < len(base64_data):
+                probe_info = image_probe.probe_bytes(base64.b64decode(base64_data), count_frames=False)
+            if not probe_info:
+                if LOGGER_AVAILABLE:
+                    logger.error("内联图像数据无法识别")
+                return None
+
+            decoded_size = len(base64_data) * 3 // 4 - base64_data[-2:].count('=')
+            image_info = dict(probe_info, file_size=decoded_size)
+
+            if decoded_size <= self.max_file_size:
+                if LOGGER_AVAILABLE:
+                    logger.info(f"内联图像直接转发: {probe_info['format']} {probe_info['size']}, {decoded_size} 字节")
+                return {
+                    'base64': f"data:{probe_info['mime_type']};base64,{base64_data}",
+                    'original_info': image_info,
+                    'passthrough': True
+                }
+
+            # 超出大小限制，解码后缩放压缩
+            image = self.decode_base64_to_image(base64_data)
+            if image is None:
+                return None
+            with image:
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                resized_img = self.resize_image(self.apply_auto_crop(image), max_size, max_size)
+                cache_key = (hashlib.sha1(base64_data.encode('ascii')).hexdigest(), max_size, quality)
+                compressed = self.compress_image_auto(resized_img, quality, cache_key)
+            if not compressed:
+                return None
+            compressed_data, mime_type = compressed
+
+            if LOGGER_AVAILABLE:
+                logger.info(f"内联图像已压缩: {decoded_size} -> {len(compressed_data)} 字节 ({mime_type})")
+            encoded_string = base64.b64encode(compressed_data).decode('utf-8')
+            return {
+                'base64': f"data:{mime_type};base64,{encoded_string}",
+                'original_info': image_info,
+                'processed_size': resized_img.size,
+                'compressed_size': len(compressed_data),
+                'passthrough': False
+            }
+
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"内联图像处理失败: {e}")
+            return None
+
     def resize_image(self, image: Image.Image, max_width: int = 1024, max_height: int = 1024) -> Image.Image:
         """调整图像大小"""
         try:
@@ -147,17 +552,121 @@ class ImageProcessor:
                 logger.error(f"图像压缩失败: {e}")
             return None
     
+    def _candidate_codecs(self) -> List[str]:
+        codecs = []
+        for name in self.output_formats:
+            if name == 'webp' and not features.check('webp'):
+                continue
+            codecs.extend(_FORMAT_CODECS.get(name, ()))
+        return codecs or ['jpeg']
+    
+    def encode_with_codec(self, image: Image.Image, codec: str, quality: int = 85) -> Optional[bytes]:
+        """按指定编码方式编码图像（image 应为 RGB 或 L 模式）"""
+        try:
+            buffer = io.BytesIO()
+            if codec == 'jpeg':
+                image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            elif codec == 'webp':
+                image.save(buffer, format='WEBP', quality=quality, method=4)
+            elif codec == 'webp_lossless':
+                image.save(buffer, format='WEBP', lossless=True, quality=80, method=4)
+            elif codec == 'png':
+                image.save(buffer, format='PNG', optimize=True)
+            elif codec == 'png_palette':
+                palette = image if image.mode == 'L' else image.quantize(256)
+                palette.save(buffer, format='PNG', optimize=True)
+            else:
+                raise ValueError(f"未知编码方式: {codec}")
+            return buffer.getvalue()
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"图像编码失败 ({codec}): {e}")
+            return None
+    
+    def select_codec(self, image: Image.Image, quality: int = 85, cache_key: Any = None) -> str:
+        """
+        在允许的输出格式中选择编码方式
+
+        在缩小的探测图上试编码每个候选，有损候选需达到 codec_min_ssim，取体积最小者；
+        选择结果按 cache_key（源图像标识）缓存
+        """
+        candidates = self._candidate_codecs()
+        if len(candidates) == 1:
+            return candidates[0]
+        if cache_key is not None:
+            with self._slim_lock:
+                codec = self._codec_cache.get(cache_key)
+                if codec is not None:
+                    self._codec_cache.move_to_end(cache_key)
+                    return codec
+        
+        probe = image.copy()
+        probe.thumbnail((CODEC_PROBE_SIZE, CODEC_PROBE_SIZE), Image.Resampling.BILINEAR)
+        best: Optional[Tuple[int, str]] = None
+        for codec in candidates:
+            data = self.encode_with_codec(probe, codec, quality)
+            if data is None or (best is not None and len(data) >= best[0]):
+                continue
+            if codec not in _LOSSLESS_CODECS:
+                with Image.open(io.BytesIO(data)) as decoded:
+                    if structural_similarity(probe, decoded) < self.codec_min_ssim:
+                        continue
+            best = (len(data), codec)
+        codec = best[1] if best else 'jpeg'
+        
+        if cache_key is not None:
+            with self._slim_lock:
+                self._codec_cache[cache_key] = codec
+                while len(self._codec_cache) > CODEC_CACHE_SIZE:
+                    self._codec_cache.popitem(last=False)
+        return codec
+    
+    def compress_image_auto(self, image: Image.Image, quality: int = 85,
+                            cache_key: Any = None) -> Optional[Tuple[bytes, str]]:
+        """按编码选择（未启用时为 JPEG）压缩图像，返回 (编码数据, MIME 类型)"""
+        codec = self.select_codec(image, quality, cache_key) if self.codec_select else 'jpeg'
+        data = self.encode_with_codec(image, codec, quality)
+        if data is None and codec != 'jpeg':
+            codec = 'jpeg'
+            data = self.encode_with_codec(image, codec, quality)
+        if data is None:
+            return None
+        with self._slim_lock:
+            self._codec_stats[codec] = self._codec_stats.get(codec, 0) + 1
+        return data, _CODEC_MIME_TYPES[codec]
+    
     def get_image_info(self, file_path: str) -> Optional[Dict[str, Any]]:
         """获取图像信息"""
+        probe_info = image_probe.probe_file(file_path)
+        if probe_info:
+            return {
+                'filename': os.path.basename(file_path),
+                'format': probe_info['format'],
+                'mime_type': probe_info['mime_type'],
+                'mode': probe_info['mode'],
+                'size': probe_info['size'],
+                'width': probe_info['width'],
+                'height': probe_info['height'],
+                'frames': probe_info['frames'],
+                'is_animated': probe_info['is_animated'],
+                'file_size': self.get_file_size(file_path),
+                'has_transparency': probe_info['has_transparency']
+            }
+        
+        # 文件头无法解析时回退到 PIL
         try:
             with Image.open(file_path) as img:
+                frames = getattr(img, 'n_frames', 1)
                 info = {
                     'filename': os.path.basename(file_path),
                     'format': img.format,
+                    'mime_type': Image.MIME.get(img.format, 'image/jpeg'),
                     'mode': img.mode,
                     'size': img.size,
                     'width': img.width,
                     'height': img.height,
+                    'frames': frames,
+                    'is_animated': frames > 1,
                     'file_size': self.get_file_size(file_path),
                     'has_transparency': img.mode in ('RGBA', 'LA') or 'transparency' in img.info
                 }
@@ -188,19 +697,26 @@ class ImageProcessor:
             
             # 打开图像
             with Image.open(file_path) as img:
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                # 裁去纯色边框后再缩放，内容区域获得更高的有效分辨率
+                img = self.apply_auto_crop(img)
                 # 调整大小
                 resized_img = self.resize_image(img, max_size, max_size)
                 
-                # 压缩图像
-                compressed_data = self.compress_image(resized_img, quality)
-                if not compressed_data:
+                # 压缩图像：启用编码选择时按源文件缓存所选格式
+                cache_key = (self.get_file_identity(file_path), max_size, quality)
+                compressed = self.compress_image_auto(resized_img, quality, cache_key)
+                if not compressed:
                     return None
+                compressed_data, mime_type = compressed
                 
                 # 编码为 base64
                 encoded_string = base64.b64encode(compressed_data).decode('utf-8')
                 
                 result = {
-                    'base64': f"data:image/jpeg;base64,{encoded_string}",
+                    'base64': f"data:{mime_type};base64,{encoded_string}",
+                    'mime_type': mime_type,
                     'original_info': original_info,
                     'processed_size': resized_img.size,
                     'compressed_size': len(compressed_data),
@@ -219,48 +735,582 @@ class ImageProcessor:
                 logger.error(f"图像处理失败: {e}")
             return None
     
-    def create_thumbnail(self, file_path: str, size: Tuple[int, int] = (200, 200)) -> Optional[str]:
-        """创建缩略图并返回 base64 编码"""
+    @staticmethod
+    def compute_tile_boxes(width: int, height: int, tile_size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+        """计算带重叠的分块区域，分块均匀分布且重叠不小于 overlap"""
+        def positions(length: int) -> List[int]:
+            if length <= tile_size:
+                return [0]
+            step = max(tile_size - overlap, 1)
+            count = -(-(length - overlap) // step)
+            return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+        
+        return [
+            (left, top, min(left + tile_size, width), min(top + tile_size, height))
+            for top in positions(height)
+            for left in positions(width)
+        ]
+    
+    def create_tiles(self, file_path: str, tile_size: int = 1024, overlap: int = 128, quality: int = 85,
+                     max_file_size: Optional[int] = None, overview_size: int = 1024) -> Optional[Dict[str, Any]]:
+        """按原始分辨率将大图切分为重叠分块，并生成用于汇总的缩略总览图"""
         try:
+            is_valid, message = self.validate_image_file(file_path, max_file_size)
+            if not is_valid:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"图像验证失败: {message}")
+                return None
+            
             with Image.open(file_path) as img:
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                width, height = img.size
+                boxes = self.compute_tile_boxes(width, height, tile_size, overlap)
+                
+                tiles = []
+                for index, box in enumerate(boxes):
+                    tile_data = self.compress_image(img.crop(box), quality)
+                    if not tile_data:
+                        return None
+                    encoded_string = base64.b64encode(tile_data).decode('utf-8')
+                    tiles.append({
+                        'index': index,
+                        'box': box,
+                        'base64': f"data:image/jpeg;base64,{encoded_string}",
+                        'compressed_size': len(tile_data)
+                    })
+                
+                overview_data = self.compress_image(self.resize_image(img, overview_size, overview_size), quality)
+                if not overview_data:
+                    return None
+            
+            columns = len({box[0] for box in boxes})
+            if LOGGER_AVAILABLE:
+                logger.info(f"图像分块完成: {file_path} | {width}x{height} -> {len(tiles)} 块")
+            return {
+                'tiles': tiles,
+                'grid': (columns, len(tiles) // columns),
+                'size': (width, height),
+                'overview': f"data:image/jpeg;base64,{base64.b64encode(overview_data).decode('utf-8')}"
+            }
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"图像分块失败: {e}")
+            return None
+    
+    @staticmethod
+    def get_file_identity(file_path: str) -> Tuple[str, int, int]:
+        """文件身份标识：绝对路径、修改时间（纳秒）和大小"""
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+    
+    def build_image_pyramid(self, file_path: str, min_size: int = 256,
+                            max_file_size: Optional[int] = None) -> Optional[List[Image.Image]]:
+        """构建图像金字塔（第 0 层为原始分辨率，逐层减半直到长边不超过 min_size），每个文件只解码一次"""
+        try:
+            is_valid, message = self.validate_image_file(file_path, max_file_size)
+            if not is_valid:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"图像验证失败: {message}")
+                return None
+            
+            key = self.get_file_identity(file_path)
+            with self._pyramid_lock:
+                levels = self._pyramid_cache.get(key)
+                if levels is not None:
+                    self._pyramid_cache.move_to_end(key)
+                    return levels
+            
+            with Image.open(file_path) as img:
+                base = img.convert('RGB') if img.mode not in ('RGB', 'L') else img.copy()
+            levels = [base]
+            while max(levels[-1].size) > min_size:
+                levels.append(levels[-1].reduce(2))
+            
+            with self._pyramid_lock:
+                self._pyramid_cache[key] = levels
+                while len(self._pyramid_cache) > self.pyramid_cache_size:
+                    self._pyramid_cache.popitem(last=False)
+            
+            if LOGGER_AVAILABLE:
+                logger.info(f"图像金字塔已构建: {file_path} | {base.size} | {len(levels)} 层")
+            return levels
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"构建图像金字塔失败: {e}")
+            return None
+    
+    def encode_pyramid_region(self, file_path: str, box: Optional[Tuple[float, float, float, float]] = None,
+                              max_size: int = 1024, quality: int = 85,
+                              max_file_size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        从图像金字塔中裁剪区域并编码
+
+        box 为相对整图的比例坐标 (x0, y0, x1, y1)，为空时取整图；
+        选择能提供不低于 max_size 分辨率的最小层级，避免在原图上做不必要的缩放
+        """
+        levels = self.build_image_pyramid(file_path, max_file_size=max_file_size)
+        if not levels:
+            return None
+        
+        try:
+            width, height = levels[0].size
+            x0, y0, x1, y1 = box or (0.0, 0.0, 1.0, 1.0)
+            pixel_box = (
+                int(x0 * width), int(y0 * height),
+                max(int(round(x1 * width)), int(x0 * width) + 1),
+                max(int(round(y1 * height)), int(y0 * height) + 1)
+            )
+            region_size = max(pixel_box[2] - pixel_box[0], pixel_box[3] - pixel_box[1])
+            
+            level = 0
+            for index in range(len(levels) - 1, -1, -1):
+                if region_size / (2 ** index) >= max_size:
+                    level = index
+                    break
+            
+            scale = levels[level].size[0] / width
+            level_width, level_height = levels[level].size
+            level_box = (
+                min(int(pixel_box[0] * scale), level_width - 1),
+                min(int(pixel_box[1] * scale), level_height - 1),
+                min(max(int(round(pixel_box[2] * scale)), int(pixel_box[0] * scale) + 1), level_width),
+                min(max(int(round(pixel_box[3] * scale)), int(pixel_box[1] * scale) + 1), level_height)
+            )
+            region = self.resize_image(levels[level].crop(level_box), max_size, max_size)
+            compressed_data = self.compress_image(region, quality)
+            if not compressed_data:
+                return None
+            
+            return {
+                'base64': f"data:image/jpeg;base64,{base64.b64encode(compressed_data).decode('utf-8')}",
+                'box': pixel_box,
+                'level': level,
+                'processed_size': region.size,
+                'compressed_size': len(compressed_data)
+            }
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"金字塔区域编码失败: {e}")
+            return None
+    
+    def has_cached_pyramid(self, file_path: str) -> bool:
+        """检查文件是否已有缓存的已解码金字塔"""
+        try:
+            key = self.get_file_identity(file_path)
+        except OSError:
+            return False
+        with self._pyramid_lock:
+            return key in self._pyramid_cache
+    
+    def crop_region(self, file_path: str, box: Tuple[float, float, float, float], target_size: int = 1024,
+                    quality: int = 85) -> Optional[Dict[str, Any]]:
+        """
+        裁剪感兴趣区域并编码
+
+        box 全部不大于 1 时视为比例坐标，否则视为像素坐标。已有缓存金字塔时直接复用；
+        否则 JPEG 通过 draft 在解码阶段按 2 的幂降采样，只解码所需分辨率
+        """
+        try:
+            is_valid, message = self.validate_image_file(file_path)
+            if not is_valid:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"图像验证失败: {message}")
+                return None
+            
+            probe_info = image_probe.probe_file(file_path, count_frames=False)
+            width, height = probe_info['size']
+            if all(0.0 <= float(v) <= 1.0 for v in box):
+                pixel_box = (box[0] * width, box[1] * height, box[2] * width, box[3] * height)
+            else:
+                pixel_box = tuple(float(v) for v in box)
+            x0, y0 = max(int(pixel_box[0]), 0), max(int(pixel_box[1]), 0)
+            x1, y1 = min(int(round(pixel_box[2])), width), min(int(round(pixel_box[3])), height)
+            if x1 <= x0 or y1 <= y0:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"裁剪区域无效: {box}")
+                return None
+            
+            if self.has_cached_pyramid(file_path):
+                return self.encode_pyramid_region(
+                    file_path, (x0 / width, y0 / height, x1 / width, y1 / height), target_size, quality
+                )
+            
+            with Image.open(file_path) as img:
+                region_size = max(x1 - x0, y1 - y0)
+                if region_size > target_size:
+                    # 仅 JPEG 生效：解码时直接缩小到不低于目标分辨率的尺度
+                    ratio = target_size / region_size
+                    img.draft('RGB', (int(width * ratio) + 1, int(height * ratio) + 1))
+                scale = img.size[0] / width
+                region = img.crop((
+                    int(x0 * scale), int(y0 * scale),
+                    max(int(round(x1 * scale)), int(x0 * scale) + 1),
+                    max(int(round(y1 * scale)), int(y0 * scale) + 1)
+                ))
+            if region.mode not in ('RGB', 'L'):
+                region = region.convert('RGB')
+            region = self.resize_image(region, target_size, target_size)
+            compressed_data = self.compress_image(region, quality)
+            if not compressed_data:
+                return None
+            
+            if LOGGER_AVAILABLE:
+                logger.info(f"区域裁剪完成: {file_path} | {(x0, y0, x1, y1)} -> {region.size}")
+            return {
+                'base64': f"data:image/jpeg;base64,{base64.b64encode(compressed_data).decode('utf-8')}",
+                'box': (x0, y0, x1, y1),
+                'processed_size': region.size,
+                'compressed_size': len(compressed_data)
+            }
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"区域裁剪失败: {e}")
+            return None
+    
+    def sample_keyframes(self, file_path: str, max_frames: int = 6, min_distance: int = 6,
+                         max_size: int = 512) -> Optional[Dict[str, Any]]:
+        """
+        从动画中抽取关键帧
+
+        第一帧固定为关键帧，其余时间轴均分为 max_frames - 1 段，每段均匀采样若干帧，
+        取与上一关键帧 dHash 距离最大且不小于 min_distance 的采样帧作为该段的关键帧（无变化的段不选），
+        使关键帧覆盖整个动画；最后一段选中第一个足够不同的帧后即停止解码，不再读到文件末尾；
+        内存中只保留缩小后的关键帧与当前段的候选帧
+        """
+        try:
+            is_valid, message = self.validate_image_file(file_path)
+            if not is_valid:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"图像验证失败: {message}")
+                return None
+            
+            # 帧数取自文件头探测，无需预先解码全部帧
+            total_frames = image_probe.probe_file(file_path)['frames']
+            sample_count = min(total_frames, max_frames * 4)
+            positions = sorted({index * total_frames // sample_count for index in range(sample_count)})
+            segments = max(max_frames - 1, 1)
+            
+            keyframes = []
+            last_hash = None
+            sampled = 0
+            # 当前段的最佳候选：(距离, 帧序号, 帧, 哈希)
+            candidate = None
+            current_segment = None
+            
+            def commit(index, frame, frame_hash):
+                frame.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                keyframes.append({'index': index, 'image': frame})
+                return frame_hash
+            
+            with Image.open(file_path) as img:
+                for index in positions:
+                    try:
+                        img.seek(index)
+                    except EOFError:
+                        break
+                    sampled += 1
+                    frame = img.convert('RGB')
+                    frame_hash = compute_dhash(frame)
+                    if last_hash is None:
+                        last_hash = commit(index, frame, frame_hash)
+                        if max_frames <= 1:
+                            break
+                        continue
+                    segment = index * segments // total_frames
+                    if segment != current_segment:
+                        if candidate is not None:
+                            last_hash = commit(*candidate[1:])
+                            candidate = None
+                        current_segment = segment
+                    distance = hamming_distance(frame_hash, last_hash)
+                    if distance >= min_distance and segment == segments - 1:
+                        # 最后一段的关键帧选定后名额已满，后续帧无需再解码
+                        commit(index, frame, frame_hash)
+                        candidate = None
+                        break
+                    if distance >= min_distance and (candidate is None or distance > candidate[0]):
+                        candidate = (distance, index, frame, frame_hash)
+                if candidate is not None:
+                    commit(*candidate[1:])
+            
+            if LOGGER_AVAILABLE:
+                logger.info(f"关键帧抽取完成: {file_path} | 共 {total_frames} 帧，采样 {sampled} 帧，保留 {len(keyframes)} 帧")
+            return {
+                'keyframes': keyframes,
+                'total_frames': total_frames,
+                'sampled_frames': sampled
+            }
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"关键帧抽取失败: {e}")
+            return None
+    
+    def encode_image(self, image: Image.Image, quality: int = 85) -> Optional[str]:
+        """将 PIL 图像编码为 JPEG data URL"""
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        compressed_data = self.compress_image(image, quality)
+        if not compressed_data:
+            return None
+        return f"data:image/jpeg;base64,{base64.b64encode(compressed_data).decode('utf-8')}"
+    
+    def create_contact_sheet(self, images: List[Image.Image], labels: List[str], cell_size: int = 256,
+                             columns: Optional[int] = None, quality: int = 85) -> Optional[Dict[str, Any]]:
+        """将多张图像拼接为带编号标签的网格图"""
+        try:
+            count = len(images)
+            if count == 0:
+                return None
+            columns = columns or math.ceil(math.sqrt(count))
+            rows = math.ceil(count / columns)
+            padding = 4
+            
+            sheet = Image.new('RGB', (columns * cell_size, rows * cell_size), 'white')
+            draw = ImageDraw.Draw(sheet)
+            try:
+                font = ImageFont.load_default(size=max(cell_size // 10, 12))
+            except TypeError:
+                font = ImageFont.load_default()
+            
+            for position, (image, label) in enumerate(zip(images, labels)):
+                row, column = divmod(position, columns)
+                left, top = column * cell_size, row * cell_size
+                
+                thumb = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+                thumb.thumbnail((cell_size - 2 * padding, cell_size - 2 * padding), Image.Resampling.LANCZOS)
+                sheet.paste(thumb, (left + (cell_size - thumb.width) // 2, top + (cell_size - thumb.height) // 2))
+                
+                # 左上角绘制编号标签，外框区分单元格
+                text_box = draw.textbbox((0, 0), label, font=font)
+                label_box = (left + padding, top + padding,
+                             left + padding + text_box[2] - text_box[0] + 8, top + padding + text_box[3] - text_box[1] + 8)
+                draw.rectangle(label_box, fill='black')
+                draw.text((label_box[0] + 4 - text_box[0], label_box[1] + 4 - text_box[1]), label, fill='yellow', font=font)
+                draw.rectangle((left, top, left + cell_size - 1, top + cell_size - 1), outline='gray')
+            
+            compressed_data = self.compress_image(sheet, quality)
+            if not compressed_data:
+                return None
+            return {
+                'base64': f"data:image/jpeg;base64,{base64.b64encode(compressed_data).decode('utf-8')}",
+                'grid': (columns, rows),
+                'size': sheet.size,
+                'compressed_size': len(compressed_data)
+            }
+            
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"创建网格图失败: {e}")
+            return None
+    
+    @staticmethod
+    def cluster_changed_blocks(grid: bytes, columns: int, rows: int, gap: int = 1) -> List[Tuple[int, int, int, int]]:
+        """
+        将变化块聚类为包围盒（块坐标，右下为开区间）
+
+        相距不超过 gap 个块的变化块归为同一区域，使同一处改动的零散块合并
+        """
+        seen = bytearray(len(grid))
+        boxes = []
+        for start in range(len(grid)):
+            if not grid[start] or seen[start]:
+                continue
+            seen[start] = 1
+            stack = [start]
+            x0 = x1 = start % columns
+            y0 = y1 = start // columns
+            while stack:
+                index = stack.pop()
+                x, y = index % columns, index // columns
+                x0, x1, y0, y1 = min(x0, x), max(x1, x), min(y0, y), max(y1, y)
+                for ny in range(max(y - gap, 0), min(y + gap + 1, rows)):
+                    for nx in range(max(x - gap, 0), min(x + gap + 1, columns)):
+                        neighbor = ny * columns + nx
+                        if grid[neighbor] and not seen[neighbor]:
+                            seen[neighbor] = 1
+                            stack.append(neighbor)
+            boxes.append((x0, y0, x1 + 1, y1 + 1))
+        return boxes
+    
+    @staticmethod
+    def merge_boxes(boxes: List[Tuple[int, int, int, int]], max_boxes: int) -> List[Tuple[int, int, int, int]]:
+        """合并相互重叠的包围盒，数量仍超过 max_boxes 时反复合并使总面积增量最小的一对"""
+        def union(a, b):
+            return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+        
+        def area(box):
+            return (box[2] - box[0]) * (box[3] - box[1])
+        
+        boxes = list(boxes)
+        while len(boxes) > 1:
+            best = None
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    overlaps = a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+                    cost = -1 if overlaps else area(union(a, b)) - area(a) - area(b)
+                    if best is None or cost < best[0]:
+                        best = (cost, i, j)
+            cost, i, j = best
+            if cost >= 0 and len(boxes) <= max_boxes:
+                break
+            merged = union(boxes[i], boxes[j])
+            boxes = [box for k, box in enumerate(boxes) if k not in (i, j)] + [merged]
+        return sorted(boxes, key=lambda box: (box[1], box[0]))
+    
+    def diff_images(self, path_a: str, path_b: str, block_size: int = 16, tolerance: int = 24,
+                    max_regions: int = 4, region_size: int = 1024, context_size: int = 512) -> Optional[Dict[str, Any]]:
+        """
+        比较两张同尺寸图像，只编码变化区域
+
+        逐像素求差并阈值化后按 block_size 降采样为块网格，变化块聚类为最多 max_regions 个区域；
+        每个区域编码一张「变化前 | 变化后」对照图，另附标出各区域编号的缩小总览图。尺寸不一致时抛出 ValueError
+        """
+        try:
+            for path in (path_a, path_b):
+                is_valid, message = self.validate_image_file(path)
+                if not is_valid:
+                    raise ValueError(message)
+            with Image.open(path_a) as img:
+                before = img.convert('RGB')
+            with Image.open(path_b) as img:
+                after = img.convert('RGB')
+        except ValueError:
+            raise
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"图像差异比较失败: {e}")
+            return None
+        if before.size != after.size:
+            raise ValueError(f"两张图像尺寸不一致: {before.size} 与 {after.size}")
+        
+        width, height = after.size
+        block_size = max(min(block_size, width, height), 1)
+        mask = ImageChops.difference(before, after).convert('L').point(lambda value: 255 if value > tolerance else 0)
+        grid_image = mask.reduce(block_size) if block_size > 1 else mask
+        columns, rows = grid_image.size
+        grid = grid_image.tobytes()
+        changed_blocks = sum(1 for value in grid if value)
+        
+        # 零散变化过多时放宽聚类间距，控制后续两两合并的开销
+        gap = 1
+        block_boxes = self.cluster_changed_blocks(grid, columns, rows, gap)
+        while len(block_boxes) > 64 and gap < 16:
+            gap *= 2
+            block_boxes = self.cluster_changed_blocks(grid, columns, rows, gap)
+        block_boxes = self.merge_boxes(block_boxes, max(max_regions, 1))
+        pixel_boxes = [
+            (max(x0 * block_size - block_size // 2, 0), max(y0 * block_size - block_size // 2, 0),
+             min(x1 * block_size + block_size // 2, width), min(y1 * block_size + block_size // 2, height))
+            for x0, y0, x1, y1 in block_boxes
+        ]
+        result: Dict[str, Any] = {
+            'size': (width, height),
+            'changed_ratio': changed_blocks / (columns * rows) if columns * rows else 0.0,
+            'regions': [],
+            'context': None,
+            'payload_bytes': 0,
+            'full_bytes': self.get_file_size(path_a) + self.get_file_size(path_b)
+        }
+        if not pixel_boxes:
+            return result
+        
+        try:
+            font = ImageFont.load_default(size=max(context_size // 24, 12))
+        except TypeError:
+            font = ImageFont.load_default()
+        separator = 8
+        for box in pixel_boxes:
+            region_before = self.resize_image(before.crop(box), region_size, region_size)
+            region_after = self.resize_image(after.crop(box), region_size, region_size)
+            # 宽区域上下排列，其余左右排列
+            stacked = region_after.width > region_after.height
+            if stacked:
+                pair = Image.new('RGB', (region_after.width, region_after.height * 2 + separator), 'gray')
+                pair.paste(region_after, (0, region_after.height + separator))
+            else:
+                pair = Image.new('RGB', (region_after.width * 2 + separator, region_after.height), 'gray')
+                pair.paste(region_after, (region_after.width + separator, 0))
+            pair.paste(region_before, (0, 0))
+            encoded = self.compress_image_auto(pair)
+            if not encoded:
+                return None
+            data, mime_type = encoded
+            result['regions'].append({
+                'box': box,
+                'layout': 'stacked' if stacked else 'side_by_side',
+                'base64': f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+            })
+            result['payload_bytes'] += len(data)
+        
+        # 总览图：变化后的缩小图，红框与编号标出各区域
+        context = after.copy()
+        context.thumbnail((context_size, context_size), Image.Resampling.LANCZOS)
+        scale = context.width / width
+        draw = ImageDraw.Draw(context)
+        for number, box in enumerate(pixel_boxes, start=1):
+            scaled = tuple(int(value * scale) for value in box)
+            draw.rectangle(scaled, outline='red', width=2)
+            draw.text((scaled[0] + 3, scaled[1] + 2), str(number), fill='red', font=font)
+        encoded = self.compress_image_auto(context)
+        if not encoded:
+            return None
+        data, mime_type = encoded
+        result['context'] = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+        result['payload_bytes'] += len(data)
+        
+        if LOGGER_AVAILABLE:
+            logger.info(f"图像差异: {len(pixel_boxes)} 个变化区域，上传 {result['payload_bytes']} 字节（原图共 {result['full_bytes']} 字节）")
+        return result
+    
+    def create_thumbnail_image(self, file_path: str, size: Tuple[int, int] = (200, 200)) -> Optional[Image.Image]:
+        """创建缩略图并返回 RGB 模式的 PIL 图像（JPEG 使用 draft 降采样解码）"""
+        try:
+            with Image.open(file_path) as img:
+                img.draft('RGB', size)
                 # 创建缩略图
                 img.thumbnail(size, Image.Resampling.LANCZOS)
+                # 按 EXIF 方向矫正，重新编码后方向标记会丢失
+                thumbnail = ImageOps.exif_transpose(img)
                 
                 # 转换为 RGB 模式（如果需要）
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
-                # 保存到缓冲区
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=80)
-                
-                # 编码为 base64
-                encoded_string = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                return f"data:image/jpeg;base64,{encoded_string}"
+                if thumbnail.mode != 'RGB':
+                    return thumbnail.convert('RGB')
+                return thumbnail
                 
         except Exception as e:
             if LOGGER_AVAILABLE:
                 logger.error(f"创建缩略图失败: {e}")
             return None
+    
+    def create_thumbnail(self, file_path: str, size: Tuple[int, int] = (200, 200)) -> Optional[str]:
+        """创建缩略图并返回 base64 编码"""
+        thumbnail = self.create_thumbnail_image(file_path, size)
+        if thumbnail is None:
+            return None
+        return self.encode_image(thumbnail, quality=80)
 
     @staticmethod
     def validate_image_file_static(file_path: str) -> bool:
         """验证图像文件（静态方法）"""
-        processor = ImageProcessor()
-        is_valid, _ = processor.validate_image_file(file_path)
+        is_valid, _ = image_processor.validate_image_file(file_path)
         return is_valid
     
     @staticmethod
     def get_image_info_static(file_path: str) -> Optional[Dict[str, Any]]:
         """获取图像信息（静态方法）"""
-        processor = ImageProcessor()
-        return processor.get_image_info(file_path)
+        return image_processor.get_image_info(file_path)
     
     @staticmethod
     def create_image_data_url_static(file_path: str) -> Optional[str]:
         """创建图像 data URL（静态方法）"""
-        processor = ImageProcessor()
-        return processor.encode_image_to_base64(file_path)
+        return image_processor.encode_image_to_base64(file_path)
 
 # 创建全局图像处理器实例
 image_processor = ImageProcessor()
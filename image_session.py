@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+图像会话模块
+open_image 预处理一次图像并缓存其 data URL，后续 ask_image 按句柄复用，
+同时保存问答轮次作为多轮上下文；句柄按 LRU 与空闲时长淘汰
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class ImageSession:
+    """单个图像会话"""
+
+    def __init__(self, handle: str, image_data_url: str, image_info: Dict[str, Any]):
+        self.handle = handle
+        self.image_data_url = image_data_url
+        self.image_info = image_info
+        self.turns: List[Tuple[str, str]] = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def to_dict(self, ttl: int) -> Dict[str, Any]:
+        return {
+            'handle': self.handle,
+            'image_info': self.image_info,
+            'turns': len(self.turns),
+            'expires_in': max(int(self.last_used + ttl - time.time()), 0)
+        }
+
+
+class ImageSessionStore:
+    """图像会话存储（线程安全）"""
+
+    def __init__(self, max_sessions: int = 32, ttl: int = 1800, max_turns: int = 10):
+        """
+        Args:
+            max_sessions: 最多保留的会话数，超出时淘汰最久未使用的会话
+            ttl: 会话空闲多久后过期（秒）
+            max_turns: 作为上下文发送的最近问答轮数
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[str, ImageSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now: float):
+        expired = [handle for handle, session in self._sessions.items() if now - session.last_used > self.ttl]
+        for handle in expired:
+            del self._sessions[handle]
+
+    def open(self, image_data_url: str, image_info: Dict[str, Any]) -> ImageSession:
+        """创建会话并返回"""
+        session = ImageSession(uuid.uuid4().hex, image_data_url, image_info)
+        with self._lock:
+            self._purge_expired(session.created_at)
+            self._sessions[session.handle] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def get(self, handle: str) -> Optional[ImageSession]:
+        """按句柄取会话并刷新使用时间，不存在或已过期时返回 None"""
+        with self._lock:
+            now = time.time()
+            self._purge_expired(now)
+            session = self._sessions.get(handle)
+            if session is None:
+                return None
+            session.last_used = now
+            self._sessions.move_to_end(handle)
+            return session
+
+    def history(self, session: ImageSession) -> List[Tuple[str, str]]:
+        """作为上下文发送的最近问答轮次"""
+        with self._lock:
+            return list(session.turns[-self.max_turns:]) if self.max_turns else []
+
+    def add_turn(self, session: ImageSession, prompt: str, answer: str):
+        """记录一轮问答（只保留上下文需要的轮数）"""
+        with self._lock:
+            session.turns.append((prompt, answer))
+            if len(session.turns) > self.max_turns:
+                del session.turns[:len(session.turns) - self.max_turns]
+
+    def close(self, handle: str) -> bool:
+        """关闭会话，返回句柄是否存在"""
+        with self._lock:
+            return self._sessions.pop(handle, None) is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired(time.time())
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'ttl': self.ttl,
+                'max_turns': self.max_turns
+            }
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+任务存储模块
+基于 SQLite 的持久化异步任务队列：提交后立即返回任务 ID，由后台工作协程领取执行，结果按 TTL 保留
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    arguments TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+"""
+
+
+class JobStore:
+    """SQLite 任务存储（可跨进程共享同一数据库文件）"""
+
+    def __init__(self, db_path: str, result_ttl: int = 86400, max_attempts: int = 3):
+        self.db_path = db_path
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def submit(self, tool: str, arguments: Dict[str, Any]) -> str:
+        """提交任务，返回任务 ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, tool, arguments, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, tool, json.dumps(arguments, ensure_ascii=False), STATUS_QUEUED, time.time())
+            )
+        return job_id
+
+    def claim_next(self) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """领取最早的排队任务并标记为运行中，返回 (任务 ID, 工具名, 参数)"""
+        with self._lock:
+            # BEGIN IMMEDIATE 取得写锁，保证多进程共享数据库时同一任务只被领取一次
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, tool, arguments FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (STATUS_RUNNING, os.getpid(), time.time(), row["id"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row["id"], row["tool"], json.loads(row["arguments"])
+
+    def complete(self, job_id: str, result: Optional[str] = None, error: Optional[str] = None):
+        """记录任务结果，并按 TTL 设置过期时间"""
+        now = time.time()
+        status = STATUS_FAILED if error is not None else STATUS_SUCCEEDED
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, expires_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, now, now + self.result_ttl, result, error, job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务记录（已过期的视为不存在）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == STATUS_QUEUED:
+                job["queue_position"] = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                    (STATUS_QUEUED, job["created_at"])
+                ).fetchone()[0] + 1
+        if job["expires_at"] is not None and job["expires_at"] < time.time():
+            return None
+        job["arguments"] = json.loads(job["arguments"])
+        return job
+
+    def recover_interrupted(self) -> int:
+        """
+        将所属进程已退出的运行中任务重新排队（服务重启后调用）
+
+        超过最大尝试次数的任务标记为失败，避免反复导致进程崩溃的任务无限重试
+        """
+        recovered = 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner, attempts FROM jobs WHERE status = ?", (STATUS_RUNNING,)
+            ).fetchall()
+            for row in rows:
+                if row["owner"] is not None and row["owner"] != os.getpid() and _process_alive(row["owner"]):
+                    continue
+                if row["attempts"] >= self.max_attempts:
+                    now = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ?, expires_at = ?, error = ? WHERE id = ?",
+                        (STATUS_FAILED, now, now + self.result_ttl, "任务多次中断，已放弃", row["id"])
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL WHERE id = ?",
+                        (STATUS_QUEUED, row["id"])
+                    )
+                    recovered += 1
+        if recovered:
+            logger.info(f"已重新排队 {recovered} 个中断的任务")
+        return recovered
+
+    def purge_expired(self) -> int:
+        """删除已过期的任务记录"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """按状态统计任务数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _process_alive(pid: int) -> bool:
+    """检查进程是否仍在运行"""
+    if os.name == 'nt':
+        # Windows 上 os.kill 会终止目标进程，无法用于探测；单进程部署时按已退出处理
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -59,8 +59,23 @@ def print_usage_instructions():
     logger.info("5. 查看 mcpserver.log 文件获取详细日志")
     logger.info("================")
 
+def parse_args():
+    """解析命令行参数（未指定时取环境变量配置）"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="GLM MCP 服务器")
+    parser.add_argument("--transport", choices=["stdio", "http", "unix"], default=None,
+                        help="传输方式：stdio 单客户端 / http 多客户端共享 / unix 供 stdio_shim 连接的常驻守护进程（默认取 GLM_TRANSPORT）")
+    parser.add_argument("--host", default=None, help="HTTP 监听地址（默认取 GLM_HTTP_HOST）")
+    parser.add_argument("--port", type=int, default=None, help="HTTP 监听端口（默认取 GLM_HTTP_PORT）")
+    parser.add_argument("--socket", default=None, help="unix 模式的套接字路径（默认取 GLM_DAEMON_SOCKET）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="HTTP 工作进程数，大于 1 时由监督进程预派生（默认取 GLM_HTTP_WORKERS）")
+    return parser.parse_args()
+
 def main():
     """主程序入口"""
+    args = parse_args()
     try:
         logger.info("=== GLM MCP 服务器启动 ===")
         print_system_info()
@@ -80,12 +95,22 @@ def main():
             sys.exit(1)
         
         # 创建并运行服务器
-        if FULL_SERVER_AVAILABLE:
+        workers = args.workers or config.http_workers
+        if FULL_SERVER_AVAILABLE and (args.transport or config.transport) == "http" and workers > 1:
+            from supervisor import Supervisor
+            Supervisor(
+                workers,
+                args.host or config.http_host,
+                args.port or config.http_port,
+                max_requests=config.worker_max_requests,
+                max_requests_jitter=config.worker_max_requests_jitter
+            ).run()
+        elif FULL_SERVER_AVAILABLE:
             logger.info("正在创建完整 MCP 服务器...")
             server = GLMMcpServer()
             
             logger.info("启动服务器，按 Ctrl+C 停止...")
-            server.run()
+            server.run(args.transport, args.host, args.port, args.socket)
         else:
             logger.error("完整版服务器不可用，无法启动")
             logger.error("请安装所需依赖: pip install -r requirements.txt")
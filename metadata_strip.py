@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+图像元数据精简模块
+按段 / 块删除 JPEG 与 PNG 中与显示无关的元数据（EXIF、XMP、内嵌缩略图、注释、文本块等），
+不重新编码像素；EXIF 方向标记可保留为最小 EXIF 段，或返回给调用方矫正方向
+"""
+
+import struct
+from typing import Optional, Tuple
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+# 保留的 JPEG APPn 段：APP0（JFIF）、APP2 中的 ICC 配置、APP14（Adobe，决定 CMYK/YCCK 颜色变换）
+_JPEG_KEEP_APP = {0xE0, 0xEE}
+_ICC_SIGNATURE = b'ICC_PROFILE\x00'
+_EXIF_SIGNATURE = b'Exif\x00\x00'
+# 无长度字段的独立标记
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 保留的 PNG 辅助块：透明度、色彩空间与 APNG 动画相关块；关键块（首字母大写）始终保留
+_PNG_KEEP_ANCILLARY = {b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'sBIT', b'acTL', b'fcTL', b'fdAT'}
+
+# EXIF 方向标记
+_ORIENTATION_TAG = 0x0112
+
+
+def read_exif_orientation(exif: bytes) -> int:
+    """从 APP1 EXIF 段内容（含 Exif 签名）读取方向标记，缺失或无法解析时返回 1"""
+    try:
+        tiff = exif[len(_EXIF_SIGNATURE):]
+        endian = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+        for index in range(count):
+            entry = ifd_offset + 2 + index * 12
+            tag, field_type = struct.unpack(endian + 'HH', tiff[entry:entry + 4])
+            if tag == _ORIENTATION_TAG and field_type == 3:
+                value = struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, IndexError, struct.error):
+        pass
+    return 1
+
+
+def orientation_segment(orientation: int) -> bytes:
+    """构造只含方向标记的最小 EXIF APP1 段（约 40 字节）"""
+    tiff = struct.pack('>2sHIH', b'MM', 42, 8, 1) + struct.pack('>HHIHH', _ORIENTATION_TAG, 3, 1, orientation, 0) + b'\0' * 4
+    payload = _EXIF_SIGNATURE + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def strip_jpeg(data: bytes, keep_orientation: bool = False) -> Tuple[bytes, int]:
+    """
+    删除 JPEG 中的 EXIF / XMP / 厂商 APPn 段、注释以及 EOI 之后附加的数据（MPF 预览图等），
+    返回 (精简后的数据, EXIF 方向)；图像扫描数据原样复制
+
+    keep_orientation 为 True 且方向不为 1 时，以只含方向标记的最小 EXIF 段替换原 EXIF 段
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("不是 JPEG 数据")
+    output = [data[:2]]
+    orientation = 1
+    position = 2
+    while position < len(data):
+        if data[position] != 0xFF:
+            raise ValueError("JPEG 段结构无效")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # 填充字节
+            position += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            output.append(data[position:position + 2])
+            position += 2
+            continue
+        if marker == 0xD9:
+            output.append(data[position:position + 2])
+            break
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        segment_end = position + 2 + length
+        if segment_end > len(data):
+            raise ValueError("JPEG 段长度越界")
+        payload = data[position + 4:segment_end]
+
+        if marker == 0xDA:
+            # 扫描数据直到下一个非 RST 标记，整段复制
+            scan_end = segment_end
+            while True:
+                scan_end = data.find(b'\xff', scan_end)
+                if scan_end < 0 or scan_end + 1 >= len(data):
+                    scan_end = len(data)
+                    break
+                # 0xFF00 为字节填充，0xFFD0-0xFFD7 为重启标记，均属于扫描数据
+                following = data[scan_end + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    scan_end += 2
+                    continue
+                break
+            output.append(data[position:scan_end])
+            position = scan_end
+            continue
+
+        keep = True
+        if marker == 0xE1 and payload.startswith(_EXIF_SIGNATURE):
+            orientation = read_exif_orientation(payload)
+            keep = False
+            if keep_orientation and orientation != 1:
+                output.append(orientation_segment(orientation))
+        elif marker == 0xE2:
+            keep = payload.startswith(_ICC_SIGNATURE)
+        elif 0xE0 <= marker <= 0xEF:
+            keep = marker in _JPEG_KEEP_APP
+        elif marker == 0xFE:
+            keep = False
+        if keep:
+            output.append(data[position:segment_end])
+        position = segment_end
+    return b''.join(output), orientation
+
+
+def strip_png(data: bytes) -> bytes:
+    """删除 PNG 中的文本、时间、EXIF 等与显示无关的辅助块，像素数据块原样复制"""
+    if not data.startswith(_PNG_SIGNATURE):
+        raise ValueError("不是 PNG 数据")
+    output = [_PNG_SIGNATURE]
+    position = len(_PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunk_end = position + 12 + length
+        if chunk_end > len(data):
+            raise ValueError("PNG 块长度越界")
+        # 首字母大写为关键块
+        if chunk_type[0] < 0x61 or chunk_type in _PNG_KEEP_ANCILLARY:
+            output.append(data[position:chunk_end])
+        position = chunk_end
+        if chunk_type == b'IEND':
+            break
+    return b''.join(output)
+
+
+def strip_metadata(data: bytes, image_format: Optional[str], keep_orientation: bool = False) -> Tuple[bytes, int]:
+    """
+    按格式精简元数据，返回 (数据, EXIF 方向)
+
+    不支持的格式或结构无法解析时原样返回；keep_orientation 见 strip_jpeg
+    """
+    try:
+        if image_format == 'JPEG':
+            return strip_jpeg(data, keep_orientation)
+        if image_format == 'PNG':
+            return strip_png(data), 1
+    except (ValueError, IndexError, struct.error) as e:
+        if LOGGER_AVAILABLE:
+            logger.debug(f"元数据精简跳过: {e}")
+    return data, 1
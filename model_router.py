@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+模型路由模块
+按图像大小、提示长度和输出上限在轻量模型与完整模型之间选择，记录各模型延迟与成功率并据此调整路由，
+超时或过载时回退到另一模型
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+# 统计成功率使用的最近请求数与最长时效（秒），过期记录不再计入，使回避的模型能够恢复
+STATS_WINDOW = 20
+STATS_MAX_AGE = 300.0
+# 轻量模型最近成功率低于该值时不再路由简单请求
+MIN_SUCCESS_RATE = 0.8
+# 连续失败达到该次数后暂时回避该模型（秒）
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 60.0
+# 延迟指数移动平均的平滑系数
+LATENCY_ALPHA = 0.2
+# 各项指标不超过简单请求上限的该倍数时视为临界请求，完整模型变慢时改由轻量模型处理
+BORDERLINE_FACTOR = 2.0
+
+
+class ModelStats:
+    """单个模型的延迟与成功率统计"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.avg_latency: Optional[float] = None
+        self.cooldown_until = 0.0
+        self._recent: deque = deque(maxlen=STATS_WINDOW)
+
+    def record(self, success: bool, latency: float):
+        self.requests += 1
+        self._recent.append((time.time(), success))
+        if success:
+            self.consecutive_failures = 0
+            self.avg_latency = latency if self.avg_latency is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.avg_latency
+            )
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURE_THRESHOLD:
+                self.cooldown_until = time.time() + COOLDOWN_SECONDS
+
+    def success_rate(self, now: float) -> float:
+        recent = [success for timestamp, success in self._recent if now - timestamp <= STATS_MAX_AGE]
+        return sum(recent) / len(recent) if recent else 1.0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.success_rate(now) >= MIN_SUCCESS_RATE
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'success_rate': round(self.success_rate(now), 3),
+            'avg_latency': round(self.avg_latency, 3) if self.avg_latency is not None else None,
+            'cooling_down': now < self.cooldown_until
+        }
+
+
+class ModelRouter:
+    """轻量 / 完整模型路由器（线程安全）"""
+
+    def __init__(self, full_model: str, light_model: str, max_image_bytes: int = 300 * 1024,
+                 max_prompt_chars: int = 200, max_output_tokens: int = 512, latency_threshold: float = 0.0):
+        self.full_model = full_model
+        self.light_model = light_model
+        self.max_image_bytes = max_image_bytes
+        self.max_prompt_chars = max_prompt_chars
+        self.max_output_tokens = max_output_tokens
+        self.latency_threshold = latency_threshold
+        self._stats = {model: ModelStats(model) for model in (full_model, light_model)}
+        self._lock = threading.Lock()
+
+    def is_simple(self, image_bytes: Optional[int], prompt_chars: int, max_tokens: int, image_count: int = 1) -> bool:
+        """判断是否为适合轻量模型的简单请求（远程 URL 图像大小未知，按复杂请求处理）"""
+        return (
+            image_bytes is not None
+            and image_count == 1
+            and image_bytes <= self.max_image_bytes
+            and prompt_chars <= self.max_prompt_chars
+            and max_tokens <= self.max_output_tokens
+        )
+
+    def is_borderline(self, image_bytes: Optional[int], prompt_chars: int, max_tokens: int, image_count: int = 1) -> bool:
+        """判断是否为略超简单请求上限的临界请求"""
+        return (
+            image_bytes is not None
+            and image_count == 1
+            and image_bytes <= self.max_image_bytes * BORDERLINE_FACTOR
+            and prompt_chars <= self.max_prompt_chars * BORDERLINE_FACTOR
+            and max_tokens <= self.max_output_tokens * BORDERLINE_FACTOR
+        )
+
+    def _full_is_slow(self, full: ModelStats, light: ModelStats) -> bool:
+        """完整模型的平均延迟超过阈值且慢于轻量模型"""
+        if self.latency_threshold <= 0 or full.avg_latency is None or full.avg_latency <= self.latency_threshold:
+            return False
+        return light.avg_latency is None or light.avg_latency < full.avg_latency
+
+    def route(self, image_bytes: Optional[int], prompt_chars: int, max_tokens: int, image_count: int = 1) -> List[str]:
+        """返回按优先级排列的候选模型，首选失败（超时 / 过载）时依次回退"""
+        with self._lock:
+            now = time.time()
+            light = self._stats[self.light_model]
+            full = self._stats[self.full_model]
+            prefer_light = self.is_simple(image_bytes, prompt_chars, max_tokens, image_count) and light.is_healthy(now)
+            # 完整模型处于冷却期而轻量模型健康时，复杂请求也先尝试轻量模型
+            if not prefer_light and now < full.cooldown_until and light.is_healthy(now):
+                prefer_light = True
+            # 完整模型平均延迟过高时，临界请求也先尝试轻量模型
+            if (not prefer_light and self._full_is_slow(full, light) and light.is_healthy(now)
+                    and self.is_borderline(image_bytes, prompt_chars, max_tokens, image_count)):
+                prefer_light = True
+        if prefer_light:
+            return [self.light_model, self.full_model]
+        return [self.full_model, self.light_model]
+
+    def record(self, model: str, success: bool, latency: float):
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is not None:
+                stats.record(success, latency)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            return {model: stats.to_dict(now) for model, stats in self._stats.items()}
+
+
+def is_fallback_error(error: Exception) -> bool:
+    """超时、限流、服务端过载等可改用另一模型重试的错误"""
+    if isinstance(error, TimeoutError):
+        return True
+    name = type(error).__name__
+    if any(marker in name for marker in ('Timeout', 'ReachLimit', 'RateLimit', 'Overload', 'ServerError', 'Connection')):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code in (429, 500, 502, 503, 504, 529)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+感知哈希索引模块
+计算图像 dHash，并用 BK 树按汉明距离检索近似重复图像的历史分析结果
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from PIL import Image
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+
+def compute_dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """计算差值哈希（dHash），返回 hash_size * hash_size 位整数"""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def compute_file_dhash(file_path: str, hash_size: int = 8) -> Optional[int]:
+    """计算图像文件的 dHash，JPEG 使用 draft 模式降采样解码"""
+    try:
+        with Image.open(file_path) as img:
+            img.draft('L', (hash_size * 16, hash_size * 16))
+            return compute_dhash(img, hash_size)
+    except Exception as e:
+        if LOGGER_AVAILABLE:
+            logger.warning(f"计算感知哈希失败: {file_path} | {e}")
+        return None
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希值的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树"""
+
+    def __init__(self):
+        # 节点结构: [哈希值, 条目 ID 列表, {距离: 子节点}]
+        self._root: Optional[list] = None
+
+    def add(self, image_hash: int, entry_id: int):
+        """插入哈希值及对应条目"""
+        if self._root is None:
+            self._root = [image_hash, [entry_id], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(image_hash, node[0])
+            if distance == 0:
+                node[1].append(entry_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, [entry_id], {}]
+                return
+            node = child
+
+    def search(self, image_hash: int, max_distance: int) -> List[Tuple[int, int]]:
+        """查找距离不超过 max_distance 的条目，返回 (距离, 条目 ID) 列表"""
+        results = []
+        if self._root is None:
+            return results
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(image_hash, node[0])
+            if distance <= max_distance:
+                results.extend((distance, entry_id) for entry_id in node[1])
+            # 三角不等式剪枝
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in node[2].items() if low <= d <= high)
+        return results
+
+
+class NearDuplicateCache:
+    """近似重复图像分析结果缓存（LRU 淘汰）"""
+
+    def __init__(self, max_distance: int = 4, max_entries: int = 1024):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[str, int, Any]]" = OrderedDict()
+        self._trees: Dict[str, BKTree] = {}
+        self._next_id = 0
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, image_hash: int, key: str) -> Optional[Tuple[Any, int]]:
+        """查找同一 key 下最接近的历史结果，返回 (结果, 汉明距离)"""
+        with self._lock:
+            tree = self._trees.get(key)
+            if tree is None:
+                return None
+            matches = [(d, entry_id) for d, entry_id in tree.search(image_hash, self.max_distance)
+                       if entry_id in self._entries]
+            if not matches:
+                return None
+            distance, entry_id = min(matches)
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][2], distance
+
+    def store(self, image_hash: int, key: str, result: Any):
+        """记录分析结果"""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, image_hash, result)
+            self._trees.setdefault(key, BKTree()).add(image_hash, entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stale += 1
+
+            # BK 树不支持删除，淘汰条目累积过多时重建
+            if self._stale > self.max_entries:
+                self._rebuild()
+
+    def _rebuild(self):
+        self._trees = {}
+        for entry_id, (key, image_hash, _) in self._entries.items():
+            self._trees.setdefault(key, BKTree()).add(image_hash, entry_id)
+        self._stale = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'keys': len(self._trees),
+                'max_distance': self.max_distance,
+                'max_entries': self.max_entries
+            }
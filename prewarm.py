@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+预热模块
+监视指定目录（Linux 使用 inotify，其他平台或不可用时轮询），在后台以低优先级为新写入的图像
+预先完成头部探测、感知哈希与上传载荷编码，read_image 到达时直接命中载荷缓存
+"""
+
+import os
+import sys
+import time
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from image_processor import ImageProcessor
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+# inotify 事件：写入完成关闭、移入目录
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+# 预热线程的 nice 增量
+PREWARM_NICENESS = 10
+
+
+class DirectoryWatcher:
+    """目录监视器：文件写入完成或移入时回调文件路径（不递归子目录）"""
+
+    def __init__(self, directories: List[str], callback: Callable[[str], None], poll_interval: float = 2.0):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.mode: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        inotify = self._open_inotify()
+        if inotify is not None:
+            self.mode = 'inotify'
+            target, args = self._run_inotify, inotify
+        else:
+            self.mode = 'polling'
+            target, args = self._run_polling, ()
+        self._thread = threading.Thread(target=target, args=args, name="glm-prewarm-watcher", daemon=True)
+        self._thread.start()
+        if LOGGER_AVAILABLE:
+            logger.info(f"预热目录监视已启动（{self.mode}）: {self.directories}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _open_inotify(self) -> Optional[Tuple[int, Dict[int, str]]]:
+        """初始化 inotify 并添加监视，平台不支持或失败时返回 None"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+            watches = {}
+            for directory in self.directories:
+                wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+                if wd < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), f"无法监视目录: {directory}")
+                watches[wd] = directory
+            return fd, watches
+        except (OSError, AttributeError) as e:
+            if LOGGER_AVAILABLE:
+                logger.warning(f"inotify 不可用，改为轮询: {e}")
+            return None
+
+    def _run_inotify(self, fd: int, watches: Dict[int, str]):
+        try:
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                buffer = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(buffer):
+                    wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    name = buffer[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0')
+                    offset += _EVENT_HEADER.size + length
+                    if mask & IN_Q_OVERFLOW:
+                        if LOGGER_AVAILABLE:
+                            logger.warning("inotify 事件队列溢出，部分文件未预热")
+                        continue
+                    directory = watches.get(wd)
+                    if directory and name:
+                        self._notify(os.path.join(directory, os.fsdecode(name)))
+        finally:
+            os.close(fd)
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def _run_polling(self):
+        # 启动时已存在的文件不预热，只处理之后新增或变更的文件
+        previous = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            for path, signature in current.items():
+                if previous.get(path) != signature:
+                    self._notify(path)
+            previous = current
+
+    def _notify(self, path: str):
+        try:
+            self.callback(path)
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.warning(f"预热回调失败: {path} | {e}")
+
+
+class Prewarmer:
+    """预热器：有界队列去重后由单个低优先级线程生成上传载荷"""
+
+    def __init__(self, processor: ImageProcessor, directories: List[str], queue_size: int = 64,
+                 poll_interval: float = 2.0):
+        self.processor = processor
+        self.watcher = DirectoryWatcher(directories, self.enqueue, poll_interval)
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=queue_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'queued': 0, 'prewarmed': 0, 'skipped': 0, 'dropped': 0, 'failed': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="glm-prewarm-worker", daemon=True)
+        self._thread.start()
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def enqueue(self, path: str) -> bool:
+        """加入预热队列；不支持的格式、已在缓存或队列中的文件跳过，队列已满时丢弃"""
+        if not self.processor.is_supported_format(path):
+            return False
+        try:
+            identity = self.processor.get_file_identity(path)
+        except OSError:
+            return False
+        with self._lock:
+            if path in self._pending or identity in self.processor.payload_cache:
+                self.stats['skipped'] += 1
+                return False
+            try:
+                self._queue.put_nowait(path)
+            except queue.Full:
+                self.stats['dropped'] += 1
+                return False
+            self._pending.add(path)
+            self.stats['queued'] += 1
+        return True
+
+    def _run(self):
+        # Linux 上 setpriority 以线程 ID 只调整本线程的 nice 值
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREWARM_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            try:
+                path = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._pending.discard(path)
+            started = time.time()
+            payload = self.processor.get_file_payload(path, with_hash=True)
+            with self._lock:
+                self.stats['prewarmed' if payload else 'failed'] += 1
+            if payload and LOGGER_AVAILABLE:
+                logger.debug(f"已预热: {path}", **{"seconds": round(time.time() - started, 3)})
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, mode=self.watcher.mode, queue=self._queue.qsize(),
+                        cache=self.processor.payload_cache.get_stats())
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+远程图像模块
+提供图像 URL 的白名单校验、HEAD/Range 预检，以及上游无法访问时的下载内联回退
+"""
+
+import base64
+import socket
+import threading
+import ipaddress
+import contextlib
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlparse
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+from image_probe import image_probe
+from model_router import is_fallback_error
+from utils import is_valid_url
+
+# Range 预检读取的字节数，足够覆盖常见格式的头部
+PROBE_RANGE_BYTES = 64 * 1024
+# 手动跟随重定向的最大次数
+MAX_REDIRECTS = 5
+# 上游模型无法下载图像 URL 时错误信息中的关键词
+_FETCH_ERROR_MARKERS = ('url', 'download', 'fetch', '下载', '获取', '访问')
+
+
+def is_image_fetch_error(error: Exception) -> bool:
+    """
+    是否为上游模型无法下载图像 URL 导致的请求错误（4xx 且错误信息指向 URL 获取）
+
+    限流、过载、超时、鉴权失败、预算用尽等错误不属于此类，不应触发本地下载回退
+    """
+    if is_fallback_error(error):
+        return False
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code not in (400, 422):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in _FETCH_ERROR_MARKERS)
+
+
+class RemoteImageFetcher:
+    """远程图像获取器（复用连接池）"""
+
+    def __init__(self, allowlist: Optional[List[str]] = None, timeout: float = 10.0,
+                 max_bytes: int = 10 * 1024 * 1024, client: Optional[Any] = None, allow_private: bool = False):
+        """
+        Args:
+            allow_private: 是否允许访问解析到回环、链路本地、私有等非公网地址的主机（默认拒绝，防止 SSRF）
+        """
+        self.allowlist = [entry.strip().lower() for entry in (allowlist or []) if entry.strip()]
+        self.allow_private = allow_private
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _get_client(self) -> Any:
+        """延迟创建共享的 httpx 客户端"""
+        if self._client is None:
+            if not HTTPX_AVAILABLE:
+                raise RuntimeError("httpx 未安装，无法获取远程图像")
+            with self._client_lock:
+                if self._client is None:
+                    # 不自动跟随重定向：每一跳都需经白名单校验，见 _send
+                    self._client = httpx.Client(
+                        timeout=self.timeout,
+                        follow_redirects=False,
+                        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+                    )
+        return self._client
+
+    def is_allowed(self, url: str) -> bool:
+        """检查 URL 是否为 http(s) 且命中白名单（白名单为空时允许所有主机）"""
+        if not is_valid_url(url):
+            return False
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            return False
+        if not self.allowlist:
+            return True
+
+        hostname = (parsed.hostname or '').lower()
+        netloc = parsed.netloc.lower()
+        for entry in self.allowlist:
+            if entry in (hostname, netloc):
+                return True
+            if entry.startswith('*.') and hostname.endswith(entry[1:]):
+                return True
+        return False
+
+    def check_address(self, url: str):
+        """解析主机地址，任一地址不是公网地址时抛出 ValueError（allow_private 为 True 时跳过）"""
+        if self.allow_private:
+            return
+        hostname = urlparse(url).hostname
+        if not hostname:
+            raise ValueError(f"URL 缺少主机: {url}")
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(hostname, None)}
+        except socket.gaierror as e:
+            raise ValueError(f"无法解析主机: {hostname} | {e}")
+        for raw_address in addresses:
+            address = ipaddress.ip_address(raw_address.split('%')[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                raise ValueError(f"拒绝访问内网或保留地址: {hostname} ({address})")
+
+    def _send(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, stream: bool = False) -> Any:
+        """
+        发送请求并手动跟随重定向，每一跳的目标都必须通过 is_allowed 与 check_address，
+        防止请求被发往或重定向到内网地址及白名单以外的主机
+
+        stream 为 True 时调用方负责关闭返回的响应
+        """
+        client = self._get_client()
+        request = client.build_request(method, url, headers=headers)
+        for _ in range(MAX_REDIRECTS + 1):
+            self.check_address(str(request.url))
+            response = client.send(request, stream=stream)
+            if not response.is_redirect:
+                return response
+            next_request = response.next_request
+            response.close()
+            if next_request is None or not self.is_allowed(str(next_request.url)):
+                target = next_request.url if next_request is not None else response.headers.get('location')
+                raise ValueError(f"重定向目标不允许访问: {target}")
+            if headers:
+                next_request.headers.update(headers)
+            request = next_request
+        raise ValueError(f"重定向次数超过 {MAX_REDIRECTS} 次")
+
+    def probe(self, url: str) -> Tuple[bool, Dict[str, Any]]:
+        """
+        预检远程图像
+
+        先发送 HEAD 请求检查状态码、类型和长度；服务器不支持 HEAD 时改用 Range 请求，
+        并对返回的头部字节做格式探测。返回 (是否可用, 信息或错误)
+        """
+        try:
+            response = self._send('HEAD', url)
+            if response.status_code in (405, 501):
+                response = self._send('GET', url, headers={'Range': f'bytes=0-{PROBE_RANGE_BYTES - 1}'})
+            if response.status_code >= 400:
+                return False, {'error': f"远程图像不可访问: HTTP {response.status_code}"}
+
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if content_type and not content_type.startswith('image/'):
+                return False, {'error': f"远程资源不是图像: {content_type}"}
+
+            info: Dict[str, Any] = {'url': url, 'content_type': content_type or None}
+            if str(response.url) != url:
+                info['final_url'] = str(response.url)
+            content_length = self._parse_total_length(response.headers)
+            if content_length is not None:
+                info['file_size'] = content_length
+                if content_length > self.max_bytes:
+                    return False, {'error': f"远程图像过大: {content_length} 字节"}
+
+            if response.request.method == 'GET' and response.content:
+                probe_info = image_probe.probe_bytes(response.content, count_frames=False)
+                if not probe_info:
+                    return False, {'error': "远程图像文件头无法识别"}
+                info.update(probe_info)
+            return True, info
+
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.warning(f"远程图像预检失败: {url} | {e}")
+            return False, {'error': f"远程图像预检失败: {str(e)}"}
+
+    @staticmethod
+    def _parse_total_length(headers: Any) -> Optional[int]:
+        """从 Content-Range 或 Content-Length 解析资源总长度"""
+        content_range = headers.get('content-range')
+        if content_range and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1].strip()
+            return int(total) if total.isdigit() else None
+        content_length = headers.get('content-length')
+        if content_length and content_length.isdigit():
+            return int(content_length)
+        return None
+
+    def fetch_as_data_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """下载远程图像并内联为 data URL，超过大小限制时中止"""
+        try:
+            chunks = []
+            received = 0
+            response = self._send('GET', url, stream=True)
+            with contextlib.closing(response):
+                if response.status_code >= 400:
+                    if LOGGER_AVAILABLE:
+                        logger.error(f"远程图像下载失败: {url} | HTTP {response.status_code}")
+                    return None
+                for chunk in response.iter_bytes():
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        if LOGGER_AVAILABLE:
+                            logger.error(f"远程图像超过大小限制: {url}")
+                        return None
+                    chunks.append(chunk)
+
+            image_data = b''.join(chunks)
+            probe_info = image_probe.probe_bytes(image_data, count_frames=False)
+            if not probe_info:
+                if LOGGER_AVAILABLE:
+                    logger.error(f"远程图像文件头无法识别: {url}")
+                return None
+
+            encoded_string = base64.b64encode(image_data).decode('utf-8')
+            if LOGGER_AVAILABLE:
+                logger.info(f"远程图像已下载内联: {url} | {len(image_data)} 字节")
+            return {
+                'base64': f"data:{probe_info['mime_type']};base64,{encoded_string}",
+                'original_info': dict(probe_info, url=url, file_size=len(image_data))
+            }
+
+        except Exception as e:
+            if LOGGER_AVAILABLE:
+                logger.error(f"远程图像下载失败: {url} | {e}")
+            return None
+
+    def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+if __name__ == "__main__":
+    import sys
+
+    fetcher = RemoteImageFetcher()
+    for url in sys.argv[1:]:
+        print(f"{url}: allowed={fetcher.is_allowed(url)} probe={fetcher.probe(url)}")
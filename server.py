@@ -1,6 +1,9 @@
+import os
 import sys
 import json
-from typing import Dict, Any, Optional, List
+import hashlib
+import contextlib
+from typing import Dict, Any, Optional, List, Tuple, Union
 import asyncio
 
 # 尝试导入依赖模块
@@ -12,131 +15,401 @@ except ImportError:
     MCP_AVAILABLE = False
     # 在MCP模式下不使用print，避免干扰stdio通信
 
-try:
-    from zhipuai import ZhipuAI
-    ZHIPUAI_AVAILABLE = True
-except ImportError:
-    ZHIPUAI_AVAILABLE = False
-    # 在MCP模式下不使用print，避免干扰stdio通信
-
 from config import config
 from logger import logger
-from image_processor import ImageProcessor
+from glm_client import GLMClient, create_glm_client
+from directory_analyzer import DirectoryAnalyzer
+from job_store import JobStore, STATUS_QUEUED
+from shared_state import SharedState
+from usage_meter import UsageMeter, classify_prompt
+from image_session import ImageSessionStore
+from prewarm import Prewarmer
+from image_processor import ImageProcessor, image_processor
+from remote_image import RemoteImageFetcher, is_image_fetch_error
+from phash_index import NearDuplicateCache, compute_dhash, compute_file_dhash
 from utils import (
     create_success_response,
     create_error_response,
     create_validation_error_response,
+    extract_json_block,
     is_valid_temperature,
+    parse_int_param,
     validate_required_params
 )
 
+# 可通过 submit_analysis 异步执行的工具
+ASYNC_JOB_TOOLS = ("read_image", "classify_images", "analyze_directory")
+# 队列为空时的轮询间隔（秒），用于发现其他进程提交的任务
+JOB_POLL_INTERVAL = 2.0
+# 只读写任务库或内存状态的轻量工具，不占用并发名额，避免状态查询排在长时间分析之后
+UNTHROTTLED_TOOLS = ("submit_analysis", "get_job_status", "get_job_result", "get_usage_stats", "close_image")
+# 守护进程模式下必须为绝对路径的文件路径参数
+PATH_ARGUMENTS = ("image_path", "image_paths", "directory", "before_path", "after_path")
+
 class GLMMcpServer:
     """智谱 GLM MCP 服务器"""
     
-    def __init__(self):
+    def __init__(self, prewarm: bool = True):
+        """
+        Args:
+            prewarm: 是否启动预热目录监视；多进程 HTTP 模式的工作进程传入 False
+                （载荷缓存在进程内，每个工作进程各自监视同一目录只会重复编码）
+        """
         # 检查依赖是否可用
         if not MCP_AVAILABLE:
             # 在MCP模式下不使用print，避免干扰stdio通信
             raise ImportError("MCP module is required")
         
         self.server = Server("glm-mcp")
-        self.client: Optional[ZhipuAI] = None
+        self.client: Optional[GLMClient] = None
+        self.remote_fetcher = RemoteImageFetcher(
+            allowlist=config.image_url_allowlist,
+            timeout=config.image_url_timeout,
+            max_bytes=image_processor.max_file_size,
+            allow_private=config.image_url_allow_private
+        )
+        self.near_duplicate_cache: Optional[NearDuplicateCache] = None
+        if config.phash_cache_enabled:
+            self.near_duplicate_cache = NearDuplicateCache(
+                max_distance=config.phash_max_distance,
+                max_entries=config.phash_cache_size
+            )
+        self.job_store: Optional[JobStore] = None
+        self._job_event: Optional[asyncio.Event] = None
+        self._job_workers: List[asyncio.Task] = []
+        self._running_jobs = 0
+        # 守护进程的工作目录来自首个拉起它的会话，与后续客户端无关，此时拒绝相对路径
+        self._require_absolute_paths = False
+        self._call_semaphore = asyncio.Semaphore(config.max_concurrent_calls)
+        self.shared_state: Optional[SharedState] = None
+        self._setup_job_store()
+        self._setup_shared_state()
+        self.usage_meter = UsageMeter(
+            session_budget=config.session_token_budget,
+            daily_budget=config.daily_token_budget,
+            store=self.shared_state
+        )
+        self.image_sessions = ImageSessionStore(
+            max_sessions=config.image_session_max,
+            ttl=config.image_session_ttl,
+            max_turns=config.image_session_max_turns
+        )
+        image_processor.configure(config)
+        self.prewarmer: Optional[Prewarmer] = None
+        if prewarm:
+            self._setup_prewarmer()
         self._setup_client()
         self._register_tools()
     
     def _setup_client(self):
         """设置智谱 AI 客户端"""
-        if not config.validate_config():
-            logger.error("配置验证失败，请检查 GLM_API_KEY 等配置")
-            logger.error("验证错误详情:", **{"errors": config.get_validation_errors()})
-            return
-        
+        self.client = create_glm_client()
+    
+    def _setup_job_store(self):
+        """打开任务数据库，失败时禁用异步任务工具"""
         try:
-            logger.info("正在初始化智谱 AI 客户端...")
-            logger.debug("客户端配置", **{
-                "api_base": config.glm_api_base,
-                "model": config.glm_image_model
-            })
-            
-            if not ZHIPUAI_AVAILABLE:
-                logger.warning("智谱 AI SDK 未安装，无法初始化客户端")
-                self.client = None
-                return
-            
-            self.client = ZhipuAI(
-                api_key=config.glm_api_key,
-                base_url=config.glm_api_base
-            )
-            
-            # 测试客户端连接
-            logger.info("智谱 AI 客户端初始化成功")
-            logger.debug("客户端已准备就绪")
-            
+            self.job_store = JobStore(config.job_db_path, result_ttl=config.job_result_ttl)
+            self.job_store.recover_interrupted()
         except Exception as e:
-            logger.log_exception(e, {"context": "Initializing Zhipu AI client"})
-            logger.error(f"智谱 AI 客户端初始化失败: {e}")
-            self.client = None
+            logger.log_exception(e, {"context": "Opening job store"})
+            logger.error(f"任务数据库打开失败，异步任务不可用: {e}")
+            self.job_store = None
+    
+    def _setup_shared_state(self):
+        """打开跨进程共享状态（速率预算与结果缓存），失败时退化为进程内状态"""
+        try:
+            self.shared_state = SharedState(config.shared_state_db)
+        except Exception as e:
+            logger.log_exception(e, {"context": "Opening shared state"})
+            logger.warning(f"共享状态数据库打开失败，速率限制与结果缓存仅在本进程内生效: {e}")
+            self.shared_state = None
+    
+    def _setup_prewarmer(self):
+        """配置了预热目录时启动目录监视与后台预处理"""
+        directories = [directory for directory in config.prewarm_dirs if os.path.isdir(directory)]
+        if not directories:
+            return
+        if not config.payload_cache_mb:
+            logger.warning("GLM_PAYLOAD_CACHE_MB 为 0，预热结果无处缓存，已跳过预热")
+            return
+        self.prewarmer = Prewarmer(
+            image_processor, directories,
+            queue_size=config.prewarm_queue_size,
+            poll_interval=config.prewarm_poll_interval
+        )
+        self.prewarmer.start()
     
     def _register_tools(self):
         """注册所有工具"""
-        self._register_read_image_tool()
-    
-    def _register_read_image_tool(self):
-        """注册图像分析工具"""
+        self._tool_handlers = {
+            "read_image": self._analyze_image,
+            "classify_images": self._classify_images,
+            "analyze_directory": self._analyze_directory,
+            "submit_analysis": self._submit_analysis,
+            "get_job_status": self._get_job_status,
+            "get_job_result": self._get_job_result,
+            "get_usage_stats": self._get_usage_stats,
+            "open_image": self._open_image,
+            "ask_image": self._ask_image,
+            "close_image": self._close_image,
+            "diff_images": self._diff_images
+        }
         
         # 注册工具列表处理器
         @self.server.list_tools()
         async def handle_list_tools() -> List[types.Tool]:
             """处理工具列表请求"""
-            return [
-                types.Tool(
-                    name="read_image",
-                    description="使用 GLM-4.6V 模型分析本地图像",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "image_path": {
-                                "type": "string",
-                                "description": "图像文件路径"
-                            },
-                            "prompt": {
-                                "type": "string",
-                                "description": "分析提示文本"
-                            },
-                            "temperature": {
-                                "type": "number",
-                                "description": "温度参数 (0.0-2.0)",
-                                "default": 0.8
-                            },
-                            "max_tokens": {
-                                "type": "integer",
-                                "description": "最大输出令牌数",
-                                "default": 1000
-                            }
-                        },
-                        "required": ["image_path", "prompt"]
-                    }
-                )
-            ]
+            return self._get_tool_definitions()
         
         # 注册工具调用处理器
         @self.server.call_tool()
         async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[types.TextContent]:
             """处理工具调用请求"""
-            if name == "read_image":
-                return await self._analyze_image(arguments)
-            else:
+            handler = self._tool_handlers.get(name)
+            if handler is None:
                 raise ValueError(f"Unknown tool: {name}")
+            if self._require_absolute_paths:
+                path_error = self._check_absolute_paths(arguments)
+                if path_error:
+                    return self._to_text_content(create_validation_error_response(path_error))
+            if name in UNTHROTTLED_TOOLS:
+                return await handler(arguments)
+            # 多个客户端共享同一进程时限制同时执行的工具调用数，超出的排队等待
+            async with self._call_semaphore:
+                return await handler(arguments)
         
         # 确保处理器被正确注册
-        logger.info("图像分析工具已注册")
+        logger.info("图像分析工具已注册", **{"tools": list(self._tool_handlers)})
     
-    async def _test_list_tools(self) -> List[types.Tool]:
-        """测试方法：直接返回工具列表"""
+    @staticmethod
+    def _check_absolute_paths(arguments: Dict[str, Any]) -> Optional[str]:
+        """检查路径参数（含异步任务的嵌套参数）是否均为绝对路径，返回错误信息或 None"""
+        for key in PATH_ARGUMENTS:
+            value = arguments.get(key)
+            for path in (value if isinstance(value, list) else [value]):
+                if isinstance(path, str) and path and not os.path.isabs(os.path.expanduser(path)):
+                    return f"守护进程模式下 {key} 必须为绝对路径: {path}"
+        nested = arguments.get("arguments")
+        return GLMMcpServer._check_absolute_paths(nested) if isinstance(nested, dict) else None
+    
+    def _get_tool_definitions(self) -> List[types.Tool]:
+        """构建工具定义列表"""
         return [
             types.Tool(
                 name="read_image",
-                description="使用 GLM-4.6V 模型分析本地图像",
+                description="使用 GLM-4.6V 模型分析图像（本地文件、内联 base64 数据或图像 URL）",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "image_path": {
+                            "type": "string",
+                            "description": "图像文件路径（image_path / image_base64 / image_url 三选一）"
+                        },
+                        "image_base64": {
+                            "type": "string",
+                            "description": "图像 base64 数据或 data URL，满足大小限制时直接转发"
+                        },
+                        "image_url": {
+                            "type": "string",
+                            "description": "http(s) 图像 URL，直接交由模型获取，不在本地下载"
+                        },
+                        "prompt": {
+                            "type": "string",
+                            "description": "分析提示文本"
+                        },
+                        "prompts": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "针对同一图像的多个独立问题（代替 prompt），合并为一次模型调用并按问题拆分回答，解析失败的问题单独重试；此时 max_tokens 为每个问题的上限（仅支持 single 模式）"
+                        },
+                        "temperature": {
+                            "type": "number",
+                            "description": "温度参数 (0.0-2.0)",
+                            "default": 0.8
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "最大输出令牌数",
+                            "default": 1000
+                        },
+                        "mode": {
+                            "type": "string",
+                            "enum": ["single", "tiles", "zoom", "frames"],
+                            "description": "分析模式：single 整图分析；tiles 按原始分辨率切分重叠分块并发分析后汇总；zoom 先发送低分辨率总览，按模型请求追加高分辨率局部；frames 抽取动画关键帧后一次性分析（tiles/zoom/frames 仅支持 image_path）",
+                            "default": "single"
+                        },
+                        "tile_size": {
+                            "type": "integer",
+                            "description": "分块边长（像素），默认取 GLM_TILE_SIZE"
+                        },
+                        "tile_overlap": {
+                            "type": "integer",
+                            "description": "相邻分块重叠像素，默认取 GLM_TILE_OVERLAP"
+                        },
+                        "max_frames": {
+                            "type": "integer",
+                            "description": "frames 模式最多抽取的关键帧数，默认取 GLM_FRAME_SAMPLES"
+                        },
+                        "frames_layout": {
+                            "type": "string",
+                            "enum": ["multi", "sheet"],
+                            "description": "frames 模式关键帧发送方式：multi 多图请求，sheet 拼接为带编号网格图，默认取 GLM_FRAMES_LAYOUT"
+                        },
+                        "crop": {
+                            "type": "array",
+                            "items": {"type": "number"},
+                            "minItems": 4,
+                            "maxItems": 4,
+                            "description": "感兴趣区域 [x0, y0, x1, y1]，全部不大于 1 时为比例坐标，否则为像素坐标（仅支持 image_path 与 single 模式）"
+                        },
+                        "target_size": {
+                            "type": "integer",
+                            "description": "裁剪区域编码后的长边像素，默认 1024"
+                        }
+                    },
+                    "required": []
+                }
+            ),
+            types.Tool(
+                name="classify_images",
+                description="将多张图像的缩略图拼接为带编号的网格图，用一次模型调用回答同一问题，并拆分为逐图结果",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "image_paths": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "图像文件路径列表"
+                        },
+                        "prompt": {
+                            "type": "string",
+                            "description": "对每张图像提出的问题，如「是否显示错误对话框？」"
+                        },
+                        "sheet_size": {
+                            "type": "integer",
+                            "description": "每张网格图包含的图像数，默认取 GLM_SHEET_SIZE"
+                        },
+                        "temperature": {
+                            "type": "number",
+                            "description": "温度参数 (0.0-2.0)",
+                            "default": 0.2
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "每张网格图的最大输出令牌数",
+                            "default": 2000
+                        }
+                    },
+                    "required": ["image_paths", "prompt"]
+                }
+            ),
+            types.Tool(
+                name="analyze_directory",
+                description="增量分析目录中的图像：按清单记录文件标识、内容哈希和结果，重复运行时只分析新增或变更的文件",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "directory": {
+                            "type": "string",
+                            "description": "图像目录路径"
+                        },
+                        "prompt": {
+                            "type": "string",
+                            "description": "分析提示文本（提示或参数变化时会重新分析所有文件）"
+                        },
+                        "patterns": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "glob 过滤列表，匹配相对路径或文件名，如 [\"*.png\", \"screens/*\"]"
+                        },
+                        "recursive": {
+                            "type": "boolean",
+                            "description": "是否递归子目录",
+                            "default": True
+                        },
+                        "include_unchanged": {
+                            "type": "boolean",
+                            "description": "是否在结果中附带清单里未变更文件的历史结果",
+                            "default": False
+                        },
+                        "retry_failed": {
+                            "type": "boolean",
+                            "description": "是否同时重试上次因不可重试错误（如图像无法解码）失败且内容未变的文件；其他失败默认重试",
+                            "default": False
+                        },
+                        "temperature": {
+                            "type": "number",
+                            "description": "温度参数 (0.0-2.0)",
+                            "default": 0.8
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "最大输出令牌数",
+                            "default": 1000
+                        }
+                    },
+                    "required": ["directory", "prompt"]
+                }
+            ),
+            types.Tool(
+                name="submit_analysis",
+                description="提交异步分析任务并立即返回任务 ID，适合大图、长输出或批量分析等可能超过工具调用超时的场景",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "tool": {
+                            "type": "string",
+                            "enum": list(ASYNC_JOB_TOOLS),
+                            "description": "要异步执行的工具",
+                            "default": "read_image"
+                        },
+                        "arguments": {
+                            "type": "object",
+                            "description": "传给该工具的参数，与同步调用时相同"
+                        }
+                    },
+                    "required": ["arguments"]
+                }
+            ),
+            types.Tool(
+                name="get_job_status",
+                description="查询异步任务状态（queued / running / succeeded / failed）",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "job_id": {
+                            "type": "string",
+                            "description": "submit_analysis 返回的任务 ID"
+                        }
+                    },
+                    "required": ["job_id"]
+                }
+            ),
+            types.Tool(
+                name="get_job_result",
+                description="获取异步任务结果；任务未完成时返回当前状态",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "job_id": {
+                            "type": "string",
+                            "description": "submit_analysis 返回的任务 ID"
+                        }
+                    },
+                    "required": ["job_id"]
+                }
+            ),
+            types.Tool(
+                name="get_usage_stats",
+                description="查看令牌用量：累计与按模型用量、本会话与今日用量及预算、各提示类别的输出长度统计",
+                inputSchema={
+                    "type": "object",
+                    "properties": {}
+                }
+            ),
+            types.Tool(
+                name="open_image",
+                description="预处理一次图像并返回句柄，之后用 ask_image 针对同一图像多次提问而无需重复读取、编码；句柄空闲超时或超出数量上限时失效",
                 inputSchema={
                     "type": "object",
                     "properties": {
@@ -144,10 +417,47 @@ class GLMMcpServer:
                             "type": "string",
                             "description": "图像文件路径"
                         },
+                        "image_base64": {
+                            "type": "string",
+                            "description": "图像 base64 数据或 data URL"
+                        },
+                        "image_url": {
+                            "type": "string",
+                            "description": "http(s) 图像 URL"
+                        },
+                        "crop": {
+                            "type": "array",
+                            "items": {"type": "number"},
+                            "minItems": 4,
+                            "maxItems": 4,
+                            "description": "感兴趣区域 [x0, y0, x1, y1]（仅支持 image_path）"
+                        },
+                        "target_size": {
+                            "type": "integer",
+                            "description": "裁剪区域编码后的长边像素，默认 1024"
+                        }
+                    }
+                }
+            ),
+            types.Tool(
+                name="ask_image",
+                description="针对 open_image 打开的图像提问，复用已缓存的图像数据，可携带此前问答作为多轮上下文",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "handle": {
+                            "type": "string",
+                            "description": "open_image 返回的句柄"
+                        },
                         "prompt": {
                             "type": "string",
                             "description": "分析提示文本"
                         },
+                        "use_history": {
+                            "type": "boolean",
+                            "description": "是否携带此前问答作为上下文（最多 GLM_IMAGE_SESSION_MAX_TURNS 轮）",
+                            "default": True
+                        },
                         "temperature": {
                             "type": "number",
                             "description": "温度参数 (0.0-2.0)",
@@ -159,11 +469,135 @@ class GLMMcpServer:
                             "default": 1000
                         }
                     },
-                    "required": ["image_path", "prompt"]
+                    "required": ["handle", "prompt"]
+                }
+            ),
+            types.Tool(
+                name="diff_images",
+                description="比较两张同尺寸截图：按块比较像素差异并聚类为变化区域，只上传各区域的变化前后对照图和一张标注区域的缩小总览图",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "before_path": {
+                            "type": "string",
+                            "description": "变化前的图像文件路径"
+                        },
+                        "after_path": {
+                            "type": "string",
+                            "description": "变化后的图像文件路径（尺寸须与变化前一致）"
+                        },
+                        "prompt": {
+                            "type": "string",
+                            "description": "关于变化的问题，默认描述两张图之间的所有变化"
+                        },
+                        "block_size": {
+                            "type": "integer",
+                            "description": "比较块边长（像素），默认取 GLM_DIFF_BLOCK_SIZE"
+                        },
+                        "max_regions": {
+                            "type": "integer",
+                            "description": "最多上传的变化区域数，默认取 GLM_DIFF_MAX_REGIONS"
+                        },
+                        "temperature": {
+                            "type": "number",
+                            "description": "温度参数 (0.0-2.0)",
+                            "default": 0.2
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "最大输出令牌数",
+                            "default": 1000
+                        }
+                    },
+                    "required": ["before_path", "after_path"]
+                }
+            ),
+            types.Tool(
+                name="close_image",
+                description="关闭 open_image 打开的图像句柄并释放缓存",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "handle": {
+                            "type": "string",
+                            "description": "open_image 返回的句柄"
+                        }
+                    },
+                    "required": ["handle"]
                 }
             )
         ]
     
+    async def _test_list_tools(self) -> List[types.Tool]:
+        """测试方法：直接返回工具列表"""
+        return self._get_tool_definitions()
+    
+    @staticmethod
+    def _to_text_content(response: Dict[str, Any]) -> List[types.TextContent]:
+        """将响应字典序列化为 MCP 文本内容"""
+        return [types.TextContent(type="text", text=json.dumps(response, ensure_ascii=False))]
+    
+    def _resolve_image_source(self, arguments: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[str]]:
+        """
+        根据参数解析图像来源
+
+        返回 (data URL, 图像信息, 错误信息)
+        """
+        image_path = arguments.get("image_path")
+        image_base64 = arguments.get("image_base64")
+        image_url = arguments.get("image_url")
+        
+        provided = [value for value in (image_path, image_base64, image_url) if value]
+        if len(provided) > 1:
+            return None, None, "image_path、image_base64、image_url 只能提供一个"
+        if not provided:
+            return None, None, "缺少必需参数: image_path、image_base64 或 image_url"
+        if arguments.get("crop") and not image_path:
+            return None, None, "crop 仅支持 image_path"
+        
+        if image_url:
+            if not self.remote_fetcher.is_allowed(image_url):
+                return None, None, f"图像 URL 无效或不在白名单中: {image_url}"
+            image_info: Dict[str, Any] = {'url': image_url}
+            if config.image_url_probe:
+                ok, probe_info = self.remote_fetcher.probe(image_url)
+                if not ok:
+                    return None, None, probe_info['error']
+                image_info = probe_info
+            image_info['source'] = 'url'
+            return image_url, image_info, None
+        
+        if image_base64:
+            processed = image_processor.prepare_base64_for_api(image_base64)
+            if not processed:
+                return None, None, "内联图像数据无效或格式不支持"
+            image_info = dict(processed['original_info'], source='base64', passthrough=processed['passthrough'])
+            return processed['base64'], image_info, None
+        
+        if not ImageProcessor.validate_image_file_static(image_path):
+            return None, None, f"图像文件不存在或格式不支持: {image_path}"
+        
+        crop = arguments.get("crop")
+        if crop:
+            if not isinstance(crop, (list, tuple)) or len(crop) != 4:
+                return None, None, "crop 必须为 [x0, y0, x1, y1]"
+            cropped = image_processor.crop_region(image_path, tuple(crop), int(arguments.get("target_size") or 1024))
+            if not cropped:
+                return None, None, f"裁剪区域无效: {crop}"
+            image_info = dict(
+                ImageProcessor.get_image_info_static(image_path) or {},
+                source='path', path=image_path, crop_box=list(cropped['box']),
+                processed_size=cropped['processed_size'], compressed_size=cropped['compressed_size']
+            )
+            return cropped['base64'], image_info, None
+        
+        # 载荷缓存命中（含预热目录中预先处理的文件）时不再读取和编码
+        payload = image_processor.get_file_payload(image_path)
+        if not payload:
+            return None, None, "图像编码失败"
+        image_info = dict(payload['image_info'], source='path', path=image_path)
+        return payload['data_url'], image_info, None
+    
     async def _analyze_image(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
         """分析图像"""
         image_path = arguments.get("image_path")
@@ -173,35 +607,66 @@ class GLMMcpServer:
         
         params = {
             "image_path": image_path,
+            "image_base64_length": len(arguments.get("image_base64") or ""),
+            "image_url": arguments.get("image_url"),
             "prompt": prompt,
             "temperature": temperature,
-            "max_tokens": max_tokens
+            "max_tokens": max_tokens,
+            "crop": arguments.get("crop")
         }
         
         # 参数验证
-        validation_error = validate_required_params(params, ["image_path", "prompt"])
+        prompts = arguments.get("prompts")
+        if prompts is not None:
+            params["prompts"] = prompts
+            validation_error = None
+            if prompt:
+                validation_error = "prompt 与 prompts 只能提供一个"
+            elif not isinstance(prompts, list) or not prompts or not all(isinstance(item, str) and item.strip() for item in prompts):
+                validation_error = "prompts 必须为非空字符串列表"
+        else:
+            validation_error = validate_required_params(params, ["prompt"])
+        if not validation_error and not any(arguments.get(key) for key in ("image_path", "image_base64", "image_url")):
+            validation_error = "缺少必需参数: image_path、image_base64 或 image_url"
         if validation_error:
             logger.log_tool_call("read_image", params, error=validation_error)
-            return [types.TextContent(type="text", text=json.dumps(create_validation_error_response("parameters", validation_error), ensure_ascii=False))]
+            return self._to_text_content(create_validation_error_response(validation_error))
         
         if not is_valid_temperature(temperature):
             error_msg = f"温度参数必须在 0.0-2.0 之间，当前值: {temperature}"
             logger.log_tool_call("read_image", params, error=error_msg)
-            return [types.TextContent(type="text", text=json.dumps(create_validation_error_response("temperature", error_msg), ensure_ascii=False))]
-        
-        if not ImageProcessor.validate_image_file_static(image_path):
-            error_msg = f"图像文件不存在或格式不支持: {image_path}"
-            logger.log_tool_call("read_image", params, error=error_msg)
-            return [types.TextContent(type="text", text=json.dumps(create_error_response(error_msg), ensure_ascii=False))]
+            return self._to_text_content(create_validation_error_response(error_msg))
         
         if not self.client:
             error_msg = "智谱 AI 客户端未初始化"
             logger.log_tool_call("read_image", params, error=error_msg)
-            return [types.TextContent(type="text", text=json.dumps(create_error_response(error_msg), ensure_ascii=False))]
+            return self._to_text_content(create_error_response(error_msg))
+        
+        mode = arguments.get("mode") or "single"
+        if mode != "single" and (arguments.get("crop") or prompts is not None):
+            error_msg = f"{'crop' if arguments.get('crop') else 'prompts'} 仅支持 single 模式"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        if prompts is not None:
+            return await self._analyze_image_prompts(arguments, params)
+        if mode == "tiles":
+            return await self._analyze_image_tiled(arguments, params)
+        if mode == "zoom":
+            return await self._analyze_image_zoom(arguments, params)
+        if mode == "frames":
+            return await self._analyze_image_frames(arguments, params)
+        if mode != "single":
+            error_msg = f"不支持的分析模式: {mode}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
         
         try:
-            # 获取图像信息
-            image_info = ImageProcessor.get_image_info_static(image_path)
+            # 解析图像来源并生成 data URL
+            image_data_url, image_info, error_msg = self._resolve_image_source(arguments)
+            if error_msg:
+                logger.log_tool_call("read_image", params, error=error_msg)
+                return self._to_text_content(create_error_response(error_msg))
+            
             logger.info(f"开始分析图像: {image_info}")
             logger.debug("图像分析参数", **{
                 "image_path": image_path,
@@ -209,88 +674,1025 @@ class GLMMcpServer:
                 "temperature": temperature,
                 "max_tokens": max_tokens
             })
+            logger.debug("图像编码成功", **{"data_url_length": len(image_data_url)})
+            
+            # 近似重复图像直接复用历史结果（提示、采样参数与路由首选模型均相同时）
+            image_hash = await asyncio.to_thread(self._compute_image_hash, image_data_url, image_info)
+            if image_hash is not None:
+                cache_key = self._result_cache_key(
+                    self.client.preferred_model(image_data_url, prompt, max_tokens), prompt, temperature, max_tokens
+                )
+                cached = self.near_duplicate_cache.lookup(image_hash, cache_key)
+                if not cached:
+                    cached = await asyncio.to_thread(self._lookup_shared_result, image_hash, cache_key)
+                if cached:
+                    result, distance = cached
+                    logger.info(f"命中近似重复缓存，汉明距离: {distance}")
+                    logger.log_tool_call("read_image", params, result=result)
+                    response = create_success_response(result)
+                    response["approximate"] = True
+                    response["hamming_distance"] = distance
+                    return self._to_text_content(response)
+            
+            try:
+                result, usage = await asyncio.to_thread(
+                    self._call_glm_detailed, image_data_url, prompt, temperature, max_tokens
+                )
+            except Exception as e:
+                # 仅当上游无法获取图像 URL 时改为本地下载内联后重试一次；限流、超时、鉴权、预算等错误直接返回
+                if image_info.get('source') != 'url' or not config.image_url_fallback or not is_image_fetch_error(e):
+                    raise
+                logger.warning(f"模型获取图像 URL 失败，回退为下载内联: {e}")
+                fetched = await asyncio.to_thread(self.remote_fetcher.fetch_as_data_url, image_data_url)
+                if not fetched:
+                    raise
+                result, usage = await asyncio.to_thread(
+                    self._call_glm_detailed, fetched['base64'], prompt, temperature, max_tokens
+                )
+            if image_hash is not None:
+                # 以实际应答的模型存储，回退模型的结果不会被当作首选模型的结果复用
+                cache_key = self._result_cache_key(usage.get('model') or self.client.model, prompt, temperature, max_tokens)
+                self.near_duplicate_cache.store(image_hash, cache_key, result)
+                await asyncio.to_thread(self._store_shared_result, image_hash, cache_key, result)
+            logger.info("图像分析成功完成")
+            logger.debug("分析结果", **{"result_length": len(result)})
+            logger.log_tool_call("read_image", params, result=result)
+            
+            return self._to_text_content(create_success_response(result))
             
-            # 创建图像 data URL
-            image_data_url = ImageProcessor.create_image_data_url_static(image_path)
-            if not image_data_url:
-                error_msg = "图像编码失败"
+        except Exception as e:
+            logger.log_exception(e, {
+                "context": "Image analysis",
+                "image_path": image_path,
+                "prompt": prompt
+            })
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    async def _analyze_image_prompts(self, arguments: Dict[str, Any], params: Dict[str, Any]) -> List[types.TextContent]:
+        """多问题模式：图像只上传一次，所有问题合并为一次请求并要求按编号返回 JSON，解析不到的问题单独重试"""
+        prompts = arguments["prompts"]
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        
+        try:
+            image_data_url, image_info, error_msg = self._resolve_image_source(arguments)
+            if error_msg:
                 logger.log_tool_call("read_image", params, error=error_msg)
-                return [types.TextContent(type="text", text=json.dumps(create_error_response(error_msg), ensure_ascii=False))]
+                return self._to_text_content(create_error_response(error_msg))
             
-            logger.debug("图像编码成功", **{"data_url_length": len(image_data_url)})
+            answers: Dict[str, Any] = {}
+            requests = 0
+            if len(prompts) > 1:
+                questions = "\n".join(f"{index}. {question}" for index, question in enumerate(prompts, start=1))
+                combined_prompt = (
+                    f"请针对这张图像分别回答以下 {len(prompts)} 个相互独立的问题：\n{questions}\n"
+                    f'只输出一个 JSON 对象，键为问题编号字符串，值为该问题的完整回答，例如 {{"1": "...", "2": "..."}}。'
+                )
+                reply = await asyncio.to_thread(
+                    self._call_glm, image_data_url, combined_prompt, temperature, max_tokens * len(prompts),
+                    prompt_class=classify_prompt("\n".join(prompts), "prompts")
+                )
+                requests += 1
+                parsed = extract_json_block(reply)
+                if isinstance(parsed, dict):
+                    answers = parsed
+                else:
+                    logger.warning("未能从合并回复中解析 JSON，逐个问题单独重试")
             
-            # 调用智谱 GLM 模型
-            logger.info("正在调用智谱 GLM API...")
-            api_params = {
-                "model": config.glm_image_model,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "prompt_length": len(prompt)
-            }
-            
-            response = self.client.chat.completions.create(
-                model=config.glm_image_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "image_url", "image_url": {"url": image_data_url}},
-                            {"type": "text", "text": prompt}
-                        ]
-                    }
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=False
+            results: List[Dict[str, Any]] = [{"prompt": question} for question in prompts]
+            missing = []
+            for index, item in enumerate(results, start=1):
+                answer = answers.get(str(index), answers.get(index))
+                if answer is None or answer == "":
+                    missing.append(item)
+                else:
+                    item["answer"] = answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+            
+            async def ask_separately(item: Dict[str, Any]):
+                try:
+                    item["answer"] = await asyncio.to_thread(
+                        self._call_glm, image_data_url, item["prompt"], temperature, max_tokens
+                    )
+                except Exception as e:
+                    item["error"] = f"模型调用失败: {str(e)}"
+                if requests:
+                    item["separate"] = True
+            
+            await asyncio.gather(*(ask_separately(item) for item in missing))
+            requests += len(missing)
+            logger.info(f"多问题分析完成: {len(prompts)} 个问题，{requests} 次模型调用")
+            result_text = json.dumps(results, ensure_ascii=False)
+            logger.log_tool_call("read_image", params, result=result_text)
+            return self._to_text_content(create_success_response({
+                "results": results,
+                "requests": requests
+            }))
+            
+        except Exception as e:
+            logger.log_exception(e, {"context": "Multi-question image analysis", "prompts": prompts})
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    async def _classify_images(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """网格图批量分类：每张网格图一次模型调用，回复按编号拆分回逐图结果"""
+        image_paths = arguments.get("image_paths")
+        prompt = arguments.get("prompt")
+        temperature = arguments.get("temperature", 0.2)
+        max_tokens = arguments.get("max_tokens", 2000)
+        sheet_size = int(arguments.get("sheet_size") or config.sheet_size)
+        
+        params = {
+            "image_count": len(image_paths) if isinstance(image_paths, list) else 0,
+            "prompt": prompt,
+            "sheet_size": sheet_size
+        }
+        
+        validation_error = validate_required_params(arguments, ["image_paths", "prompt"])
+        if not validation_error and (not isinstance(image_paths, list) or not image_paths):
+            validation_error = "image_paths 必须为非空列表"
+        if not validation_error and not is_valid_temperature(temperature):
+            validation_error = f"温度参数必须在 0.0-2.0 之间，当前值: {temperature}"
+        if not validation_error and sheet_size < 1:
+            validation_error = f"sheet_size 必须大于 0，当前值: {sheet_size}"
+        if validation_error:
+            logger.log_tool_call("classify_images", params, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        
+        if not self.client:
+            error_msg = "智谱 AI 客户端未初始化"
+            logger.log_tool_call("classify_images", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        results: List[Dict[str, Any]] = [{"image_path": path} for path in image_paths]
+        valid_indices = []
+        for index, path in enumerate(image_paths):
+            if ImageProcessor.validate_image_file_static(path):
+                valid_indices.append(index)
+            else:
+                results[index]["error"] = "图像文件不存在或格式不支持"
+        
+        batches = [valid_indices[i:i + sheet_size] for i in range(0, len(valid_indices), sheet_size)]
+        semaphore = asyncio.Semaphore(config.sheet_parallelism)
+        cell_size = config.sheet_cell_size
+        
+        async def classify_batch(batch: List[int]):
+            thumbnails = await asyncio.gather(*(
+                asyncio.to_thread(image_processor.create_thumbnail_image, image_paths[i], (cell_size, cell_size))
+                for i in batch
+            ))
+            for i, thumb in zip(batch, thumbnails):
+                if thumb is None:
+                    results[i]["error"] = "缩略图生成失败"
+            pairs = [(i, thumb) for i, thumb in zip(batch, thumbnails) if thumb is not None]
+            if not pairs:
+                return
+            batch = [i for i, _ in pairs]
+            thumbnails = [thumb for _, thumb in pairs]
+            
+            labels = [str(position + 1) for position in range(len(batch))]
+            sheet = await asyncio.to_thread(image_processor.create_contact_sheet, thumbnails, labels, cell_size)
+            if not sheet:
+                for i in batch:
+                    results[i]["error"] = "网格图生成失败"
+                return
+            
+            sheet_prompt = (
+                f"这张网格图包含 {len(batch)} 张独立图片（从左到右、从上到下排列），每张左上角标有编号 1-{len(batch)}。"
+                f"请对每张图片分别回答：{prompt}\n"
+                f'只输出一个 JSON 对象，键为编号字符串，值为该图片的简短回答，例如 {{"1": "...", "2": "..."}}。'
             )
+            try:
+                async with semaphore:
+                    reply = await asyncio.to_thread(
+                        self._call_glm, sheet['base64'], sheet_prompt, temperature, max_tokens,
+                        prompt_class=classify_prompt(prompt, "sheet")
+                    )
+            except Exception as e:
+                for i in batch:
+                    results[i]["error"] = f"模型调用失败: {str(e)}"
+                return
             
-            logger.log_api_call(
-                method="POST",
-                url=config.glm_api_base,
-                status_code=200
+            answers = extract_json_block(reply)
+            if not isinstance(answers, dict):
+                answers = {}
+            for position, i in enumerate(batch, start=1):
+                answer = answers.get(str(position), answers.get(position))
+                if answer is None:
+                    results[i]["error"] = "未能从回复中解析该图结果"
+                    results[i]["raw_response"] = reply
+                else:
+                    results[i]["answer"] = answer
+        
+        try:
+            await asyncio.gather(*(classify_batch(batch) for batch in batches))
+            answered = sum(1 for item in results if "answer" in item)
+            logger.info(f"网格图分类完成: {len(image_paths)} 张图像，{len(batches)} 次模型调用，成功 {answered} 张")
+            result_text = json.dumps(results, ensure_ascii=False)
+            logger.log_tool_call("classify_images", params, result=result_text)
+            return self._to_text_content(create_success_response({
+                "results": results,
+                "sheets": len(batches)
+            }))
+        except Exception as e:
+            logger.log_exception(e, {"context": "Contact sheet classification"})
+            error_msg = f"批量分类失败: {str(e)}"
+            logger.log_tool_call("classify_images", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    async def _analyze_directory(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """目录增量分析：逐个完成时发送进度通知，最终返回本次分析结果与汇总"""
+        directory = arguments.get("directory")
+        prompt = arguments.get("prompt")
+        patterns = arguments.get("patterns") or None
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        
+        params = {
+            "directory": directory,
+            "prompt": prompt,
+            "patterns": patterns
+        }
+        
+        validation_error = validate_required_params(arguments, ["directory", "prompt"])
+        if not validation_error and not os.path.isdir(directory):
+            validation_error = f"目录不存在: {directory}"
+        if not validation_error and patterns is not None and not isinstance(patterns, list):
+            validation_error = "patterns 必须为字符串列表"
+        if not validation_error and not is_valid_temperature(temperature):
+            validation_error = f"温度参数必须在 0.0-2.0 之间，当前值: {temperature}"
+        if validation_error:
+            logger.log_tool_call("analyze_directory", params, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        
+        if not self.client:
+            error_msg = "智谱 AI 客户端未初始化"
+            logger.log_tool_call("analyze_directory", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        progress_token, session = self._get_progress_target()
+        # 分析在目录分析器自己的线程池中执行，不在请求上下文内，需显式传入会话以计入会话预算
+        request_session = self._get_current_session()
+        analyzer = DirectoryAnalyzer(
+            self.client,
+            workers=config.directory_workers,
+            checkpoint_interval=config.directory_checkpoint_interval,
+            analyze=lambda image_data_url, text, temp, tokens: self._call_glm(
+                image_data_url, text, temp, tokens, session=request_session
             )
+        )
+        records = analyzer.run(
+            directory, prompt, patterns=patterns, recursive=arguments.get("recursive", True),
+            temperature=temperature, max_tokens=max_tokens, retry_failed=arguments.get("retry_failed", False)
+        )
+        
+        results: List[Dict[str, Any]] = []
+        summary: Dict[str, Any] = {}
+        try:
+            # 生成器在工作线程中推进，避免阻塞事件循环
+            while True:
+                record = await asyncio.to_thread(next, records, None)
+                if record is None:
+                    break
+                if record.pop("type") == "summary":
+                    summary = record
+                    continue
+                results.append(record)
+                if progress_token is not None:
+                    await session.send_progress_notification(
+                        progress_token, len(results), message=record["path"]
+                    )
+        except Exception as e:
+            logger.log_exception(e, {"context": "Directory analysis"})
+            error_msg = f"目录分析失败: {str(e)}"
+            logger.log_tool_call("analyze_directory", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        finally:
+            try:
+                records.close()
+            except ValueError:
+                # 请求被取消时生成器可能仍在工作线程中执行，由其自行结束并保存清单
+                pass
+        
+        data: Dict[str, Any] = {"results": results, "summary": summary}
+        if arguments.get("include_unchanged", False):
+            analyzed = {record["path"] for record in results}
+            cached = await asyncio.to_thread(analyzer.get_cached_results, directory)
+            data["unchanged_results"] = [
+                {"path": path, "result": result} for path, result in cached.items() if path not in analyzed
+            ]
+        
+        logger.log_tool_call("analyze_directory", params, result=json.dumps(summary, ensure_ascii=False))
+        return self._to_text_content(create_success_response(data))
+    
+    async def _submit_analysis(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """提交异步任务"""
+        tool = arguments.get("tool") or "read_image"
+        tool_arguments = arguments.get("arguments")
+        params = {"tool": tool}
+        
+        validation_error = validate_required_params(arguments, ["arguments"])
+        if not validation_error and not isinstance(tool_arguments, dict):
+            validation_error = "arguments 必须为对象"
+        if not validation_error and tool not in ASYNC_JOB_TOOLS:
+            validation_error = f"不支持异步执行的工具: {tool}"
+        if validation_error:
+            logger.log_tool_call("submit_analysis", params, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        
+        if not self.job_store:
+            error_msg = "任务数据库不可用"
+            logger.log_tool_call("submit_analysis", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        job_id = await asyncio.to_thread(self.job_store.submit, tool, tool_arguments)
+        if self._job_event is not None:
+            self._job_event.set()
+        logger.log_tool_call("submit_analysis", params, result=job_id)
+        return self._to_text_content(create_success_response({"job_id": job_id, "status": STATUS_QUEUED}))
+    
+    async def _get_job_status(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """查询任务状态"""
+        job, error_response = await self._load_job("get_job_status", arguments)
+        if error_response:
+            return error_response
+        return self._to_text_content(create_success_response(self._job_summary(job)))
+    
+    async def _get_job_result(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """获取任务结果（未完成时只返回状态）"""
+        job, error_response = await self._load_job("get_job_result", arguments)
+        if error_response:
+            return error_response
+        data = self._job_summary(job)
+        if job["result"] is not None:
+            data["result"] = json.loads(job["result"])
+        return self._to_text_content(create_success_response(data))
+    
+    async def _load_job(self, tool: str, arguments: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[List[types.TextContent]]]:
+        """按 job_id 读取任务，返回 (任务, 错误响应)"""
+        params = {"job_id": arguments.get("job_id")}
+        validation_error = validate_required_params(arguments, ["job_id"])
+        if validation_error:
+            logger.log_tool_call(tool, params, error=validation_error)
+            return None, self._to_text_content(create_validation_error_response(validation_error))
+        if not self.job_store:
+            return None, self._to_text_content(create_error_response("任务数据库不可用"))
+        
+        job = await asyncio.to_thread(self.job_store.get, arguments["job_id"])
+        if job is None:
+            error_msg = f"任务不存在或结果已过期: {arguments['job_id']}"
+            logger.log_tool_call(tool, params, error=error_msg)
+            return None, self._to_text_content(create_error_response(error_msg))
+        return job, None
+    
+    @staticmethod
+    def _job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+        """任务状态摘要"""
+        summary = {
+            "job_id": job["id"],
+            "tool": job["tool"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "expires_at": job["expires_at"]
+        }
+        if "queue_position" in job:
+            summary["queue_position"] = job["queue_position"]
+        if job["error"]:
+            summary["error"] = job["error"]
+        return summary
+    
+    def _start_job_workers(self):
+        """在当前事件循环中启动任务工作协程"""
+        if not self.job_store or self._job_workers:
+            return
+        self._job_event = asyncio.Event()
+        self._job_workers = [
+            asyncio.create_task(self._job_worker(index)) for index in range(config.job_workers)
+        ]
+        logger.info(f"异步任务工作协程已启动: {config.job_workers} 个")
+    
+    async def _stop_job_workers(self):
+        """停止工作协程；执行中的任务保持 running 状态，重启后重新排队"""
+        for task in self._job_workers:
+            task.cancel()
+        await asyncio.gather(*self._job_workers, return_exceptions=True)
+        self._job_workers = []
+    
+    async def _job_worker(self, index: int):
+        """循环领取并执行排队任务，队列为空时等待新提交或定期轮询"""
+        while True:
+            try:
+                job = await asyncio.to_thread(self.job_store.claim_next)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
             
-            result = response.choices[0].message.content
-            logger.info("图像分析成功完成")
-            logger.debug("分析结果", **{"result_length": len(result)})
+            if job is None:
+                if index == 0:
+                    await asyncio.to_thread(self.job_store.purge_expired)
+                self._job_event.clear()
+                try:
+                    await asyncio.wait_for(self._job_event.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            job_id, tool, tool_arguments = job
+            logger.info(f"开始执行异步任务: {job_id} | {tool}")
+            self._running_jobs += 1
+            try:
+                content = await self._tool_handlers[tool](tool_arguments)
+                response = json.loads(content[0].text)
+                if response.get("success", True):
+                    await asyncio.to_thread(self.job_store.complete, job_id, content[0].text)
+                    logger.info(f"异步任务完成: {job_id}")
+                else:
+                    # 工具以错误响应返回（参数校验、模型调用失败等）时任务记为失败
+                    error = response.get("error") or "工具执行失败"
+                    await asyncio.to_thread(self.job_store.complete, job_id, None, error)
+                    logger.warning(f"异步任务失败: {job_id} | {error}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.log_exception(e, {"context": "Async job", "job_id": job_id})
+                await asyncio.to_thread(self.job_store.complete, job_id, None, str(e))
+            finally:
+                self._running_jobs -= 1
+    
+    async def _get_usage_stats(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """返回令牌用量统计"""
+        stats = await asyncio.to_thread(self.usage_meter.get_stats, self._get_current_session())
+        stats["payload"] = image_processor.get_slim_stats()
+        return self._to_text_content(create_success_response(stats))
+    
+    async def _open_image(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """预处理图像并创建会话句柄"""
+        params = {
+            "image_path": arguments.get("image_path"),
+            "image_base64_length": len(arguments.get("image_base64") or ""),
+            "image_url": arguments.get("image_url"),
+            "crop": arguments.get("crop")
+        }
+        try:
+            image_data_url, image_info, error_msg = await asyncio.to_thread(self._resolve_image_source, arguments)
+            if error_msg:
+                logger.log_tool_call("open_image", params, error=error_msg)
+                return self._to_text_content(create_error_response(error_msg))
+            
+            session = self.image_sessions.open(image_data_url, image_info)
+            logger.info(f"图像会话已创建: {session.handle}", **{"data_url_length": len(image_data_url)})
+            response = create_success_response(session.to_dict(self.image_sessions.ttl))
+            logger.log_tool_call("open_image", params, result=session.handle)
+            return self._to_text_content(response)
+        except Exception as e:
+            logger.log_exception(e, {"context": "Opening image session"})
+            error_msg = f"图像预处理失败: {str(e)}"
+            logger.log_tool_call("open_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    async def _ask_image(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """针对已打开的图像提问，携带此前问答作为上下文"""
+        handle = arguments.get("handle")
+        prompt = arguments.get("prompt")
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        use_history = arguments.get("use_history", True)
+        params = {"handle": handle, "prompt": prompt, "use_history": use_history}
+        
+        validation_error = validate_required_params(arguments, ["handle", "prompt"])
+        if not validation_error and not is_valid_temperature(temperature):
+            validation_error = f"温度参数必须在 0.0-2.0 之间，当前值: {temperature}"
+        if validation_error:
+            logger.log_tool_call("ask_image", params, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        
+        if not self.client:
+            error_msg = "智谱 AI 客户端未初始化"
+            logger.log_tool_call("ask_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        session = self.image_sessions.get(handle)
+        if session is None:
+            error_msg = f"图像句柄不存在或已过期，请重新调用 open_image: {handle}"
+            logger.log_tool_call("ask_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        history = self.image_sessions.history(session) if use_history else []
+        try:
+            result = await asyncio.to_thread(
+                self._call_glm, session.image_data_url, prompt, temperature, max_tokens, history
+            )
+        except Exception as e:
+            logger.log_exception(e, {"context": "Image session question", "handle": handle})
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("ask_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        self.image_sessions.add_turn(session, prompt, result)
+        logger.log_tool_call("ask_image", params, result=result)
+        response = create_success_response(result)
+        response["handle"] = handle
+        response["context_turns"] = len(history)
+        return self._to_text_content(response)
+    
+    async def _close_image(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """关闭图像会话"""
+        handle = arguments.get("handle")
+        validation_error = validate_required_params(arguments, ["handle"])
+        if validation_error:
+            logger.log_tool_call("close_image", {"handle": handle}, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        closed = self.image_sessions.close(handle)
+        logger.log_tool_call("close_image", {"handle": handle}, result=str(closed))
+        return self._to_text_content(create_success_response({"handle": handle, "closed": closed}))
+    
+    async def _diff_images(self, arguments: Dict[str, Any]) -> List[types.TextContent]:
+        """截图差异：只上传变化区域的前后对照图与标注总览图"""
+        before_path = arguments.get("before_path")
+        after_path = arguments.get("after_path")
+        prompt = arguments.get("prompt") or "请逐一描述每个变化区域中发生了什么变化。"
+        temperature = arguments.get("temperature", 0.2)
+        max_tokens = arguments.get("max_tokens", 1000)
+        block_size = parse_int_param(arguments, "block_size", config.diff_block_size)
+        max_regions = parse_int_param(arguments, "max_regions", config.diff_max_regions)
+        params = {
+            "before_path": before_path,
+            "after_path": after_path,
+            "prompt": prompt,
+            "block_size": block_size,
+            "max_regions": max_regions
+        }
+        
+        validation_error = validate_required_params(arguments, ["before_path", "after_path"])
+        if not validation_error and not is_valid_temperature(temperature):
+            validation_error = f"温度参数必须在 0.0-2.0 之间，当前值: {temperature}"
+        if not validation_error and (block_size is None or max_regions is None or block_size < 1 or max_regions < 1):
+            validation_error = (
+                f"block_size 与 max_regions 必须为正整数，当前值: "
+                f"{arguments.get('block_size', block_size)}, {arguments.get('max_regions', max_regions)}"
+            )
+        if validation_error:
+            logger.log_tool_call("diff_images", params, error=validation_error)
+            return self._to_text_content(create_validation_error_response(validation_error))
+        
+        if not self.client:
+            error_msg = "智谱 AI 客户端未初始化"
+            logger.log_tool_call("diff_images", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        try:
+            diff = await asyncio.to_thread(
+                image_processor.diff_images, before_path, after_path, block_size, config.diff_tolerance, max_regions
+            )
+        except ValueError as e:
+            logger.log_tool_call("diff_images", params, error=str(e))
+            return self._to_text_content(create_validation_error_response(str(e)))
+        if diff is None:
+            error_msg = "图像读取或编码失败"
+            logger.log_tool_call("diff_images", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        regions = [{"region": number, "box": list(region["box"])} for number, region in enumerate(diff["regions"], start=1)]
+        summary = {
+            "regions": regions,
+            "changed_ratio": round(diff["changed_ratio"], 4),
+            "payload_bytes": diff["payload_bytes"],
+            "full_bytes": diff["full_bytes"]
+        }
+        if not regions:
+            logger.log_tool_call("diff_images", params, result="no changes")
+            response = create_success_response("两张图像没有可见差异。")
+            response.update(summary)
+            return self._to_text_content(response)
+        
+        layouts = {"side_by_side": "左为变化前、右为变化后", "stacked": "上为变化前、下为变化后"}
+        region_lines = "\n".join(
+            f"区域 {item['region']}（附图 {item['region'] + 1}，{layouts[region['layout']]}）：像素坐标 {item['box']}"
+            for item, region in zip(regions, diff["regions"])
+        )
+        diff_prompt = (
+            f"以下是同一界面两张 {diff['size'][0]}x{diff['size'][1]} 截图的差异。"
+            f"附图 1 为变化后截图的缩小总览，红框与编号标出了 {len(regions)} 个变化区域；"
+            f"其后每张附图是一个区域变化前后的原分辨率对照，中间以灰色分隔：\n{region_lines}\n"
+            f"区域以外的内容没有变化。\n\n问题：{prompt}"
+        )
+        images = [diff["context"]] + [region["base64"] for region in diff["regions"]]
+        try:
+            result = await asyncio.to_thread(
+                self._call_glm, images, diff_prompt, temperature, max_tokens, prompt_class=classify_prompt(prompt, "diff")
+            )
+        except Exception as e:
+            logger.log_exception(e, {"context": "Image diff", "before_path": before_path, "after_path": after_path})
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("diff_images", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+        
+        logger.log_tool_call("diff_images", params, result=result)
+        response = create_success_response(result)
+        response.update(summary)
+        return self._to_text_content(response)
+    
+    def _get_current_session(self) -> Optional[Any]:
+        """当前请求所属的 MCP 会话（异步任务等不在请求上下文中时返回 None）"""
+        try:
+            return self.server.request_context.session
+        except LookupError:
+            return None
+    
+    def _get_progress_target(self) -> Tuple[Optional[Union[str, int]], Any]:
+        """获取当前请求的进度令牌与会话（不在请求上下文中或客户端未提供令牌时返回 None）"""
+        try:
+            ctx = self.server.request_context
+        except LookupError:
+            return None, None
+        token = ctx.meta.progressToken if ctx.meta else None
+        return token, ctx.session
+    
+    async def _analyze_image_tiled(self, arguments: Dict[str, Any], params: Dict[str, Any]) -> List[types.TextContent]:
+        """分块模式：按原始分辨率切分重叠分块，并发分析后汇总"""
+        image_path = arguments.get("image_path")
+        prompt = arguments["prompt"]
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        
+        if not image_path:
+            error_msg = "分块模式仅支持 image_path"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        
+        tile_size = parse_int_param(arguments, "tile_size", config.tile_size)
+        overlap = parse_int_param(arguments, "tile_overlap", config.tile_overlap)
+        if tile_size is None or overlap is None or tile_size < 64 or not 0 <= overlap < tile_size:
+            error_msg = f"分块参数无效: tile_size={arguments.get('tile_size', tile_size)}, tile_overlap={arguments.get('tile_overlap', overlap)}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        
+        try:
+            tiled = await asyncio.to_thread(
+                image_processor.create_tiles, image_path, tile_size, overlap,
+                max_file_size=config.tile_max_file_size
+            )
+            if not tiled:
+                error_msg = f"图像文件不存在、格式不支持或分块失败: {image_path}"
+                logger.log_tool_call("read_image", params, error=error_msg)
+                return self._to_text_content(create_error_response(error_msg))
+            
+            tiles = tiled['tiles']
+            columns, rows = tiled['grid']
+            width, height = tiled['size']
+            logger.info(f"分块分析: {image_path} | {width}x{height} | {columns}x{rows} 块 | 并发 {config.tile_parallelism}")
+            
+            if len(tiles) == 1:
+                result = await asyncio.to_thread(self._call_glm, tiles[0]['base64'], prompt, temperature, max_tokens)
+                logger.log_tool_call("read_image", params, result=result)
+                return self._to_text_content(create_success_response(result))
+            
+            semaphore = asyncio.Semaphore(config.tile_parallelism)
+            
+            async def analyze_tile(tile: Dict[str, Any]) -> str:
+                row, column = divmod(tile['index'], columns)
+                tile_prompt = (
+                    f"这是一张 {width}x{height} 大图按 {rows} 行 {columns} 列切分后的第 {row + 1} 行第 {column + 1} 列分块"
+                    f"（像素区域 {tile['box']}，相邻分块有 {overlap} 像素重叠）。"
+                    f"请仅根据该分块的内容回答：{prompt}\n若该分块与问题无关，请简要说明。"
+                )
+                async with semaphore:
+                    return await asyncio.to_thread(
+                        self._call_glm, tile['base64'], tile_prompt, temperature, max_tokens,
+                        prompt_class=classify_prompt(prompt, "tile")
+                    )
+            
+            tile_results = await asyncio.gather(*(analyze_tile(tile) for tile in tiles), return_exceptions=True)
+            failures = [r for r in tile_results if isinstance(r, Exception)]
+            if len(failures) == len(tiles):
+                raise failures[0]
+            
+            # 汇总：总览图 + 各分块回答
+            sections = []
+            for tile, tile_result in zip(tiles, tile_results):
+                row, column = divmod(tile['index'], columns)
+                answer = f"（分析失败: {tile_result}）" if isinstance(tile_result, Exception) else tile_result
+                sections.append(f"[第 {row + 1} 行第 {column + 1} 列，区域 {tile['box']}]\n{answer}")
+            summary_prompt = (
+                f"附图是整张图像的缩略总览。该图已按原始分辨率切分为 {len(tiles)} 个重叠分块分别分析，各分块的回答如下：\n\n"
+                + "\n\n".join(sections)
+                + f"\n\n请综合总览图和以上分块回答，去除重叠区域造成的重复内容，完整回答原问题：{prompt}"
+            )
+            result = await asyncio.to_thread(
+                self._call_glm, tiled['overview'], summary_prompt, temperature, max_tokens,
+                prompt_class=classify_prompt(prompt, "tiles")
+            )
+            
+            logger.info(f"分块分析完成: {len(tiles)} 块，失败 {len(failures)} 块")
             logger.log_tool_call("read_image", params, result=result)
+            response = create_success_response(result)
+            response["tiles"] = len(tiles)
+            response["failed_tiles"] = len(failures)
+            return self._to_text_content(response)
+            
+        except Exception as e:
+            logger.log_exception(e, {
+                "context": "Tiled image analysis",
+                "image_path": image_path,
+                "prompt": prompt
+            })
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    async def _analyze_image_zoom(self, arguments: Dict[str, Any], params: Dict[str, Any]) -> List[types.TextContent]:
+        """缩放模式：先发送低分辨率总览，模型请求细节时从图像金字塔裁剪高分辨率区域"""
+        image_path = arguments.get("image_path")
+        prompt = arguments["prompt"]
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        
+        if not image_path:
+            error_msg = "缩放模式仅支持 image_path"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        
+        try:
+            overview = await asyncio.to_thread(
+                image_processor.encode_pyramid_region, image_path, None, config.zoom_overview_size
+            )
+            if not overview:
+                error_msg = f"图像文件不存在或格式不支持: {image_path}"
+                logger.log_tool_call("read_image", params, error=error_msg)
+                return self._to_text_content(create_error_response(error_msg))
+            
+            width, height = overview['box'][2], overview['box'][3]
+            zoom_instruction = (
+                f"如果需要查看更多细节才能准确回答，请不要作答，只输出 JSON："
+                f'{{"zoom": [[x0, y0, x1, y1], ...]}}，坐标为相对整张原图的 0-1 比例，最多 {config.zoom_max_regions} 个区域。'
+            )
+            round_prompt = (
+                f"附图是一张 {width}x{height} 图像的低分辨率总览。如果总览已足够回答，请直接回答。"
+                f"{zoom_instruction}\n\n问题：{prompt}"
+            )
+            
+            images = [overview['base64']]
+            zoom_regions: List[List[int]] = []
+            uploaded_bytes = overview['compressed_size']
+            zoom_class = classify_prompt(prompt, "zoom")
+            result = await asyncio.to_thread(
+                self._call_glm, images, round_prompt, temperature, max_tokens, prompt_class=zoom_class
+            )
+            
+            for round_index in range(config.zoom_max_rounds):
+                regions = self._parse_zoom_regions(result)
+                if not regions:
+                    break
+                
+                crops = []
+                for region in regions:
+                    crop = await asyncio.to_thread(
+                        image_processor.encode_pyramid_region, image_path, region, config.zoom_detail_size
+                    )
+                    if crop:
+                        crops.append(crop)
+                if not crops:
+                    break
+                
+                images.extend(crop['base64'] for crop in crops)
+                zoom_regions.extend(list(crop['box']) for crop in crops)
+                uploaded_bytes += sum(crop['compressed_size'] for crop in crops)
+                
+                descriptions = "\n".join(
+                    f"第 {i} 张图：原图像素区域 {box} 的高分辨率局部"
+                    for i, box in enumerate(zoom_regions, start=2)
+                )
+                last_round = round_index == config.zoom_max_rounds - 1
+                round_prompt = (
+                    f"第 1 张图是一张 {width}x{height} 图像的低分辨率总览，之后为按需裁剪的局部：\n{descriptions}\n"
+                    + ("请结合以上图像直接回答，不要再请求缩放。" if last_round else f"请结合以上图像回答。{zoom_instruction}")
+                    + f"\n\n问题：{prompt}"
+                )
+                logger.info(f"缩放模式第 {round_index + 1} 轮: 追加 {len(crops)} 个局部区域")
+                result = await asyncio.to_thread(
+                    self._call_glm, images, round_prompt, temperature, max_tokens, prompt_class=zoom_class
+                )
             
-            return [types.TextContent(type="text", text=json.dumps(create_success_response(result), ensure_ascii=False))]
+            logger.info(f"缩放模式完成: 局部区域 {len(zoom_regions)} 个，上传 {uploaded_bytes} 字节")
+            logger.log_tool_call("read_image", params, result=result)
+            response = create_success_response(result)
+            response["zoom_regions"] = zoom_regions
+            response["uploaded_bytes"] = uploaded_bytes
+            return self._to_text_content(response)
             
         except Exception as e:
             logger.log_exception(e, {
-                "context": "Image analysis",
+                "context": "Zoom image analysis",
                 "image_path": image_path,
                 "prompt": prompt
             })
             error_msg = f"图像分析失败: {str(e)}"
             logger.log_tool_call("read_image", params, error=error_msg)
-            return [types.TextContent(type="text", text=json.dumps(create_error_response(error_msg), ensure_ascii=False))]
+            return self._to_text_content(create_error_response(error_msg))
     
-    async def run_async(self):
-        """异步运行 MCP 服务器"""
+    async def _analyze_image_frames(self, arguments: Dict[str, Any], params: Dict[str, Any]) -> List[types.TextContent]:
+        """关键帧模式：按场景变化抽取动画关键帧，以多图请求或网格图一次性分析"""
+        image_path = arguments.get("image_path")
+        prompt = arguments["prompt"]
+        temperature = arguments.get("temperature", 0.8)
+        max_tokens = arguments.get("max_tokens", 1000)
+        max_frames = parse_int_param(arguments, "max_frames", config.frame_samples)
+        layout = arguments.get("frames_layout") or config.frames_layout
+        
+        if not image_path:
+            error_msg = "关键帧模式仅支持 image_path"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        if layout not in ("multi", "sheet") or max_frames is None or max_frames < 1:
+            error_msg = f"关键帧参数无效: max_frames={arguments.get('max_frames', max_frames)}, frames_layout={layout}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_validation_error_response(error_msg))
+        
+        try:
+            sampled = await asyncio.to_thread(
+                image_processor.sample_keyframes, image_path, max_frames, config.frame_min_distance
+            )
+            if not sampled or not sampled['keyframes']:
+                error_msg = f"图像文件不存在、格式不支持或无法抽取关键帧: {image_path}"
+                logger.log_tool_call("read_image", params, error=error_msg)
+                return self._to_text_content(create_error_response(error_msg))
+            
+            keyframes = sampled['keyframes']
+            indices = [frame['index'] for frame in keyframes]
+            header = f"该动画共 {sampled['total_frames']} 帧，按场景变化按时间顺序抽取了 {len(keyframes)} 个关键帧"
+            
+            if layout == "sheet":
+                sheet = await asyncio.to_thread(
+                    image_processor.create_contact_sheet,
+                    [frame['image'] for frame in keyframes],
+                    [str(position + 1) for position in range(len(keyframes))]
+                )
+                if not sheet:
+                    raise RuntimeError("关键帧网格图生成失败")
+                images = [sheet['base64']]
+                frame_prompt = (
+                    f"{header}，拼接为一张网格图（从左到右、从上到下排列，左上角编号 1-{len(keyframes)}，"
+                    f"分别对应原动画第 {', '.join(str(i + 1) for i in indices)} 帧）。\n\n问题：{prompt}"
+                )
+            else:
+                images = [image_processor.encode_image(frame['image']) for frame in keyframes]
+                if not all(images):
+                    raise RuntimeError("关键帧编码失败")
+                frame_prompt = (
+                    f"{header}，附图按时间顺序分别对应原动画第 {', '.join(str(i + 1) for i in indices)} 帧。"
+                    f"\n\n问题：{prompt}"
+                )
+            
+            result = await asyncio.to_thread(
+                self._call_glm, images, frame_prompt, temperature, max_tokens, prompt_class=classify_prompt(prompt, "frames")
+            )
+            
+            logger.info(f"关键帧分析完成: {len(keyframes)} 帧 ({layout})")
+            logger.log_tool_call("read_image", params, result=result)
+            response = create_success_response(result)
+            response["keyframes"] = indices
+            response["total_frames"] = sampled['total_frames']
+            return self._to_text_content(response)
+            
+        except Exception as e:
+            logger.log_exception(e, {
+                "context": "Keyframe image analysis",
+                "image_path": image_path,
+                "prompt": prompt
+            })
+            error_msg = f"图像分析失败: {str(e)}"
+            logger.log_tool_call("read_image", params, error=error_msg)
+            return self._to_text_content(create_error_response(error_msg))
+    
+    @staticmethod
+    def _parse_zoom_regions(text: str) -> List[Tuple[float, float, float, float]]:
+        """解析模型回复中的缩放请求，返回规范化后的比例坐标区域"""
+        data = extract_json_block(text)
+        if not isinstance(data, dict) or not isinstance(data.get("zoom"), list):
+            return []
+        
+        regions = []
+        for item in data["zoom"][:config.zoom_max_regions]:
+            if not isinstance(item, (list, tuple)) or len(item) != 4:
+                continue
+            try:
+                x0, y0, x1, y1 = (min(max(float(v), 0.0), 1.0) for v in item)
+            except (TypeError, ValueError):
+                continue
+            if x1 - x0 > 0.01 and y1 - y0 > 0.01:
+                regions.append((x0, y0, x1, y1))
+        return regions
+    
+    def _compute_image_hash(self, image_data_url: str, image_info: Dict[str, Any]) -> Optional[int]:
+        """为本地或内联图像计算感知哈希（未启用缓存或图像为 URL 时返回 None）"""
+        if self.near_duplicate_cache is None:
+            return None
+        source = image_info.get('source')
+        if source == 'path' and not image_info.get('crop_box'):
+            payload = image_processor.get_file_payload(image_info['path'], with_hash=True)
+            return payload['dhash'] if payload else compute_file_dhash(image_info['path'])
+        if source in ('path', 'base64'):
+            image = image_processor.decode_base64_to_image(image_data_url)
+            if image is None:
+                return None
+            with image:
+                return compute_dhash(image)
+        return None
+    
+    @staticmethod
+    def _result_cache_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        """结果缓存键：模型、提示与采样参数任一不同都不复用"""
+        return json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+    
+    @staticmethod
+    def _shared_result_key(image_hash: int, cache_key: str) -> str:
+        digest = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()[:16]
+        return f"result:{digest}:{image_hash:016x}"
+    
+    def _lookup_shared_result(self, image_hash: int, cache_key: str) -> Optional[Tuple[Any, int]]:
+        """在共享缓存中查找哈希完全相同的结果（其他工作进程写入），命中后同步到本进程索引"""
+        if self.shared_state is None or not config.shared_cache_ttl:
+            return None
+        try:
+            result = self.shared_state.get(self._shared_result_key(image_hash, cache_key))
+        except Exception as e:
+            logger.warning(f"读取共享结果缓存失败: {e}")
+            return None
+        if result is None:
+            return None
+        self.near_duplicate_cache.store(image_hash, cache_key, result)
+        return result, 0
+    
+    def _store_shared_result(self, image_hash: int, cache_key: str, result: Any):
+        if self.shared_state is None or not config.shared_cache_ttl:
+            return
+        try:
+            self.shared_state.set(self._shared_result_key(image_hash, cache_key), result, config.shared_cache_ttl)
+        except Exception as e:
+            logger.warning(f"写入共享结果缓存失败: {e}")
+    
+    def _call_glm(self, image_data_url: Union[str, List[str]], prompt: str, temperature: float, max_tokens: int,
+                  history: Optional[List[Tuple[str, str]]] = None, prompt_class: Optional[str] = None,
+                  session: Optional[Any] = None) -> str:
+        """
+        调用智谱 GLM 模型分析图像（image_data_url 可为单个 URL 或多图 URL 列表，history 为此前的问答轮次）
+
+        调用前检查令牌预算，并按同类提示的历史输出长度收缩 max_tokens；收缩后被截断时以原始上限重试一次。
+        prompt 由模板生成时应传入按模式归类的 prompt_class；在请求上下文之外的线程中调用时需显式传入 session
+        """
+        return self._call_glm_detailed(image_data_url, prompt, temperature, max_tokens, history, prompt_class, session)[0]
+    
+    def _call_glm_detailed(self, image_data_url: Union[str, List[str]], prompt: str, temperature: float, max_tokens: int,
+                           history: Optional[List[Tuple[str, str]]] = None, prompt_class: Optional[str] = None,
+                           session: Optional[Any] = None) -> Tuple[str, Dict[str, Any]]:
+        """同 _call_glm，返回 (回复, 用量信息)，用量信息含实际应答的模型"""
+        return self.usage_meter.metered_call(
+            lambda limit: self._call_glm_once(image_data_url, prompt, temperature, limit, history),
+            prompt_class or classify_prompt(prompt),
+            max_tokens,
+            session=session or self._get_current_session(),
+            adaptive=config.adaptive_max_tokens
+        )
+    
+    def _call_glm_once(self, image_data_url: Union[str, List[str]], prompt: str, temperature: float,
+                       max_tokens: int, history: Optional[List[Tuple[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
+        if config.rate_limit and self.shared_state is not None:
+            # 所有工作进程共享同一速率预算
+            self.shared_state.acquire("glm", config.rate_limit, config.rate_burst)
+        result, info = self.client.analyze_image_detailed(image_data_url, prompt, temperature, max_tokens, history)
+        logger.debug("令牌用量", **dict(info, max_tokens=max_tokens))
+        return result, info
+    
+    def _create_init_options(self):
+        """创建启用工具功能的初始化选项"""
+        init_options = self.server.create_initialization_options()
+        init_options.capabilities.tools = {"listChanged": True}
+        return init_options
+    
+    async def run_async(self, transport: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None,
+                        socket_path: Optional[str] = None):
+        """异步运行 MCP 服务器（transport 为 stdio、http 或 unix，默认取 GLM_TRANSPORT）"""
+        transport = transport or config.transport
         try:
             logger.info("启动 GLM MCP 服务器")
             logger.info("服务器信息", **{
                 "version": "1.0.0",
                 "name": "glm-mcp",
+                "transport": transport,
                 "python_version": sys.version,
                 "platform": sys.platform
             })
 
-            from mcp.server.stdio import stdio_server
-            logger.info("服务器正在运行，等待工具调用...")
-
-            async with stdio_server() as (read_stream, write_stream):
-                # 创建启用工具功能的初始化选项
-                init_options = self.server.create_initialization_options()
-                init_options.capabilities.tools = {"listChanged": True}
-
-                await self.server.run(
-                    read_stream,
-                    write_stream,
-                    init_options
-                )
+            if transport == "http":
+                await self._run_http(host or config.http_host, port or config.http_port)
+            elif transport == "unix":
+                await self.serve_unix_socket(socket_path or config.daemon_socket, config.daemon_idle_timeout)
+            else:
+                await self._run_stdio()
 
         except KeyboardInterrupt:
             logger.info("服务器被用户中断")
@@ -299,10 +1701,239 @@ class GLMMcpServer:
             logger.error(f"服务器运行失败: {e}")
             raise
     
-    def run(self):
+    async def _run_stdio(self):
+        """通过标准输入输出为单个客户端提供服务"""
+        from mcp.server.stdio import stdio_server
+        logger.info("服务器正在运行，等待工具调用...")
+
+        self._start_job_workers()
+        try:
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self._create_init_options()
+                )
+        finally:
+            await self._stop_job_workers()
+    
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def _socket_session_streams(conn):
+        """将套接字连接包装为 MCP 会话流（按行分隔的 JSON-RPC，与 stdio 传输一致）"""
+        import anyio
+        import anyio.lowlevel
+        from mcp.shared.message import SessionMessage
+        
+        read_stream_writer, read_stream = anyio.create_memory_object_stream(0)
+        write_stream, write_stream_reader = anyio.create_memory_object_stream(0)
+        
+        async def socket_reader():
+            buffer = b""
+            try:
+                async with read_stream_writer:
+                    while True:
+                        try:
+                            chunk = await conn.receive(65536)
+                        except (anyio.EndOfStream, anyio.BrokenResourceError):
+                            break
+                        buffer += chunk
+                        *lines, buffer = buffer.split(b"\n")
+                        for line in lines:
+                            if not line.strip():
+                                continue
+                            try:
+                                message = types.JSONRPCMessage.model_validate_json(line)
+                            except Exception as exc:
+                                await read_stream_writer.send(exc)
+                                continue
+                            await read_stream_writer.send(SessionMessage(message))
+            except anyio.ClosedResourceError:
+                await anyio.lowlevel.checkpoint()
+        
+        async def socket_writer():
+            try:
+                async with write_stream_reader:
+                    async for session_message in write_stream_reader:
+                        data = session_message.message.model_dump_json(by_alias=True, exclude_none=True)
+                        await conn.send(data.encode("utf-8") + b"\n")
+            except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+                await anyio.lowlevel.checkpoint()
+        
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(socket_reader)
+            tg.start_soon(socket_writer)
+            yield read_stream, write_stream
+    
+    async def serve_unix_socket(self, path: str, idle_timeout: int = 600):
+        """
+        常驻守护进程模式：在 Unix 域套接字上接受 stdio 转发器的连接，每个连接为一个独立 MCP 会话
+
+        所有会话共享缓存、连接池和任务队列；没有活动连接和执行中任务超过 idle_timeout 秒后自动退出
+        """
+        import time
+        import socket
+        import anyio
+        from stdio_shim import ensure_private_dir, verify_socket_owner
+        
+        ensure_private_dir(path)
+        verify_socket_owner(path)
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                logger.info(f"守护进程已在运行，退出: {path}")
+                return
+            except OSError:
+                # 上次异常退出残留的套接字文件
+                os.unlink(path)
+            finally:
+                probe.close()
+        
+        # 在受限 umask 下创建套接字文件，避免创建与 chmod 之间的窗口期被其他用户连接
+        previous_umask = os.umask(0o077)
+        try:
+            listener = await anyio.create_unix_listener(path)
+        finally:
+            os.umask(previous_umask)
+        self._require_absolute_paths = True
+        state = {"active": 0, "last_activity": time.monotonic()}
+        
+        async def handle_connection(conn):
+            state["active"] += 1
+            logger.info(f"守护进程会话已连接，当前 {state['active']} 个")
+            try:
+                async with conn, self._socket_session_streams(conn) as (read_stream, write_stream):
+                    await self.server.run(read_stream, write_stream, self._create_init_options())
+            except Exception as e:
+                logger.log_exception(e, {"context": "Daemon session"})
+            finally:
+                state["active"] -= 1
+                state["last_activity"] = time.monotonic()
+                logger.info(f"守护进程会话已断开，剩余 {state['active']} 个")
+        
+        async def idle_watch(cancel_scope):
+            while True:
+                await anyio.sleep(min(5, idle_timeout))
+                if state["active"] or self._running_jobs:
+                    state["last_activity"] = time.monotonic()
+                elif time.monotonic() - state["last_activity"] >= idle_timeout:
+                    logger.info(f"守护进程空闲超过 {idle_timeout} 秒，正在退出")
+                    cancel_scope.cancel()
+                    return
+        
+        logger.info(f"守护进程正在监听: {path}")
+        self._start_job_workers()
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(listener.serve, handle_connection)
+                if idle_timeout > 0:
+                    tg.start_soon(idle_watch, tg.cancel_scope)
+        finally:
+            await self._stop_job_workers()
+            await listener.aclose()
+            if os.path.exists(path):
+                os.unlink(path)
+    
+    def build_http_app(self, stateless: bool = False):
+        """
+        构建 HTTP 应用：/mcp 为 Streamable HTTP 端点，/sse 与 /messages/ 为旧版 SSE 端点，/health 返回运行状态
+
+        所有会话共享同一服务器实例，因此缓存、连接池和任务队列在客户端之间复用。
+        stateless 为 True 时（多个工作进程共享监听套接字），同一客户端的后续请求可能落到其他进程，
+        因此 /mcp 不保存会话、直接返回 JSON 响应，依赖进程内会话状态的 /sse 端点被拒绝
+        """
+        from starlette.applications import Starlette
+        from starlette.responses import JSONResponse, Response
+        from starlette.routing import Mount, Route
+        from mcp.server.sse import SseServerTransport
+        from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+        
+        session_manager = StreamableHTTPSessionManager(app=self.server, json_response=stateless, stateless=stateless)
+        sse_transport = SseServerTransport("/messages/")
+        
+        class StreamableHTTPEndpoint:
+            """将 /mcp 请求直接交给会话管理器（ASGI 端点）"""
+            async def __call__(self, scope, receive, send):
+                await session_manager.handle_request(scope, receive, send)
+        
+        async def handle_sse(request):
+            async with sse_transport.connect_sse(request.scope, request.receive, request._send) as (read_stream, write_stream):
+                await self.server.run(read_stream, write_stream, self._create_init_options())
+            return Response()
+        
+        async def handle_health(request):
+            return JSONResponse({
+                "status": "ok",
+                "model": config.glm_image_model,
+                "client_ready": self.client is not None,
+                "keys": self.client.get_stats() if self.client else None,
+                "models": self.client.get_model_stats() if self.client else None,
+                "usage": await asyncio.to_thread(self.usage_meter.get_stats),
+                "jobs": await asyncio.to_thread(self.job_store.get_stats) if self.job_store else None,
+                "image_sessions": self.image_sessions.get_stats(),
+                "payload": image_processor.get_slim_stats(),
+                "payload_cache": image_processor.payload_cache.get_stats(),
+                "prewarm": self.prewarmer.get_stats() if self.prewarmer else None
+            })
+        
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            async with session_manager.run():
+                self._start_job_workers()
+                logger.info("HTTP 服务器已就绪")
+                try:
+                    yield
+                finally:
+                    logger.info("HTTP 服务器正在关闭...")
+                    await self._stop_job_workers()
+        
+        async def handle_sse_unsupported(request):
+            return JSONResponse({"error": "多进程模式不支持 SSE 端点，请使用 /mcp"}, status_code=501)
+        
+        routes = [Route("/mcp", endpoint=StreamableHTTPEndpoint()), Route("/health", endpoint=handle_health)]
+        if stateless:
+            routes.append(Route("/sse", endpoint=handle_sse_unsupported))
+        else:
+            routes += [Route("/sse", endpoint=handle_sse), Mount("/messages/", app=sse_transport.handle_post_message)]
+        return Starlette(routes=routes, lifespan=lifespan)
+    
+    async def _run_http(self, host: str, port: int):
+        """通过 HTTP 为多个客户端提供服务，收到 SIGINT/SIGTERM 时等待进行中的请求完成后退出"""
+        import uvicorn
+        
+        uvicorn_config = uvicorn.Config(
+            self.build_http_app(),
+            host=host,
+            port=port,
+            log_level="warning",
+            timeout_graceful_shutdown=config.http_shutdown_timeout
+        )
+        logger.info(f"HTTP 服务器正在监听: http://{host}:{port}/mcp")
+        await uvicorn.Server(uvicorn_config).serve()
+    
+    async def serve_http_socket(self, sock, limit_max_requests: Optional[int] = None, stateless: bool = False):
+        """
+        在已绑定的监听套接字上提供 HTTP 服务（供多进程监督器的工作进程使用），处理 limit_max_requests 个请求后退出
+
+        多个工作进程共享套接字时应传入 stateless=True，见 build_http_app
+        """
+        import uvicorn
+        
+        uvicorn_config = uvicorn.Config(
+            self.build_http_app(stateless=stateless),
+            log_level="warning",
+            limit_max_requests=limit_max_requests,
+            timeout_graceful_shutdown=config.http_shutdown_timeout
+        )
+        logger.info(f"工作进程正在服务: pid={os.getpid()} max_requests={limit_max_requests}")
+        await uvicorn.Server(uvicorn_config).serve(sockets=[sock])
+    
+    def run(self, transport: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None,
+            socket_path: Optional[str] = None):
         """运行 MCP 服务器"""
         try:
-            asyncio.run(self.run_async())
+            asyncio.run(self.run_async(transport, host, port, socket_path))
         except KeyboardInterrupt:
             logger.info("服务器被用户中断")
             sys.exit(0)
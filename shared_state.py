@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+跨进程共享状态模块
+基于 SQLite 在同一主机的多个工作进程之间协调请求速率预算、分析结果缓存和用量计数
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Optional
+
+try:
+    from logger import logger
+    LOGGER_AVAILABLE = True
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+    LOGGER_AVAILABLE = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    next_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at);
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedState:
+    """SQLite 共享状态（每个进程各自打开连接，写操作以 BEGIN IMMEDIATE 串行化）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def reserve(self, name: str, rate: float, burst: int = 1) -> float:
+        """
+        从共享速率预算中预约一次请求，返回调用方需要等待的秒数
+
+        按 GCRA 记录下一次理论可用时间：每次预约推进 1/rate 秒，允许最多 burst 个请求同时放行
+        """
+        if rate <= 0:
+            return 0.0
+        interval = 1.0 / rate
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT next_time FROM rate_limits WHERE name = ?", (name,)).fetchone()
+                next_time = max(row[0] if row else now, now)
+                wait = max(next_time - now - (max(burst, 1) - 1) * interval, 0.0)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, next_time) VALUES (?, ?)",
+                    (name, next_time + interval)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self, name: str, rate: float, burst: int = 1):
+        """预约并等待到可以发出请求（阻塞当前线程）"""
+        wait = self.reserve(name, rate, burst)
+        if wait > 0:
+            time.sleep(wait)
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存值，不存在或已过期时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: int):
+        """写入缓存值"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+
+    def increment(self, key: str, amount: int, ttl: int) -> int:
+        """原子累加计数器并返回新值（计数器过期后从 0 重新开始）"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM counters WHERE key = ? AND expires_at < ?", (key, now))
+                self._conn.execute(
+                    "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                    (key, amount, now + ttl)
+                )
+                value = self._conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def get_counter(self, key: str) -> int:
+        """读取计数器，不存在或已过期时返回 0"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM counters WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def purge_expired(self) -> int:
+        """删除已过期的缓存条目与计数器"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            self._conn.execute("DELETE FROM counters WHERE expires_at < ?", (now,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
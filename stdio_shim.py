@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+stdio 转发器
+仅依赖标准库，启动后立即将标准输入输出的 MCP 消息转发到常驻守护进程（Unix 域套接字）；
+守护进程不存在时按需启动，并在空闲后自动退出。会话启动无需导入 mcp / zhipuai / PIL，
+缓存和 TLS 连接在会话之间保持
+
+用法（.mcp.json 中替换 main.py）: python stdio_shim.py
+"""
+
+import os
+import sys
+import stat
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 等待守护进程就绪的最长时间（秒），首次启动需要导入依赖
+STARTUP_TIMEOUT = 30.0
+
+
+def default_socket_path() -> str:
+    """
+    默认套接字路径（需与 config.daemon_socket 保持一致）
+
+    位于当前用户私有目录（$XDG_RUNTIME_DIR 或临时目录下的 glm-mcp-<uid>）中，其他用户无法访问
+    """
+    base = os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    default = os.path.join(base, f"glm-mcp-{getattr(os, 'getuid', lambda: 0)()}", "daemon.sock")
+    return os.getenv('GLM_DAEMON_SOCKET', default)
+
+
+def ensure_private_dir(path: str):
+    """
+    创建套接字所在目录（权限 0700）
+
+    目录为默认私有目录时校验属主与权限，防止其他用户预先创建同名目录或符号链接后劫持套接字
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.path.basename(directory) != f"glm-mcp-{os.getuid()}":
+        return
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"套接字目录不安全（应为当前用户所有且权限为 0700）: {directory}")
+
+
+def verify_socket_owner(path: str):
+    """已存在的套接字必须是当前用户创建的 Unix 套接字，否则可能是其他用户预先放置的伪造守护进程"""
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"套接字不属于当前用户或不是 Unix 套接字，拒绝连接: {path}")
+
+
+def connect(path: str):
+    """连接守护进程，失败时返回 None"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def start_daemon(path: str):
+    """
+    启动守护进程并等待套接字就绪
+
+    用文件锁避免多个会话同时启动时重复拉起守护进程
+    """
+    import fcntl
+
+    ensure_private_dir(path)
+    lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    with os.fdopen(lock_fd, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        verify_socket_owner(path)
+        sock = connect(path)
+        if sock:
+            return sock
+
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, "main.py"), "--transport", "unix", "--socket", path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        deadline = time.time() + STARTUP_TIMEOUT
+        while time.time() < deadline:
+            verify_socket_owner(path)
+            sock = connect(path)
+            if sock:
+                return sock
+            if process.poll() is not None:
+                sys.stderr.write(f"GLM MCP 守护进程启动失败（退出码 {process.returncode}），请查看 mcpserver.log\n")
+                return None
+            time.sleep(0.05)
+        sys.stderr.write("等待 GLM MCP 守护进程就绪超时\n")
+        return None
+
+
+def pump_stdin(sock: socket.socket):
+    """标准输入 -> 守护进程；输入结束时半关闭写端，让守护进程结束会话"""
+    stdin = sys.stdin.buffer
+    try:
+        while True:
+            data = stdin.read1(65536)
+            if not data:
+                break
+            sock.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def pump_socket(sock: socket.socket):
+    """守护进程 -> 标准输出"""
+    stdout = sys.stdout.buffer
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            stdout.write(data)
+            stdout.flush()
+    except OSError:
+        pass
+
+
+def main():
+    if not hasattr(socket, 'AF_UNIX') or os.name == 'nt':
+        # 不支持 Unix 域套接字的平台直接以 stdio 模式运行完整服务器
+        sys.exit(subprocess.call([sys.executable, os.path.join(SCRIPT_DIR, "main.py"), "--transport", "stdio"]))
+
+    path = default_socket_path()
+    try:
+        # 首次连接前即校验目录与套接字属主，避免把会话发给其他用户放置的套接字
+        ensure_private_dir(path)
+        verify_socket_owner(path)
+        sock = connect(path) or start_daemon(path)
+    except OSError as e:
+        sys.stderr.write(f"无法连接 GLM MCP 守护进程: {e}\n")
+        sys.exit(1)
+    if sock is None:
+        sys.exit(1)
+
+    threading.Thread(target=pump_stdin, args=(sock,), daemon=True).start()
+    pump_socket(sock)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+多进程 HTTP 服务监督模块
+预先创建监听套接字并 fork 多个工作进程共享，崩溃时重启、处理一定请求数后轮换，收到信号时优雅退出
+"""
+
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import asyncio
+from typing import Dict, List
+
+from config import config
+from logger import logger
+
+# 连续崩溃时重启等待的上限（秒）
+MAX_RESTART_DELAY = 30.0
+# 统计连续崩溃的时间窗口（秒）
+CRASH_WINDOW = 60.0
+
+
+class Supervisor:
+    """预派生工作进程监督器（仅支持提供 os.fork 的平台）"""
+
+    def __init__(self, workers: int, host: str, port: int, max_requests: int = 0, max_requests_jitter: int = 0):
+        self.workers = max(workers, 1)
+        self.host = host
+        self.port = port
+        self.max_requests = max(max_requests, 0)
+        self.max_requests_jitter = max(max_requests_jitter, 0)
+        self._children: Dict[int, int] = {}
+        self._crash_times: List[float] = []
+        # 等待重启的槽位 -> 重启时间点；退避期间监督循环继续回收其他进程、响应信号
+        self._pending_restarts: Dict[int, float] = {}
+        self._shutting_down = False
+
+    def _create_socket(self) -> socket.socket:
+        """创建由所有工作进程共享的监听套接字"""
+        sock = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, sock: socket.socket, slot: int):
+        """fork 一个工作进程"""
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os._exit(self._worker_main(sock, slot))
+        self._children[pid] = slot
+        logger.info(f"工作进程已启动: slot={slot} pid={pid}")
+
+    def _worker_main(self, sock: socket.socket, slot: int) -> int:
+        """工作进程入口：创建独立的服务器实例（连接、数据库句柄均在 fork 后建立）"""
+        try:
+            from server import GLMMcpServer
+
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter) if self.max_requests else None
+            server = GLMMcpServer(prewarm=self.workers == 1)
+            asyncio.run(server.serve_http_socket(sock, limit_max_requests=limit, stateless=self.workers > 1))
+            return 0
+        except KeyboardInterrupt:
+            return 0
+        except Exception as e:
+            logger.log_exception(e, {"context": "Worker process", "slot": slot})
+            return 1
+
+    def _restart_delay(self) -> float:
+        """按时间窗口内的崩溃次数指数退避，避免崩溃循环占满 CPU"""
+        now = time.time()
+        self._crash_times = [t for t in self._crash_times if now - t < CRASH_WINDOW]
+        self._crash_times.append(now)
+        return min(0.5 * 2 ** (len(self._crash_times) - 1), MAX_RESTART_DELAY)
+
+    def _handle_signal(self, signum, frame):
+        if not self._shutting_down:
+            logger.info(f"收到信号 {signum}，正在停止工作进程...")
+        self._shutting_down = True
+
+    def _reap(self, sock: socket.socket):
+        """回收已退出的工作进程：正常轮换立即补充，异常退出按退避时间登记待重启"""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self._children.pop(pid, None)
+            if slot is None or self._shutting_down:
+                continue
+
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code == 0:
+                logger.info(f"工作进程已轮换: slot={slot} pid={pid}")
+                self._spawn(sock, slot)
+            else:
+                delay = self._restart_delay()
+                logger.warning(f"工作进程异常退出: slot={slot} pid={pid} code={exit_code}，{delay:.1f}s 后重启")
+                self._pending_restarts[slot] = time.time() + delay
+
+    def _restart_due(self, sock: socket.socket):
+        """重启退避时间已到的槽位"""
+        now = time.time()
+        for slot, deadline in list(self._pending_restarts.items()):
+            if deadline <= now and not self._shutting_down:
+                del self._pending_restarts[slot]
+                self._spawn(sock, slot)
+
+    def _stop_children(self):
+        """通知工作进程优雅退出，超时后强制结束"""
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._children.pop(pid, None)
+
+        deadline = time.time() + config.http_shutdown_timeout + 5
+        while self._children and time.time() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self._children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self._children):
+            logger.warning(f"工作进程未能按时退出，强制结束: pid={pid}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self._children.clear()
+
+    def run(self):
+        """启动并监督工作进程，直到收到 SIGINT/SIGTERM"""
+        if not hasattr(os, 'fork'):
+            logger.warning("当前平台不支持 fork，改为单进程 HTTP 服务")
+            from server import GLMMcpServer
+            GLMMcpServer().run("http", self.host, self.port)
+            return
+
+        # 在父进程预先导入重量级模块，工作进程通过写时复制共享
+        import server  # noqa: F401
+
+        if self.workers > 1 and config.prewarm_dirs:
+            logger.warning("多进程模式下不启动预热目录监视（载荷缓存在进程内，不跨工作进程共享）")
+        sock = self._create_socket()
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        logger.info(f"监督进程已启动: pid={os.getpid()} workers={self.workers} http://{self.host}:{self.port}/mcp")
+
+        try:
+            for slot in range(self.workers):
+                self._spawn(sock, slot)
+            while not self._shutting_down:
+                self._reap(sock)
+                self._restart_due(sock)
+                time.sleep(0.5)
+        finally:
+            self._stop_children()
+            sock.close()
+            logger.info("监督进程已退出")
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="多进程 GLM MCP HTTP 服务")
+    parser.add_argument("--workers", type=int, default=config.http_workers, help="工作进程数")
+    parser.add_argument("--host", default=config.http_host, help="监听地址")
+    parser.add_argument("--port", type=int, default=config.http_port, help="监听端口")
+    parser.add_argument("--max-requests", type=int, default=config.worker_max_requests,
+                        help="工作进程处理多少个请求后轮换（0 表示不轮换）")
+    args = parser.parse_args()
+
+    if not config.validate_config():
+        logger.error("配置验证失败，请检查 GLM_API_KEY 等配置")
+        sys.exit(1)
+    Supervisor(
+        args.workers, args.host, args.port,
+        max_requests=args.max_requests,
+        max_requests_jitter=config.worker_max_requests_jitter
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
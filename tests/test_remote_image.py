@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+remote_image 测试：以本地 HTTP 服务替代远程图像主机，验证预检、白名单、重定向校验、非公网地址拦截与下载回退
+
+运行: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import struct
+import threading
+import unittest
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import httpx  # noqa: F401
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+from remote_image import RemoteImageFetcher, is_image_fetch_error
+
+
+def _make_png(width: int = 4, height: int = 3) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+    raw = b''.join(b'\x00' + b'\x00\x00\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+PNG = _make_png()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """模拟远程图像主机：/image.png 图像、/no-head.png 不支持 HEAD、/text 非图像、/redirect?to=... 重定向"""
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, head_only: bool):
+        path, _, query = self.path.partition('?')
+        if path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', query[len('to='):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path == '/no-head.png' and head_only:
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path in ('/image.png', '/no-head.png'):
+            body, content_type = PNG, 'image/png'
+        elif path == '/text':
+            body, content_type = b'hello', 'text/plain'
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._respond(head_only=True)
+
+    def do_GET(self):
+        self._respond(head_only=False)
+
+
+@unittest.skipUnless(HTTPX_AVAILABLE, "httpx 未安装")
+class RemoteImageFetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+        cls.port = cls.server.server_address[1]
+        cls.base = f"http://127.0.0.1:{cls.port}"
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def make_fetcher(self, **kwargs) -> RemoteImageFetcher:
+        kwargs.setdefault('allow_private', True)
+        fetcher = RemoteImageFetcher(timeout=5.0, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_probe_head(self):
+        ok, info = self.make_fetcher().probe(f"{self.base}/image.png")
+        self.assertTrue(ok, info)
+        self.assertEqual(info['content_type'], 'image/png')
+        self.assertEqual(info['file_size'], len(PNG))
+
+    def test_probe_falls_back_to_range_get(self):
+        ok, info = self.make_fetcher().probe(f"{self.base}/no-head.png")
+        self.assertTrue(ok, info)
+        self.assertEqual((info['width'], info['height']), (4, 3))
+
+    def test_probe_rejects_non_image(self):
+        ok, info = self.make_fetcher().probe(f"{self.base}/text")
+        self.assertFalse(ok)
+        self.assertIn('text/plain', info['error'])
+
+    def test_allowlist(self):
+        fetcher = self.make_fetcher(allowlist=['127.0.0.1'])
+        self.assertTrue(fetcher.is_allowed(f"{self.base}/image.png"))
+        self.assertFalse(fetcher.is_allowed(f"http://localhost:{self.port}/image.png"))
+        self.assertFalse(fetcher.is_allowed("ftp://127.0.0.1/image.png"))
+
+    def test_redirect_within_allowlist(self):
+        fetcher = self.make_fetcher(allowlist=['127.0.0.1'])
+        ok, info = fetcher.probe(f"{self.base}/redirect?to=/image.png")
+        self.assertTrue(ok, info)
+        self.assertEqual(info['final_url'], f"{self.base}/image.png")
+
+    def test_redirect_outside_allowlist_rejected(self):
+        fetcher = self.make_fetcher(allowlist=['127.0.0.1'])
+        target = f"http://localhost:{self.port}/image.png"
+        ok, info = fetcher.probe(f"{self.base}/redirect?to={target}")
+        self.assertFalse(ok)
+        self.assertIn('重定向目标不允许访问', info['error'])
+        self.assertIsNone(fetcher.fetch_as_data_url(f"{self.base}/redirect?to={target}"))
+
+    def test_private_address_rejected_by_default(self):
+        fetcher = self.make_fetcher(allow_private=False)
+        ok, info = fetcher.probe(f"{self.base}/image.png")
+        self.assertFalse(ok)
+        self.assertIn('内网', info['error'])
+        self.assertIsNone(fetcher.fetch_as_data_url(f"{self.base}/image.png"))
+
+    def test_fetch_as_data_url(self):
+        fetched = self.make_fetcher().fetch_as_data_url(f"{self.base}/redirect?to=/image.png")
+        self.assertIsNotNone(fetched)
+        self.assertTrue(fetched['base64'].startswith('data:image/png;base64,'))
+        self.assertEqual(fetched['original_info']['file_size'], len(PNG))
+
+    def test_fetch_size_limit(self):
+        self.assertIsNone(self.make_fetcher(max_bytes=10).fetch_as_data_url(f"{self.base}/image.png"))
+
+
+class ImageFetchErrorTest(unittest.TestCase):
+
+    @staticmethod
+    def make_error(status_code: int, message: str, name: str = 'APIRequestFailedError') -> Exception:
+        error_type = type(name, (Exception,), {})
+        error = error_type(message)
+        error.status_code = status_code
+        return error
+
+    def test_upstream_download_failure(self):
+        self.assertTrue(is_image_fetch_error(self.make_error(400, "图片下载失败，请检查 URL")))
+        self.assertTrue(is_image_fetch_error(self.make_error(400, "Failed to download image from url")))
+
+    def test_other_errors_do_not_fall_back(self):
+        self.assertFalse(is_image_fetch_error(self.make_error(429, "rate limit, url")))
+        self.assertFalse(is_image_fetch_error(self.make_error(401, "invalid api key")))
+        self.assertFalse(is_image_fetch_error(self.make_error(503, "download overloaded")))
+        self.assertFalse(is_image_fetch_error(self.make_error(400, "prompt too long")))
+        self.assertFalse(is_image_fetch_error(TimeoutError("fetch timed out")))
+        self.assertFalse(is_image_fetch_error(RuntimeError("今日令牌预算已用尽")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+令牌用量计量模块
+记录每次请求的提示、图像与输出令牌数，按提示类别的历史输出长度自动确定 max_tokens，
+并执行按会话和按天的令牌预算（仅依赖标准库，FastMCP 服务器也可直接使用）
+"""
+
+import math
+import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Any, Optional, Tuple
+
+try:
+    from logger import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+# 每个提示类别保留的最近输出长度样本数
+SAMPLE_SIZE = 50
+# 至少积累多少样本后才自动收缩 max_tokens
+MIN_SAMPLES = 5
+# 在 p95 输出长度基础上预留的余量倍数
+HEADROOM = 1.5
+# 自动收缩后的最小 max_tokens
+MIN_MAX_TOKENS = 64
+# 最多跟踪的提示类别数
+MAX_CLASSES = 1000
+
+
+class BudgetExceededError(RuntimeError):
+    """令牌预算已用尽"""
+
+
+def classify_prompt(prompt: str, mode: Optional[str] = None) -> str:
+    """
+    提示类别：规整空白与大小写后取哈希，相同问题的不同调用归为一类
+
+    分块、缩放、关键帧等模式由模板生成的提示含有坐标、帧号等逐次变化的内容，
+    调用方应传入用户原始问题与模式名，按 "模式:问题" 归类
+    """
+    normalized = ' '.join(prompt.lower().split())
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+    return f"{mode}:{digest}" if mode else digest
+
+
+def extract_usage(response: Any) -> Dict[str, Any]:
+    """从 SDK 响应中提取用量与结束原因（字段缺失时为 None）"""
+    usage = getattr(response, 'usage', None)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    choices = getattr(response, 'choices', None) or [None]
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+        'completion_tokens': getattr(usage, 'completion_tokens', None),
+        'total_tokens': getattr(usage, 'total_tokens', None),
+        'image_tokens': getattr(details, 'image_tokens', None) if details is not None else None,
+        'finish_reason': getattr(choices[0], 'finish_reason', None)
+    }
+
+
+class _ClassStats:
+    def __init__(self):
+        self.requests = 0
+        self.truncated = 0
+        self.completion_samples: deque = deque(maxlen=SAMPLE_SIZE)
+        # 最近 SAMPLE_SIZE 次请求是否被截断，与输出长度样本使用同一窗口
+        self.recent_truncated: deque = deque(maxlen=SAMPLE_SIZE)
+
+    def recent_truncation_rate(self) -> float:
+        if not self.recent_truncated:
+            return 0.0
+        return sum(self.recent_truncated) / len(self.recent_truncated)
+
+    def p95(self) -> Optional[int]:
+        if not self.completion_samples:
+            return None
+        ordered = sorted(self.completion_samples)
+        return ordered[min(int(math.ceil(len(ordered) * 0.95)) - 1, len(ordered) - 1)]
+
+
+class UsageMeter:
+    """令牌用量计量与预算（线程安全）"""
+
+    def __init__(self, session_budget: int = 0, daily_budget: int = 0, store: Optional[Any] = None):
+        """
+        Args:
+            session_budget: 每个会话的令牌上限，0 表示不限制
+            daily_budget: 每天（本地日期）的令牌上限，0 表示不限制
+            store: 可选的跨进程计数存储（提供 increment / get_counter），用于多进程共享每日用量
+        """
+        self.session_budget = session_budget
+        self.daily_budget = daily_budget
+        self.store = store
+        self._lock = threading.Lock()
+        self._classes: "OrderedDict[str, _ClassStats]" = OrderedDict()
+        self._models: Dict[str, Dict[str, int]] = {}
+        self._sessions: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+        self._default_session_tokens = 0
+        self._daily: Dict[str, int] = {}
+        self._totals = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'image_tokens': 0, 'total_tokens': 0}
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime('%Y-%m-%d')
+
+    def _session_tokens(self, session: Optional[Any]) -> int:
+        if session is None:
+            return self._default_session_tokens
+        return self._sessions.get(session, 0)
+
+    def get_daily_tokens(self) -> int:
+        today = self._today()
+        if self.store is not None:
+            return self.store.get_counter(f"usage:day:{today}")
+        with self._lock:
+            return self._daily.get(today, 0)
+
+    def check_budget(self, session: Optional[Any] = None):
+        """请求前检查预算，已用尽时抛出 BudgetExceededError"""
+        if self.session_budget:
+            with self._lock:
+                used = self._session_tokens(session)
+            if used >= self.session_budget:
+                raise BudgetExceededError(f"本会话令牌预算已用尽（已用 {used} / 上限 {self.session_budget}）")
+        if self.daily_budget:
+            used = self.get_daily_tokens()
+            if used >= self.daily_budget:
+                raise BudgetExceededError(f"今日令牌预算已用尽（已用 {used} / 上限 {self.daily_budget}），次日零点重置")
+
+    def suggest_max_tokens(self, prompt_class: str, requested: int) -> int:
+        """按该类别近期 p95 输出长度加余量确定 max_tokens，不超过调用方请求值"""
+        with self._lock:
+            stats = self._classes.get(prompt_class)
+            if stats is None or len(stats.completion_samples) < MIN_SAMPLES:
+                return requested
+            # 近期频繁触顶截断的类别不再收缩（按最近窗口计算，早期截断不会永久关闭收缩）
+            if stats.recent_truncation_rate() > 0.1:
+                return requested
+            suggested = max(int(stats.p95() * HEADROOM), MIN_MAX_TOKENS)
+        return min(requested, suggested)
+
+    def record(self, prompt_class: str, usage: Dict[str, Any], session: Optional[Any] = None,
+               model: Optional[str] = None, truncated: bool = False):
+        """记录一次请求的用量"""
+        total = usage.get('total_tokens') or 0
+        completion = usage.get('completion_tokens')
+        with self._lock:
+            stats = self._classes.pop(prompt_class, None) or _ClassStats()
+            self._classes[prompt_class] = stats
+            while len(self._classes) > MAX_CLASSES:
+                self._classes.popitem(last=False)
+            stats.requests += 1
+            stats.truncated += truncated
+            stats.recent_truncated.append(bool(truncated))
+            if completion is not None and not truncated:
+                stats.completion_samples.append(completion)
+
+            self._totals['requests'] += 1
+            for field in ('prompt_tokens', 'completion_tokens', 'image_tokens', 'total_tokens'):
+                self._totals[field] += usage.get(field) or 0
+            if model:
+                model_stats = self._models.setdefault(model, {'requests': 0, 'total_tokens': 0})
+                model_stats['requests'] += 1
+                model_stats['total_tokens'] += total
+
+            if session is None:
+                self._default_session_tokens += total
+            else:
+                self._sessions[session] = self._sessions.get(session, 0) + total
+            if self.store is None:
+                today = self._today()
+                self._daily = {today: self._daily.get(today, 0) + total}
+
+        if self.store is not None and total:
+            self.store.increment(f"usage:day:{self._today()}", total, ttl=2 * 86400)
+
+    def metered_call(self, analyze: Callable[[int], Tuple[str, Dict[str, Any]]], prompt_class: str, max_tokens: int,
+                     session: Optional[Any] = None, adaptive: bool = True) -> Tuple[str, Dict[str, Any]]:
+        """
+        经预算检查、自适应 max_tokens 与用量记录执行一次模型调用，analyze(max_tokens) 与本方法均返回 (回复, 用量)
+
+        收缩后的 max_tokens 导致截断时以原始上限重试一次，返回最后一次调用的结果
+        """
+        self.check_budget(session)
+        effective_max_tokens = self.suggest_max_tokens(prompt_class, max_tokens) if adaptive else max_tokens
+        result, info = analyze(effective_max_tokens)
+        truncated = info.get('finish_reason') == 'length'
+        self.record(prompt_class, info, session, info.get('model'), truncated)
+        if truncated and effective_max_tokens < max_tokens:
+            logger.info(f"自动收缩的 max_tokens={effective_max_tokens} 导致截断，以 {max_tokens} 重试")
+            result, info = analyze(max_tokens)
+            self.record(prompt_class, info, session, info.get('model'), info.get('finish_reason') == 'length')
+        return result, info
+
+    def get_stats(self, session: Optional[Any] = None) -> Dict[str, Any]:
+        """用量汇总"""
+        with self._lock:
+            classes = list(self._classes.items())[-20:]
+            stats = {
+                'totals': dict(self._totals),
+                'models': {model: dict(values) for model, values in self._models.items()},
+                'session_tokens': self._session_tokens(session),
+                'session_budget': self.session_budget or None,
+                'prompt_classes': {
+                    name: {
+                        'requests': item.requests,
+                        'truncated': item.truncated,
+                        'recent_truncation_rate': round(item.recent_truncation_rate(), 3),
+                        'p95_completion_tokens': item.p95()
+                    }
+                    for name, item in classes
+                }
+            }
+        stats['daily_tokens'] = self.get_daily_tokens()
+        stats['daily_budget'] = self.daily_budget or None
+        return stats
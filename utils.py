@@ -213,6 +213,35 @@ class JsonUtils:
                 logger.error(f"JSON解析失败: {e}")
             return default
     
+    @staticmethod
+    def extract_json_block(text: str, default: Any = None) -> Any:
+        """从模型回复中提取 JSON（兼容 ```json 代码块和前后说明文字）"""
+        if not text:
+            return default
+        candidate = text.strip()
+        if '```' in candidate:
+            parts = candidate.split('```')
+            if len(parts) >= 3:
+                candidate = parts[1]
+                if candidate.lstrip().lower().startswith('json'):
+                    candidate = candidate.lstrip()[4:]
+        candidate = candidate.strip()
+        
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+        
+        # 回退：截取第一个 { 或 [ 到最后一个 } 或 ]
+        starts = [i for i in (candidate.find('{'), candidate.find('[')) if i >= 0]
+        end = max(candidate.rfind('}'), candidate.rfind(']'))
+        if starts and end > min(starts):
+            try:
+                return json.loads(candidate[min(starts):end + 1])
+            except json.JSONDecodeError:
+                pass
+        return default
+    
     @staticmethod
     def safe_dumps(obj: Any, indent: int = 2) -> str:
         """安全地序列化对象为JSON字符串"""
@@ -368,6 +397,9 @@ def safe_loads(json_str: str, default: Any = None) -> Any:
 def safe_dumps(obj: Any, indent: int = 2) -> str:
     return json_utils.safe_dumps(obj, indent)
 
+def extract_json_block(text: str, default: Any = None) -> Any:
+    return json_utils.extract_json_block(text, default)
+
 def get_timestamp() -> int:
     return time_utils.get_timestamp()
 
@@ -421,6 +453,16 @@ def validate_required_params(params: Dict[str, Any], required_keys: List[str]) -
         return f"缺少必需参数: {', '.join(missing_keys)}"
     return None
 
+def parse_int_param(params: Dict[str, Any], key: str, default: int) -> Optional[int]:
+    """读取整数参数，未提供时返回默认值，无法转换为整数时返回 None"""
+    value = params.get(key)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 if __name__ == "__main__":
     # 测试工具函数
     print("=== 工具函数测试 ===")